@@ -8,6 +8,20 @@ import plotly
 import plotly.graph_objects as go
 from io import BytesIO
 
+from cache import cache_disco, cache_en_memoria, cache_memoria, calcular_con_puntos_control, obtener_cache
+from euribor import cargar_curva_descuento, cargar_euribor_historico, fechas_de_meses
+from importacion import PLANTILLA_CSV, leer_ofertas, validar_ofertas
+from motor import (
+    alinear_costes, amortizacion_anticipada, amortizar_o_invertir, backtest_fija_vs_mixta,
+    comparar_alternativas, cuadro_anual, eventos_anuales, cuota_asumible, cuota_francesa, curva_intereses_euribor,
+    escenarios_estres, estabilidad_ranking, estres_ofertas, euribor_equilibrio, factores_descuento, intereses_fija,
+    lote_ofertas, meses_cruce, normal_inversa, optimizar_bonificaciones, plazo_para_cuota, principal_maximo,
+    saldo_tras, simular_lote, tipo_maximo,
+)
+from paralelo import (
+    MIN_UNIDADES_PARADA, evaluar_ofertas, montecarlo_euribor, montecarlo_progresivo, simular_lote_paralelo,
+)
+
 
 st.set_page_config(page_title="Calculadora de Hipotecas", layout="centered")
 
@@ -26,18 +40,36 @@ pagina = st.sidebar.radio(
         "Comparador de Ofertas",
         "Bonificaciones",
         "Subrogación",
+        "Capacidad de Endeudamiento",
         "Glosario"
     )
 )
+with st.sidebar.expander("Caché de cálculos"):
+    est_mem = cache_en_memoria.estadisticas()
+    st.write(f"**Memoria:** {est_mem['bytes'] / 1024:,.1f} KB de {est_mem['max_bytes'] / 1024 ** 2:,.0f} MB "
+             f"({est_mem['entradas']} entradas, {est_mem['aciertos']} aciertos / {est_mem['fallos']} fallos)")
+    if est_mem["detalle"]:
+        st.dataframe(pd.DataFrame(est_mem["detalle"]), hide_index=True, use_container_width=True)
+    cache_disco_actual = obtener_cache()
+    if cache_disco_actual is not None:
+        est_disco = cache_disco_actual.estadisticas()
+        st.write(f"**Disco:** {est_disco['bytes'] / 1024 ** 2:,.1f} MB de {est_disco['max_bytes'] / 1024 ** 2:,.0f} MB "
+                 f"({est_disco['entradas']} entradas)")
 
 
 
 # =============================
 # FUNCIONES AUXILIARES
 # =============================
-@st.cache_data(show_spinner=False)
-def cuadro_amortizacion_fija(principal, years, r, cuota):
-    cuadro = []
+COLUMNAS_CUADRO = ["Cuota total pagada", "Intereses pagados", "Capital amortizado", "Capital pendiente"]
+# Plazo máximo que admite la app (40 años): longitud de las curvas de descuento
+MESES_MAXIMOS = 40 * 12
+
+# Los cuadros se guardan en caché como una matriz (años, 4) de float64 y solo
+# se convierten a DataFrame para mostrarlos o descargarlos.
+@cache_memoria
+def _cuadro_fija_array(principal, years, r, cuota):
+    cuadro = np.empty((years, 4))
     pendiente = principal
     for year in range(1, years + 1):
         intereses_anual = 0.0
@@ -50,18 +82,12 @@ def cuadro_amortizacion_fija(principal, years, r, cuota):
             pendiente -= capital_mes
             if pendiente < 0:
                 pendiente = 0.0
-        cuadro.append({
-            "Año": year,
-            "Cuota total pagada": cuota * 12,
-            "Intereses pagados": intereses_anual,
-            "Capital amortizado": capital_anual,
-            "Capital pendiente": max(pendiente, 0.0)
-        })
-    return pd.DataFrame(cuadro)
+        cuadro[year - 1] = (cuota * 12, intereses_anual, capital_anual, max(pendiente, 0.0))
+    return cuadro
 
-@st.cache_data(show_spinner=False)
-def cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable):
-    cuadro = []
+@cache_memoria
+def _cuadro_mixta_array(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable):
+    cuadro = np.empty((years_total, 4))
     pendiente = principal
     for year in range(1, years_total + 1):
         intereses_anual = 0.0
@@ -79,16 +105,127 @@ def cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var
             pendiente -= capital_mes
             if pendiente < 0:
                 pendiente = 0.0
-        cuadro.append({
-            "Año": year,
-            "Cuota total pagada": cuota_mes * 12,
-            "Intereses pagados": intereses_anual,
-            "Capital amortizado": capital_anual,
-            "Capital pendiente": max(pendiente, 0.0)
-        })
-    return pd.DataFrame(cuadro)
+        cuadro[year - 1] = (cuota_mes * 12, intereses_anual, capital_anual, max(pendiente, 0.0))
+    return cuadro
+
+def _cuadro_a_df(cuadro):
+    df = pd.DataFrame(cuadro, columns=COLUMNAS_CUADRO)
+    df.insert(0, "Año", np.arange(1, len(cuadro) + 1))
+    return df
+
+def cuadro_amortizacion_fija(principal, years, r, cuota):
+    return _cuadro_a_df(_cuadro_fija_array(principal, years, r, cuota))
+
+def cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable):
+    return _cuadro_a_df(_cuadro_mixta_array(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable))
+
+# Amortización anticipada: al cambiar un año o un importe se reanuda desde el
+# último año cuyo plan no ha cambiado (puntos de control en cache_en_memoria)
+def amortizacion_incremental(principal, r, n, modo, eventos):
+    return calcular_con_puntos_control(
+        "amortizacion_anticipada", (float(principal), float(r), int(n), modo), eventos,
+        lambda punto: amortizacion_anticipada(principal, r, n, modo=modo, eventos=eventos, punto_control=punto)
+    )
+
+def amortizar_o_invertir_incremental(principal, r, n, modo, eventos, com_amort_pct, rentabilidad_pct,
+                                     volatilidad_pct, n_caminos, semilla):
+    base = (float(principal), float(r), int(n), modo, float(com_amort_pct), float(rentabilidad_pct),
+            float(volatilidad_pct), int(n_caminos), int(semilla))
+    return calcular_con_puntos_control(
+        "amortizar_o_invertir", base, eventos,
+        lambda punto: amortizar_o_invertir(
+            principal, r, n, modo=modo, com_amort_pct=com_amort_pct, rentabilidad_pct=rentabilidad_pct,
+            volatilidad_pct=volatilidad_pct, n_caminos=n_caminos, semilla=semilla,
+            punto_control=punto, eventos=eventos
+        )
+    )
 
 
+def tabla_resultados_ofertas(lote, res):
+    """Tabla resumen del comparador a partir de un lote y su resultado de ``simular_lote``."""
+    return pd.DataFrame({
+        "Oferta": lote["nombre"],
+        "Tipo": np.where(lote["mixta"], "Mixta", "Fija"),
+        "Cuota inicial (€)": res["cuota_inicial"],
+        "Intereses totales (€)": res["intereses"],
+        "Coste apertura (€)": res["coste_apertura"],
+        "Coste amortizaciones (€)": res["coste_amort_parcial"],
+        "Coste bonificaciones (€)": res["coste_bonificaciones"],
+        "Coste total (€)": res["total_coste"],
+        "Meses pagados": res["meses_pagados"],
+        **columnas_coste_descontado(res)
+    })
+
+def matriz_descuentos(tasa_pct, curva, inflacion_pct, n_meses=MESES_MAXIMOS):
+    """Factores por mes: descuento financiero (fila 0) y deflactor por inflación (fila 1)."""
+    return np.vstack([factores_descuento(n_meses, tasa_pct, curva), factores_descuento(n_meses, inflacion_pct)])
+
+def columnas_coste_descontado(res):
+    """Columnas de coste en valor actual y en euros de hoy si se ha calculado ``coste_descontado``."""
+    if "coste_descontado" not in res:
+        return {}
+    descontado = np.asarray(res["coste_descontado"])
+    # tolist(): float si es una sola oferta (fila de simulate_offer), lista si es un lote
+    return {"Coste VA (€)": descontado[..., 0].tolist(), "Coste real (€)": descontado[..., 1].tolist()}
+
+@cache_disco
+def comparar_ofertas_fichero(contenido, nombre_fichero, descuentos=None):
+    lote, errores = validar_ofertas(leer_ofertas(contenido, nombre_fichero))
+    df = tabla_resultados_ofertas(lote, simular_lote_paralelo(lote, descuentos=descuentos))
+    df.insert(0, "Fila", lote["fila"])
+    df.insert(0, "Puesto", df["Coste total (€)"].rank(method="first").astype(int))
+    return df, errores
+
+
+# Formato por columna en el navegador (printf de sprintf-js): los datos viajan como
+# números sin formatear en lugar de una copia de texto de cada celda (pandas Styler)
+FORMATO_EUROS = "%,.2f €"
+FORMATO_IMPORTE = "%,.2f"
+FORMATOS_CUADRO = {c: FORMATO_EUROS for c in COLUMNAS_CUADRO}
+FORMATOS_OFERTAS = {
+    "Cuota inicial (€)": FORMATO_IMPORTE,
+    "Intereses totales (€)": FORMATO_IMPORTE,
+    "Coste apertura (€)": FORMATO_IMPORTE,
+    "Coste amortizaciones (€)": FORMATO_IMPORTE,
+    "Coste bonificaciones (€)": FORMATO_IMPORTE,
+    "Coste total (€)": FORMATO_IMPORTE,
+    "Coste VA (€)": FORMATO_IMPORTE,
+    "Coste real (€)": FORMATO_IMPORTE
+}
+FORMATOS_ALTERNATIVAS = {
+    "TIN (%)": "%.2f",
+    "Cuota (€)": FORMATO_IMPORTE,
+    "Intereses (€)": FORMATO_IMPORTE,
+    "Gastos y comisiones (€)": FORMATO_IMPORTE,
+    "Ahorro neto (€)": FORMATO_IMPORTE,
+    "Recuperación (meses)": "%d",
+}
+TAM_PAGINA_TABLA = 100
+# Percentiles que se muestran de las simulaciones de Euríbor
+PERCENTILES_MC = [0.05, 0.25, 0.5, 0.75, 0.95]
+# Paso (puntos porcentuales) con el que se muestran las sensibilidades a los tipos
+PASO_SENSIBILIDAD = 0.1
+
+def config_columnas(formatos):
+    return {col: st.column_config.NumberColumn(col, format=fmt) for col, fmt in formatos.items()}
+
+def mostrar_tabla(df, formatos, clave_pagina=None, tam_pagina=TAM_PAGINA_TABLA, **kwargs):
+    """
+    Muestra ``df`` con formato numérico por columna. Si tiene más de
+    ``tam_pagina`` filas y se da ``clave_pagina``, solo se envía la página
+    elegida al navegador.
+    """
+    if clave_pagina is not None and len(df) > tam_pagina:
+        n_paginas = -(-len(df) // tam_pagina)
+        pagina_tabla = st.number_input(f"Página (de {n_paginas}):", min_value=1, max_value=n_paginas,
+                                       value=1, key=clave_pagina)
+        inicio = (int(pagina_tabla) - 1) * tam_pagina
+        st.dataframe(df.iloc[inicio:inicio + tam_pagina], column_config=config_columnas(formatos),
+                     use_container_width=True, **kwargs)
+        st.caption(f"Mostrando {inicio + 1}–{min(inicio + tam_pagina, len(df))} de {len(df)} filas.")
+    else:
+        st.dataframe(df, column_config=config_columnas(formatos), use_container_width=True, **kwargs)
+
 def descargar_df(df):
     output = BytesIO()
     df.to_excel(output, index=False)
@@ -112,6 +249,56 @@ def plot_evolucion_plotly(df, titulo):
     )
     st.plotly_chart(fig, use_container_width=True)
 
+METODOS_MONTECARLO = {
+    "Sobol + antitéticas (cuasi Monte Carlo)": "sobol",
+    "Antitéticas": "antitetico",
+    "Aleatorio simple": "aleatorio",
+}
+
+def controles_modelo_euribor(clave, euribor=2.5, max_caminos=500_000):
+    """
+    Widgets del modelo de Euríbor y del método de simulación. Devuelve
+    ``(modelo, caminos, opciones)`` para ``paralelo.montecarlo_euribor`` o
+    ``paralelo.montecarlo_progresivo``.
+    """
+    c1, c2, c3 = st.columns(3)
+    inicial = c1.number_input("Euríbor actual (%):", min_value=-1.0, max_value=10.0, value=float(euribor), step=0.1, key=f"{clave}_inicial")
+    media = c2.number_input("Media a largo plazo (%):", min_value=-1.0, max_value=10.0, value=float(euribor), step=0.1, key=f"{clave}_media")
+    reversion = c3.number_input("Velocidad de reversión (anual):", min_value=0.0, max_value=5.0, value=0.3, step=0.05,
+                                key=f"{clave}_reversion", help="Cuanto mayor, antes vuelve el Euríbor a la media.")
+    c1, c2, c3 = st.columns(3)
+    volatilidad = c1.number_input("Volatilidad anual (p.p.):", min_value=0.0, max_value=5.0, value=1.0, step=0.1, key=f"{clave}_volatilidad")
+    caminos = c2.number_input("Trayectorias (máximo):", min_value=512, max_value=max_caminos, value=20_000, step=1024, key=f"{clave}_caminos")
+    semilla = c3.number_input("Semilla:", min_value=0, value=0, step=1, key=f"{clave}_semilla",
+                              help="Con la misma semilla el resultado es siempre el mismo.")
+    metodo = st.selectbox("Método:", list(METODOS_MONTECARLO), key=f"{clave}_metodo",
+                          help="Todas las ofertas se valoran sobre las mismas trayectorias. Las antitéticas añaden a cada "
+                               "trayectoria su simétrica y Sobol reparte las trayectorias de forma uniforme: con el mismo "
+                               "número de trayectorias el error es mucho menor.")
+    modelo = {"inicial": inicial, "media": media, "reversion": reversion, "volatilidad": volatilidad}
+    return modelo, int(caminos), {"semilla": int(semilla), "metodo": METODOS_MONTECARLO[metodo]}
+
+def controles_montecarlo(clave, euribor=2.5):
+    """``controles_modelo_euribor`` más la parada cuando el ranking de ofertas está claro."""
+    modelo, caminos, opciones = controles_modelo_euribor(clave, euribor)
+    c1, c2, c3 = st.columns(3)
+    parar = c1.checkbox("Parar cuando el ranking esté claro", value=True, key=f"{clave}_parar")
+    confianza = c2.selectbox("Confianza:", [0.90, 0.95, 0.99], index=1, format_func=lambda x: f"{x:.0%}",
+                             key=f"{clave}_confianza", disabled=not parar)
+    solo_mejor = c3.checkbox("Basta con saber cuál es la más barata", value=False, key=f"{clave}_solo_mejor", disabled=not parar)
+    if parar:
+        opciones.update(confianza=confianza, solo_mejor=solo_mejor)
+    return modelo, int(caminos), opciones
+
+def resumen_parada_montecarlo(mc, caminos):
+    if "ranking_decidido" not in mc:
+        st.success(f"¡Monte Carlo completado! ({mc['n_caminos']:,} trayectorias)")
+    elif mc["ranking_decidido"]:
+        st.success(f"Ranking decidido con {mc['n_caminos']:,} de {caminos:,} trayectorias como máximo.")
+    else:
+        st.warning(f"Con {mc['n_caminos']:,} trayectorias el ranking aún no está claro: "
+                   "algunas ofertas están dentro del margen de error. Aumenta las trayectorias o acepta el empate.")
+
 # =============================
 # 0. PÁGINA INICIO
 # =============================
@@ -131,19 +318,22 @@ if pagina == "Inicio":
       Simula hipotecas con años fijos y años variables.
 
     - **Comparativa Fija vs Mixta**  
-      Compara ambos tipos con gráficos y cuadro de intereses.
+      Compara ambos tipos con gráficos y cuadro de intereses, o haz un backtest con el Euríbor histórico.
 
     - **Amortización Anticipada**  
       Descubre cuánto puedes ahorrar amortizando antes de tiempo.
 
     - **Comparador de Ofertas**  
-      Introduce varias ofertas de bancos y compara cuotas e intereses totales.
+      Introduce varias ofertas de bancos (o impórtalas desde CSV/JSON) y compara cuotas e intereses totales.
 
     - **Bonificaciones**  
       Analiza si compensa contratar productos vinculados para rebajar el tipo de interés.
 
     - **Subrogación**  
-      Comprueba si te conviene cambiar tu hipoteca a otro banco.
+      Compara varias alternativas (subrogación, novación o cancelar y firmar otra) y ordénalas por ahorro neto.
+
+    - **Capacidad de Endeudamiento**  
+      Parte de tu presupuesto: préstamo máximo, plazo necesario y tipo máximo asumible.
 
     - **Glosario**  
       Consulta los conceptos clave del mundo hipotecario y consejos útiles.
@@ -208,12 +398,7 @@ elif pagina == "Hipoteca Fija":
             st.divider()
             df_cuadro = cuadro_amortizacion_fija(principal, years, r, cuota)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -318,12 +503,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -335,6 +515,90 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             st.write("### Evolución de capital pendiente e intereses")
             plot_evolucion_plotly(df_cuadro, "Evolución Hipoteca Mixta")
+
+    # ---------- Incertidumbre del Euríbor (Monte Carlo progresivo) ----------
+    st.divider()
+    st.subheader("Incertidumbre del Euríbor")
+    st.caption("Simula trayectorias aleatorias del Euríbor durante la fase variable y muestra cómo se reparten los "
+               "intereses totales, la cuota más alta y el momento en que la cuota sube de golpe. Los resultados se "
+               "actualizan mientras se simula y la simulación se detiene sola cuando el intervalo de confianza es "
+               "suficientemente estrecho.")
+    with st.expander("Modelo del Euríbor y precisión"):
+        mc_modelo, mc_caminos, mc_opciones = controles_modelo_euribor("mixta_mc", euribor, max_caminos=50_000_000)
+        c1, c2, c3 = st.columns(3)
+        mc_tolerancia = c1.number_input(
+            "Anchura máxima del intervalo (€):", min_value=0.01, max_value=10_000.0, value=50.0, step=10.0,
+            key="mixta_mc_tolerancia", help="Se deja de simular cuando el intervalo de confianza de los intereses "
+                                            "medios es más estrecho que esta cantidad."
+        )
+        mc_confianza = c2.selectbox("Confianza:", [0.90, 0.95, 0.99], index=1, format_func=lambda x: f"{x:.0%}",
+                                    key="mixta_mc_confianza")
+        mc_subida = c3.number_input("Subida de cuota a vigilar (%):", min_value=1.0, max_value=200.0, value=20.0, step=5.0,
+                                    key="mixta_mc_subida", help="Se anota el primer mes en que la cuota supera a la "
+                                                                "inicial en este porcentaje.")
+
+    if st.button("Simular Euríbor", key="mixta_mc_btn"):
+        lote = lote_ofertas([{
+            "nombre": "Mixta", "tipo": "Mixta", "principal": principal, "years": years_total, "years_fixed": years_fixed,
+            "tin_fijo_mixta": tipo_fijo, "euribor": euribor, "diferencial": diferencial,
+        }])
+        z = float(normal_inversa(0.5 + mc_confianza / 2))
+        barra = st.progress(0.0, text="Simulando…")
+        hueco_metricas = st.empty()
+        hueco_tabla = st.empty()
+        # Si Streamlit interrumpe el script (el usuario cambia algo o vuelve a pulsar), la excepción sale
+        # del bucle y el ``finally`` cierra el generador: se cancelan los bloques pendientes del pool.
+        progreso = montecarlo_progresivo(lote, mc_caminos, mc_modelo, cuantiles=True, umbral_subida=mc_subida / 100,
+                                         **mc_opciones)
+        try:
+            for mc in progreso:
+                media = mc["media"][0]
+                anchura = 2 * z * mc["error_estandar"][0]
+                with hueco_metricas.container():
+                    c1, c2, c3 = st.columns(3)
+                    c1.metric("Intereses medios", f"{media:,.2f} €")
+                    c2.metric(f"Intervalo al {mc_confianza:.0%}", f"± {anchura / 2:,.2f} €")
+                    c3.metric("Trayectorias", f"{mc['n_caminos']:,}")
+                cuantiles = mc["cuantiles"]
+                hueco_tabla.dataframe(pd.DataFrame({
+                    "Percentil": ["P5", "P25", "Mediana", "P75", "P95"],
+                    "Intereses totales (€)": cuantiles["intereses"].cuantiles(PERCENTILES_MC)[0],
+                    "Cuota máxima (€)": cuantiles["cuota_maxima"].cuantiles(PERCENTILES_MC)[0],
+                    "Mes de la subida": cuantiles["mes_subida"].cuantiles(PERCENTILES_MC, desde=1)[0],
+                }), column_config=config_columnas({
+                    "Intereses totales (€)": FORMATO_IMPORTE, "Cuota máxima (€)": FORMATO_IMPORTE, "Mes de la subida": "%d",
+                }), use_container_width=True, hide_index=True)
+                barra.progress(min(mc["n_caminos"] / mc_caminos, 1.0),
+                               text=f"{mc['n_caminos']:,} trayectorias · intervalo de {anchura:,.2f} €")
+                if mc["n_unidades"] >= MIN_UNIDADES_PARADA and anchura <= mc_tolerancia:
+                    break
+        finally:
+            progreso.close()
+
+        if anchura <= mc_tolerancia:
+            st.success(f"Precisión alcanzada con {mc['n_caminos']:,} trayectorias: intereses medios "
+                       f"{media - anchura / 2:,.2f} € – {media + anchura / 2:,.2f} €.")
+        else:
+            st.warning(f"Se alcanzó el máximo de trayectorias con un intervalo de {anchura:,.2f} €, más ancho que "
+                       f"los {mc_tolerancia:,.2f} € pedidos. Aumenta las trayectorias o elige otro método.")
+        prob_subida = cuantiles["mes_subida"].proporcion(1)[0]
+        st.caption(f"La cuota sube más de un {mc_subida:.0f} % sobre la inicial en el {prob_subida:.1%} de las trayectorias; "
+                   "el mes de la subida se calcula solo sobre ellas (vacío si no ocurre). Los percentiles de intereses y "
+                   f"cuota tienen un error de como mucho ±{cuantiles['intereses'].alpha:.1%} y ocupan la misma memoria "
+                   "sea cual sea el número de trayectorias.")
+
+        percentiles = np.arange(1, 100)
+        inferior, superior = cuantiles["intereses"].intervalos(percentiles / 100)
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=percentiles, y=superior[0], mode="lines", line=dict(width=0), showlegend=False,
+                                 hoverinfo="skip"))
+        fig.add_trace(go.Scatter(x=percentiles, y=inferior[0], mode="lines", line=dict(width=0), fill="tonexty",
+                                 name="Margen de error", hoverinfo="skip"))
+        fig.add_trace(go.Scatter(x=percentiles, y=cuantiles["intereses"].cuantiles(percentiles / 100)[0],
+                                 mode="lines", name="Intereses totales"))
+        fig.add_hline(y=media, line_dash="dash", line_color="gray", annotation_text="Media")
+        fig.update_layout(xaxis_title="Percentil (%)", yaxis_title="Intereses totales (€)", hovermode="x unified")
+        st.plotly_chart(fig, use_container_width=True)
 # =============================
 # 2. PÁGINA HIPOTECA MIXTA (mejorada)
 # =============================
@@ -423,12 +687,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -528,12 +787,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -633,12 +887,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -738,12 +987,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -843,12 +1087,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -948,12 +1187,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1053,12 +1287,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1158,12 +1387,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1263,12 +1487,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1368,12 +1587,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1473,12 +1687,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1578,12 +1787,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1683,12 +1887,7 @@ elif pagina == "Hipoteca Mixta":
             st.divider()
             df_cuadro = cuadro_amortizacion_mixta(principal, years_fixed, years_total, r_fijo, r_var, cuota_fija, cuota_variable)
             st.write("### Cuadro de amortización (anual)")
-            st.dataframe(df_cuadro.style.format({
-                "Cuota total pagada": "{:,.2f} €",
-                "Intereses pagados": "{:,.2f} €",
-                "Capital amortizado": "{:,.2f} €",
-                "Capital pendiente": "{:,.2f} €"
-            }), use_container_width=True)
+            mostrar_tabla(df_cuadro, FORMATOS_CUADRO)
 
             st.download_button(
                 label="Descargar cuadro (Excel)",
@@ -1751,9 +1950,112 @@ elif pagina == "Comparativa Fija vs Mixta":
         min_value=0.0, max_value=5.0, value=1.0, step=0.1,
         help="Diferencial añadido al euríbor en la parte variable."
     )
+    modo_comparativa = st.radio(
+        "Escenario de Euríbor:",
+        ("Euríbor estimado", "Backtest histórico", "Monte Carlo del Euríbor"),
+        horizontal=True,
+        help="El backtest evalúa la comparativa empezando la hipoteca en cada mes de una serie histórica de Euríbor 12M. "
+             "El Monte Carlo la evalúa sobre miles de trayectorias aleatorias del Euríbor."
+    )
+    if modo_comparativa == "Backtest histórico":
+        ruta_euribor = st.text_input(
+            "Fichero CSV con el Euríbor 12M histórico:",
+            value="datos/euribor_12m.csv",
+            help="Dos columnas: fecha y valor mensual en %. Se admite ';' o ',' como separador."
+        )
+        solo_completas = st.checkbox(
+            "Solo fechas de inicio con histórico completo",
+            value=False,
+            help="Si no se marca, los años posteriores al último dato repiten el último Euríbor conocido."
+        )
+    if modo_comparativa == "Monte Carlo del Euríbor":
+        with st.expander("Modelo del Euríbor y método", expanded=True):
+            mc_modelo, mc_caminos, mc_opciones = controles_montecarlo("cmpfm_mc", euribor)
     st.divider()
 
-    if st.button("Comparar"):
+    if modo_comparativa == "Monte Carlo del Euríbor" and st.button("Simular"):
+        lote = lote_ofertas([
+            {"nombre": "Fija", "tipo": "Fija", "principal": principal, "years": years_fija, "tin_fija": tipo_fijo},
+            {"nombre": "Mixta", "tipo": "Mixta", "principal": principal, "years": years_total, "years_fixed": years_fixed,
+             "tin_fijo_mixta": tipo_fijo_mixta, "euribor": euribor, "diferencial": diferencial},
+        ])
+        with st.spinner(f"Simulando hasta {mc_caminos:,} trayectorias de Euríbor…"):
+            mc = montecarlo_euribor(lote, mc_caminos, mc_modelo, **mc_opciones)
+        diferencia = mc["media"][1] - mc["media"][0]
+        error_diferencia = mc["error_diferencias"][0, 1]
+
+        resumen_parada_montecarlo(mc, mc_caminos)
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Intereses medios fija", f"{mc['media'][0]:,.2f} €")
+        c2.metric("Intereses medios mixta", f"{mc['media'][1]:,.2f} €", f"± {mc['error_estandar'][1]:,.2f} €", delta_color="off")
+        c3.metric("Gana la mixta", f"{mc['prob_mejor'][1]:.1%}")
+        st.write(f"**Diferencia media mixta − fija:** {diferencia:,.2f} € ± {error_diferencia:,.2f} € (error estándar). "
+                 f"En las trayectorias simuladas la mixta cuesta entre {mc['minimo'][1]:,.2f} € y {mc['maximo'][1]:,.2f} €.")
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=np.arange(len(mc["euribor_medio"])) / 12, y=mc["euribor_medio"],
+                                 mode="lines", name="Euríbor medio"))
+        fig.add_hline(y=euribor, line_dash="dot", line_color="gray", annotation_text="Tu estimación")
+        fig.update_layout(xaxis_title="Años desde la firma", yaxis_title="Euríbor medio simulado (%)")
+        st.plotly_chart(fig, use_container_width=True)
+
+    if modo_comparativa == "Backtest histórico" and st.button("Ejecutar backtest"):
+        try:
+            serie = cargar_euribor_historico(ruta_euribor)
+        except (OSError, ValueError) as e:
+            st.error(f"No se pudo cargar la serie de Euríbor: {e}")
+            st.stop()
+
+        bt = backtest_fija_vs_mixta(
+            serie[:, 1], principal,
+            int(years_fija * 12), (tipo_fijo / 100) / 12,
+            int(years_fixed * 12), int(years_total * 12), (tipo_fijo_mixta / 100) / 12, diferencial
+        )
+        mask = bt["cobertura"] >= 1.0 if solo_completas else np.ones(len(serie), dtype=bool)
+        if not mask.any():
+            st.warning("El histórico no cubre ninguna hipoteca completa con estos plazos.")
+            st.stop()
+
+        fechas = fechas_de_meses(serie[mask, 0])
+        diferencia = bt["diferencia"][mask]
+        gana_mixta = diferencia < 0
+
+        st.success(f"Backtest realizado sobre {mask.sum()} fechas de inicio.")
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Gana la mixta", f"{gana_mixta.mean():.1%}")
+        c2.metric("Diferencia mediana", f"{np.median(diferencia):,.2f} €")
+        c3.metric("Intereses fija", f"{bt['intereses_fija']:,.2f} €")
+        p5, p95 = np.percentile(diferencia, [5, 95])
+        st.write(f"**Diferencia mixta − fija:** entre {p5:,.2f} € (P5) y {p95:,.2f} € (P95); "
+                 f"peor caso para la mixta {diferencia.max():,.2f} €, mejor {diferencia.min():,.2f} €.")
+        if not solo_completas and (bt["cobertura"][mask] < 1).any():
+            st.caption("Las fechas de inicio más recientes usan el último Euríbor conocido para los años sin datos.")
+
+        st.divider()
+        st.write("### Distribución de la diferencia de intereses (mixta − fija)")
+        fig = go.Figure()
+        fig.add_trace(go.Histogram(x=diferencia[gana_mixta], name="Gana la mixta", marker_color="#2ECC71"))
+        fig.add_trace(go.Histogram(x=diferencia[~gana_mixta], name="Gana la fija", marker_color="#E74C3C"))
+        fig.add_vline(x=0, line_dash="dash", line_color="gray")
+        fig.update_layout(
+            barmode="overlay",
+            xaxis_title="Diferencia de intereses (€)",
+            yaxis_title="Fechas de inicio",
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+        st.write("### Diferencia según la fecha de inicio")
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=fechas, y=diferencia, mode="lines", name="Mixta − fija"))
+        fig.add_hline(y=0, line_dash="dash", line_color="gray")
+        fig.update_layout(
+            xaxis_title="Fecha de inicio",
+            yaxis_title="Diferencia de intereses (€)",
+            hovermode="x unified"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    if modo_comparativa == "Euríbor estimado" and st.button("Comparar"):
         n_fija = int(years_fija * 12)
         r_fija = (tipo_fijo / 100) / 12
         cuota_fija = principal * (r_fija * (1 + r_fija) ** n_fija) / ((1 + r_fija) ** n_fija - 1)
@@ -1800,12 +2102,50 @@ elif pagina == "Comparativa Fija vs Mixta":
         )
         st.plotly_chart(fig, use_container_width=True)
 
+        # ---------- Euríbor de equilibrio ----------
+        st.divider()
+        st.write("### ¿A partir de qué Euríbor sale más cara la mixta?")
+        args_equilibrio = (principal, n_fija, r_fija, n_fijo, n_fijo + n_var, r_fijo_mixta, diferencial)
+        eur_equilibrio = euribor_equilibrio(*args_equilibrio)
+        if n_var == 0:
+            st.info("La mixta no tiene fase variable con estos plazos: el Euríbor no influye en su coste.")
+        elif np.isnan(eur_equilibrio):
+            curva_extremos = curva_intereses_euribor([-5.0, 20.0], *args_equilibrio)
+            if curva_extremos["intereses_mixta"][0] >= curva_extremos["intereses_fija"][0]:
+                st.info("La mixta paga más intereses que la fija incluso con el Euríbor en -5 %.")
+            else:
+                st.info("La mixta paga menos intereses que la fija incluso con el Euríbor en 20 %.")
+        else:
+            c1, c2 = st.columns(2)
+            c1.metric("Euríbor de equilibrio", f"{eur_equilibrio:.2f} %")
+            c2.metric("Margen sobre tu estimación", f"{eur_equilibrio - euribor:+.2f} p.p.")
+            st.caption("Euríbor medio constante durante la fase variable con el que fija y mixta pagan los mismos intereses. "
+                       "Por encima, la fija sale más barata.")
+
+        eur_min, eur_max = -2.0, 10.0
+        if np.isfinite(eur_equilibrio):
+            eur_min, eur_max = min(eur_min, eur_equilibrio - 1.0), max(eur_max, eur_equilibrio + 1.0)
+        curva = curva_intereses_euribor(np.arange(eur_min, eur_max + 1e-9, 0.05), *args_equilibrio)
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=curva["euribor"], y=curva["intereses_fija"], mode="lines", name="Fija"))
+        fig.add_trace(go.Scatter(x=curva["euribor"], y=curva["intereses_mixta"], mode="lines", name="Mixta"))
+        fig.add_vline(x=euribor, line_dash="dot", line_color="gray", annotation_text="Tu estimación")
+        if np.isfinite(eur_equilibrio):
+            fig.add_vline(x=eur_equilibrio, line_dash="dash", line_color="#E74C3C", annotation_text="Equilibrio")
+        fig.update_layout(
+            title="Intereses totales según el Euríbor",
+            xaxis_title="Euríbor medio en la fase variable (%)",
+            yaxis_title="Intereses totales (€)",
+            hovermode="x unified"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
 # =============================
 # 4. PÁGINA AMORTIZACIÓN ANTICIPADA
 # =============================
 elif pagina == "Amortización Anticipada":
     st.title("¿Cuánto compensa amortizar anticipadamente?")
-    st.info("Simula cuánto te ahorras en intereses si haces una amortización anticipada en una hipoteca fija. Puedes elegir reducir plazo o cuota.")
+    st.info("Simula cuánto te ahorras en intereses si haces amortizaciones anticipadas (puntuales o periódicas) en una hipoteca fija. Puedes elegir reducir plazo o cuota.")
     st.divider()
 
     years = st.number_input(
@@ -1823,82 +2163,109 @@ elif pagina == "Amortización Anticipada":
         min_value=1000.0, max_value=1000000.0, value=150000.0, step=1000.0, key="aa_principal",
         help="Cantidad total que te presta el banco."
     )
-    year_amort = st.number_input(
-        "Año en que amortizas:",
-        min_value=1, max_value=years, value=5,
-        help="Año en el que realizarás la amortización anticipada."
-    )
-    importe_amort = st.number_input(
-        "Importe a amortizar (€):",
-        min_value=100.0, max_value=principal, value=10000.0, step=500.0,
-        help="Cantidad que vas a amortizar anticipadamente."
-    )
+    st.write("#### Amortizaciones puntuales")
+    n_anticipadas = st.number_input(
+        "Número de amortizaciones puntuales:",
+        min_value=0, max_value=20, value=1, key="aa_n_anticipadas",
+        help="Cada amortización se hace al empezar el año indicado."
+    )
+    anticipadas = []
+    for j in range(int(n_anticipadas)):
+        colA, colB = st.columns(2)
+        anio = colA.number_input(
+            f"Año de la amortización #{j+1}:",
+            min_value=1, max_value=years, value=min(5 * (j + 1), years), key=f"aa_anio_{j}",
+            help="Año en el que realizarás la amortización anticipada."
+        )
+        importe = colB.number_input(
+            f"Importe #{j+1} (€):",
+            min_value=100.0, max_value=principal, value=min(10000.0, principal), step=500.0, key=f"aa_importe_{j}",
+            help="Cantidad que vas a amortizar anticipadamente."
+        )
+        anticipadas.append({"anio": anio, "importe": importe})
+
+    with st.expander("Aportaciones periódicas (opcional)"):
+        frecuencia = st.radio("Frecuencia:", ("Ninguna", "Mensual", "Anual"), horizontal=True, key="aa_frecuencia")
+        c1, c2 = st.columns(2)
+        importe_periodico = c1.number_input(
+            "Importe de cada aportación (€):",
+            min_value=0.0, max_value=principal, value=100.0, step=50.0, key="aa_importe_periodico",
+            help="Pago extra que se destina íntegramente a capital, además de la cuota."
+        )
+        indexacion_pct = c2.number_input(
+            "Subida anual de la aportación (%):",
+            min_value=0.0, max_value=20.0, value=0.0, step=0.5, key="aa_indexacion",
+            help="0 = importe fijo. Por ejemplo, 2 % para actualizarla con la inflación."
+        )
+        desde_anio = c1.number_input("Desde el año:", min_value=1, max_value=years, value=1, key="aa_desde")
+        hasta_anio = c2.number_input("Hasta el año:", min_value=desde_anio, max_value=years, value=years, key="aa_hasta")
+
     tipo_amort = st.radio(
         "¿Qué quieres reducir?",
         ("Plazo", "Cuota"),
-        help="Elige si prefieres reducir el plazo de la hipoteca o la cuota mensual."
-    )
+        help="Elige si prefieres reducir el plazo de la hipoteca o la cuota mensual. Con aportaciones periódicas, en modo cuota se recalcula cada año."
+    )
+    com_amort_pct = st.number_input(
+        "Comisión por amortización anticipada (%):",
+        min_value=0.0, max_value=5.0, value=0.0, step=0.25, key="aa_comision",
+        help="Porcentaje que cobra el banco sobre cada importe amortizado."
+    )
+    comparar_con = st.radio(
+        "Comparar amortizar con:",
+        ("No hacer nada", "Invertir el dinero"),
+        horizontal=True, key="aa_comparar_con",
+        help="Con 'Invertir el dinero' se simulan miles de trayectorias de rentabilidad de una inversión con el mismo dinero."
+    )
+    if comparar_con == "Invertir el dinero":
+        c1, c2 = st.columns(2)
+        rentabilidad_pct = c1.number_input(
+            "Rentabilidad anual esperada (%):",
+            min_value=-10.0, max_value=20.0, value=5.0, step=0.5, key="aa_rentabilidad",
+            help="Rentabilidad media anual de la inversión, neta de comisiones e impuestos."
+        )
+        volatilidad_pct = c2.number_input(
+            "Volatilidad anual (%):",
+            min_value=0.0, max_value=60.0, value=15.0, step=1.0, key="aa_volatilidad",
+            help="Desviación típica de la rentabilidad anual (≈15 % para una cartera de renta variable global)."
+        )
+        n_caminos = c1.select_slider(
+            "Trayectorias simuladas:",
+            options=[1_000, 10_000, 50_000, 100_000], value=100_000, key="aa_caminos"
+        )
+        semilla = c2.number_input("Semilla aleatoria:", min_value=0, max_value=2**31 - 1, value=0, key="aa_semilla")
     st.divider()
 
     if st.button("Simular ahorro"):
         n = int(years * 12)
         r = (interest / 100) / 12
-        cuota = principal * (r * (1 + r) ** n) / ((1 + r) ** n - 1)
-        pendiente = principal
-        intereses_sin_amort = 0
-
-        for i in range(n):
-            interes = pendiente * r
-            amort = cuota - interes
-            intereses_sin_amort += interes
-            pendiente -= amort
-        intereses_totales_sin_amort = intereses_sin_amort
-
-        pendiente = principal
-        intereses_con_amort = 0
-        meses_amort = int((year_amort - 1) * 12)
-        for i in range(meses_amort):
-            interes = pendiente * r
-            amort = cuota - interes
-            intereses_con_amort += interes
-            pendiente -= amort
-
-        pendiente -= importe_amort
-        if pendiente < 0:
-            pendiente = 0
+        intereses_totales_sin_amort = float(intereses_fija(principal, r, n))
+        eventos = eventos_anuales(
+            n, anticipadas,
+            extra_mensual=importe_periodico if frecuencia == "Mensual" else 0.0,
+            extra_anual=importe_periodico if frecuencia == "Anual" else 0.0,
+            desde_anio=desde_anio, hasta_anio=hasta_anio, indexacion_pct=indexacion_pct
+        )
+        res_amort = amortizacion_incremental(principal, r, n, tipo_amort, eventos)
+        if not res_amort["amortiza"]:
+            st.error("Con estos datos el pago mensual no cubre los intereses y la deuda no se amortiza nunca.")
+            st.stop()
 
+        total_meses = res_amort["meses"]
         if tipo_amort == "Plazo":
-            meses_restantes = 0
-            while pendiente > 0:
-                interes = pendiente * r
-                amort = cuota - interes
-                intereses_con_amort += interes
-                pendiente -= amort
-                meses_restantes += 1
-                if pendiente < 0:
-                    pendiente = 0
-            total_meses = meses_amort + meses_restantes
             st.success(f"Nuevo plazo: {total_meses//12} años y {total_meses%12} meses")
         else:
-            n_rest = n - meses_amort
-            if r > 0:
-                nueva_cuota = pendiente * (r * (1 + r) ** n_rest) / ((1 + r) ** n_rest - 1)
-            else:
-                nueva_cuota = pendiente / n_rest
-            for i in range(n_rest):
-                interes = pendiente * r
-                amort = nueva_cuota - interes
-                intereses_con_amort += interes
-                pendiente -= amort
-                if pendiente < 0:
-                    pendiente = 0
-            st.success(f"Nueva cuota: {nueva_cuota:,.2f} €")
-
-        intereses_totales_con_amort = intereses_con_amort
+            st.success(f"Nueva cuota: {res_amort['cuota_final']:,.2f} €")
+            if total_meses < n:
+                st.info(f"Con las aportaciones periódicas terminas de pagar en {total_meses//12} años y {total_meses%12} meses.")
+
+        intereses_totales_con_amort = res_amort["intereses"]
         ahorro = intereses_totales_sin_amort - intereses_totales_con_amort
 
         st.write(f"**Intereses totales SIN amortizar:** {intereses_totales_sin_amort:,.2f} €")
         st.write(f"**Intereses totales CON amortización:** {intereses_totales_con_amort:,.2f} €")
+        st.write(f"**Total amortizado anticipadamente:** {res_amort['amortizado']:,.2f} €")
+        if com_amort_pct > 0:
+            st.write(f"**Comisión por amortización:** {res_amort['amortizado'] * com_amort_pct / 100:,.2f} €")
         st.write(f"### ¡Ahorro en intereses! → {ahorro:,.2f} €")
         st.divider()
 
@@ -1915,6 +2282,53 @@ elif pagina == "Amortización Anticipada":
         )
         st.plotly_chart(fig, use_container_width=True)
 
+        st.write("### Cuadro anual con amortizaciones")
+        df_amort = pd.DataFrame(res_amort["cuadro"])
+        mostrar_tabla(df_amort, {c: FORMATO_EUROS for c in df_amort.columns if c != "Año"}, hide_index=True)
+
+        if comparar_con == "Invertir el dinero":
+            st.divider()
+            st.write("### ¿Amortizar o invertir?")
+            with st.spinner(f"Simulando {n_caminos:,} trayectorias de inversión…"):
+                mc = amortizar_o_invertir_incremental(
+                    principal, r, n, tipo_amort, eventos, com_amort_pct,
+                    rentabilidad_pct, volatilidad_pct, n_caminos, int(semilla)
+                )
+            primer_anio = min([a["anio"] for a in anticipadas] + ([desde_anio] if frecuencia != "Ninguna" else []), default=1)
+            sel = mc["anio"] >= primer_anio
+            anios = mc["anio"][sel]
+            c1, c2 = st.columns(2)
+            c1.metric("Probabilidad de que amortizar gane (fin del plazo)", f"{mc['prob_amortizar'][-1]:.1%}")
+            c2.metric("Diferencia mediana al final", f"{mc['percentiles'][50][-1]:,.2f} €")
+            st.caption("Patrimonio = inversiones − capital pendiente. Diferencia positiva: amortizar deja más patrimonio. "
+                       "Ambas estrategias dedican el mismo dinero cada año, comisión de amortización incluida.")
+
+            fig = go.Figure()
+            fig.add_trace(go.Scatter(x=anios, y=mc["prob_amortizar"][sel] * 100, mode="lines+markers", name="Amortizar gana"))
+            fig.add_hline(y=50, line_dash="dash", line_color="gray")
+            fig.update_layout(
+                title="Probabilidad de que amortizar deje más patrimonio que invertir",
+                xaxis_title="Año",
+                yaxis_title="Probabilidad (%)",
+                yaxis_range=[0, 100],
+                hovermode="x unified"
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            fig = go.Figure()
+            fig.add_trace(go.Scatter(x=anios, y=mc["percentiles"][95][sel], mode="lines", line=dict(width=0), showlegend=False, name="P95"))
+            fig.add_trace(go.Scatter(x=anios, y=mc["percentiles"][5][sel], mode="lines", line=dict(width=0), fill="tonexty",
+                                     fillcolor="rgba(52, 152, 219, 0.2)", name="P5–P95"))
+            fig.add_trace(go.Scatter(x=anios, y=mc["percentiles"][50][sel], mode="lines", name="Mediana"))
+            fig.add_hline(y=0, line_dash="dash", line_color="gray")
+            fig.update_layout(
+                title="Diferencia de patrimonio (amortizar − invertir)",
+                xaxis_title="Año",
+                yaxis_title="€",
+                hovermode="x unified"
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
 
 # =============================
 # 5. PÁGINA COMPARADOR DE OFERTAS
@@ -1926,173 +2340,6 @@ elif pagina == "Comparador de Ofertas":
     st.title("Comparador de Ofertas de Hipoteca")
     st.info("Compara ofertas teniendo en cuenta bonificaciones, comisión de apertura y amortizaciones parciales con su comisión.")
 
-    # ---------- Helpers internos del comparador ----------
-    def cuota_francesa(P, r, n):
-        if n <= 0:
-            return 0.0
-        if r == 0:
-            return P / n
-        return P * (r * (1 + r) ** n) / ((1 + r) ** n - 1)
-
-    def simulate_offer(
-        tipo, principal, years,
-        # Fija
-        tin_fija=None,
-        # Mixta
-        years_fixed=None, tin_fijo_mixta=None, euribor=None, diferencial=None,
-        # Bonificaciones
-        bonus_pp=0.0, bonus_cost_anual=0.0,
-        # Comisiones
-        com_apertura_pct=0.0, com_apertura_fija=0.0, com_amort_parcial_pct=0.0,
-        # Amortizaciones parciales
-        amortizaciones=None, # lista de dicts: {anio:int, importe:float, modo:str in {"Plazo","Cuota"}}
-    ):
-        """
-        Devuelve: dict con métricas y un pequeño resumen.
-        Simulación mes a mes con:
-          - recalculo de cuota al pasar de fijo->variable (mixta)
-          - amortizaciones parciales (reducir plazo o cuota)
-          - comisiones (apertura y amortización)
-          - costes anuales de bonificaciones hasta el último mes pagado
-        """
-        amortizaciones = amortizaciones or []
-        # Normaliza y ordena eventos por mes
-        events = []
-        for ev in amortizaciones:
-            mes = max(1, int(ev["anio"] * 12))
-            events.append({"mes": mes, "importe": float(ev["importe"]), "modo": ev["modo"]})
-        events.sort(key=lambda x: x["mes"])
-
-        n_total = int(years * 12)
-
-        # Construye el "rate schedule"
-        schedule = []
-        if tipo == "Fija":
-            # TIN efectivo tras bonificación
-            tin_eff = max(0.0, (tin_fija - bonus_pp)) / 100.0
-            r_m = tin_eff / 12.0
-            schedule = [(1, n_total, r_m)]
-        else:
-            # Mixta: reduce en p.p. tipo fijo y el diferencial de variable
-            tin_fijo_eff = max(0.0, (tin_fijo_mixta - bonus_pp)) / 100.0
-            diff_eff = max(0.0, (diferencial - bonus_pp)) / 100.0
-            r_fijo_m = tin_fijo_eff / 12.0
-            r_var_m = (max(-5.0, euribor) / 100.0 + diff_eff) / 12.0  # euríbor mínimo -5% por si acaso
-            n_fijo = int(years_fixed * 12)
-            n_var = n_total - n_fijo
-            schedule = []
-            if n_fijo > 0:
-                schedule.append((1, n_fijo, r_fijo_m))
-            if n_var > 0:
-                schedule.append((n_fijo + 1, n_fijo + n_var, r_var_m))
-
-        # Comisión de apertura
-        com_apertura_eur = principal * (com_apertura_pct / 100.0) + com_apertura_fija
-
-        # Simulación
-        balance = principal
-        intereses_tot = 0.0
-        com_amort_parcial_tot = 0.0
-        mes_actual = 1
-        seg_idx = 0
-        cuota_actual = 0.0
-        meses_restantes = n_total
-        meses_pagados = 0
-
-        # Inicializa cuota para el primer segmento
-        if schedule:
-            r_seg = schedule[0][2]
-            cuota_actual = cuota_francesa(balance, r_seg, meses_restantes)
-
-        # Función para saber si cambia de segmento (entra variable) y recalcular cuota
-        def maybe_recalc_by_segment(mes, balance, meses_restantes, cuota_actual):
-            nonlocal seg_idx
-            if seg_idx < len(schedule):
-                start, end, r_seg = schedule[seg_idx]
-                # Si estamos fuera del segmento actual, avanza
-                while not (start <= mes <= end) and seg_idx + 1 < len(schedule):
-                    seg_idx += 1
-                    start, end, r_seg = schedule[seg_idx]
-                # Si el mes es el inicio del segmento, recalcula cuota a ese r y plazo restante
-                if mes == start:
-                    cuota_nueva = cuota_francesa(balance, r_seg, meses_restantes)
-                    return cuota_nueva, r_seg
-                else:
-                    return cuota_actual, r_seg
-            return cuota_actual, 0.0
-
-        # Función para aplicar amortización parcial en un mes
-        def apply_amort_event_if_any(mes, balance, cuota_actual, meses_restantes, r_seg):
-            nonlocal com_amort_parcial_tot
-            # Busca eventos en este mes
-            for ev in [e for e in events if e["mes"] == mes and balance > 0]:
-                importe = min(ev["importe"], balance)
-                if importe <= 0:
-                    continue
-                # Comisión por amortización
-                com_amort_parcial_tot += importe * (com_amort_parcial_pct / 100.0)
-                balance -= importe
-                if balance < 0:
-                    balance = 0.0
-                # Si el modo es "Cuota", recalcula cuota para los meses restantes a r_seg
-                if ev["modo"] == "Cuota":
-                    cuota_nueva = cuota_francesa(balance, r_seg, meses_restantes)
-                    return balance, cuota_nueva
-                # Si es "Plazo", mantenemos cuota_actual (se acortará el plazo por agotarse antes)
-            return balance, cuota_actual
-
-        # Bucle de meses
-        while balance > 1e-8 and meses_restantes > 0 and mes_actual <= n_total + 600:  # margen por si hay muchas reducciones de plazo
-            cuota_actual, r_seg = maybe_recalc_by_segment(mes_actual, balance, meses_restantes, cuota_actual)
-
-            # Amortización parcial en este mes (antes de calcular intereses)
-            balance, cuota_actual = apply_amort_event_if_any(mes_actual, balance, cuota_actual, meses_restantes, r_seg)
-
-            # Si llegó a cero tras amortización
-            if balance <= 1e-8:
-                break
-
-            # Interés y capital de la cuota
-            interes_mes = balance * r_seg
-            capital_mes = max(0.0, cuota_actual - interes_mes)
-
-            # Si la última cuota sobrepasa el balance, ajusta
-            if capital_mes > balance:
-                capital_mes = balance
-                cuota_real = interes_mes + capital_mes
-            else:
-                cuota_real = cuota_actual
-
-            intereses_tot += interes_mes
-            balance -= capital_mes
-
-            mes_actual += 1
-            meses_restantes -= 1
-            meses_pagados += 1
-
-        # Coste anual de bonificaciones durante los años efectivamente pagados
-        años_pagados = int(np.ceil(meses_pagados / 12.0))
-        coste_bonis_total = años_pagados * bonus_cost_anual
-
-        total_coste = intereses_tot + com_apertura_eur + com_amort_parcial_tot + coste_bonis_total
-
-        # Cuota inicial (la del primer mes)
-        cuota_inicial = cuota_actual
-        if schedule:
-            # Recalcula explícitamente la cuota del primer segmento y plazo completo
-            r0 = schedule[0][2]
-            cuota_inicial = cuota_francesa(principal, r0, n_total)
-
-        return {
-            "cuota_inicial": cuota_inicial,
-            "intereses": intereses_tot,
-            "coste_apertura": com_apertura_eur,
-            "coste_amort_parcial": com_amort_parcial_tot,
-            "coste_bonificaciones": coste_bonis_total,
-            "total_coste": total_coste,
-            "meses_pagados": meses_pagados
-        }
-
     # ---------- UI del comparador ----------
     st.divider()
     num_ofertas = st.number_input("¿Cuántas ofertas quieres comparar?", min_value=2, max_value=6, value=2)
@@ -2117,12 +2364,19 @@ elif pagina == "Comparador de Ofertas":
             bonis = st.multiselect("Selecciona bonificaciones:", opciones, key=f"cmp_bonis_sel_{i}")
             bonus_pp_total = 0.0
             bonus_cost_anual = 0.0
+            bonus_pct_saldo = 0.0
             for b in bonis:
                 nombre = st.text_input("Nombre", value=b if b != "Otro" else "", key=f"cmp_boni_nombre_{i}_{b}")
-                coste = st.number_input(f"Sobrecoste anual de {nombre} (€):", min_value=0.0, value=0.0, step=50.0, key=f"cmp_boni_cost_{i}_{b}")
+                tipo_coste = st.radio(f"Coste de {nombre}:", ("Importe anual", "% del capital pendiente"),
+                                      horizontal=True, key=f"cmp_boni_tipo_coste_{i}_{b}")
+                if tipo_coste == "Importe anual":
+                    coste = st.number_input(f"Sobrecoste anual de {nombre} (€):", min_value=0.0, value=0.0, step=50.0, key=f"cmp_boni_cost_{i}_{b}")
+                    bonus_cost_anual += coste
+                else:
+                    pct = st.number_input(f"Prima anual de {nombre} (% del capital pendiente):", min_value=0.0, max_value=5.0, value=0.25, step=0.01, key=f"cmp_boni_pct_{i}_{b}")
+                    bonus_pct_saldo += pct
                 bon_pp = st.number_input(f"Bonificación en tipo por {nombre} (p.p.):", min_value=0.0, max_value=3.0, value=0.10, step=0.01, key=f"cmp_boni_pp_{i}_{b}")
                 bonus_pp_total += bon_pp
-                bonus_cost_anual += coste
 
         # Comisiones de la oferta
         with st.expander(f"Comisiones oferta {i+1}"):
@@ -2150,6 +2404,7 @@ elif pagina == "Comparador de Ofertas":
             ofertas_cfg.append({
                 "nombre": f"Oferta {i+1}", "tipo": tipo, "principal": principal, "years": years,
                 "tin_fija": tin_fija, "bonus_pp": bonus_pp_total, "bonus_cost_anual": bonus_cost_anual,
+                "bonus_pct_saldo": bonus_pct_saldo,
                 "com_apertura_pct": com_apertura_pct, "com_apertura_fija": com_apertura_fija,
                 "com_amort_parcial_pct": com_amort_parcial_pct, "amortizaciones": amortizaciones
             })
@@ -2162,36 +2417,62 @@ elif pagina == "Comparador de Ofertas":
                 "nombre": f"Oferta {i+1}", "tipo": tipo, "principal": principal, "years": years,
                 "years_fixed": years_fixed, "tin_fijo_mixta": tin_fijo_mixta, "euribor": euribor_, "diferencial": diferencial_,
                 "bonus_pp": bonus_pp_total, "bonus_cost_anual": bonus_cost_anual,
+                "bonus_pct_saldo": bonus_pct_saldo,
                 "com_apertura_pct": com_apertura_pct, "com_apertura_fija": com_apertura_fija,
                 "com_amort_parcial_pct": com_amort_parcial_pct, "amortizaciones": amortizaciones
             })
 
     st.divider()
+    with st.expander("Opciones de cálculo"):
+        n_workers = st.number_input(
+            "Procesos de cálculo en paralelo (0 = automático):",
+            min_value=0, max_value=64, value=0, key="cmp_workers",
+            help="Con pocas ofertas el cálculo se hace en el propio proceso; con muchas ofertas o amortizaciones se reparte entre procesos."
+        )
+        calcular_sens = st.checkbox(
+            "Calcular la sensibilidad a los tipos", value=False, key="cmp_sens",
+            help="Cuánto cambian intereses y cuotas si suben el TIN, el Euríbor o el diferencial. "
+                 "Usa el cálculo sin compilar, algo más lento con muchas ofertas."
+        )
+    with st.expander("Valor actual e inflación"):
+        calcular_va = st.checkbox(
+            "Calcular el coste en valor actual y en euros de hoy", value=False, key="cmp_va",
+            help="Un euro pagado dentro de 25 años vale menos que uno pagado hoy: se descuenta cada pago mensual "
+                 "(cuota, amortizaciones, comisiones y bonificaciones) y se resta el capital recibido."
+        )
+        origen_descuento = st.radio("Descuento:", ("Tipo fijo", "Curva de tipos (fichero)"), horizontal=True, key="cmp_va_origen")
+        if origen_descuento == "Tipo fijo":
+            tasa_descuento = st.number_input("Tipo de descuento anual (%):", min_value=-2.0, max_value=15.0, value=3.0,
+                                             step=0.1, key="cmp_va_tasa",
+                                             help="Rentabilidad que obtendrías con tu dinero, p. ej. un depósito o letras.")
+        else:
+            ruta_curva = st.text_input(
+                "Fichero CSV con la curva de tipos:", value="datos/curva_descuento.csv", key="cmp_va_curva",
+                help="Dos columnas: plazo en años y tipo cero anual en %. Entre plazos se interpola linealmente."
+            )
+        inflacion = st.number_input("Inflación anual prevista (%):", min_value=-2.0, max_value=15.0, value=2.0,
+                                    step=0.1, key="cmp_va_inflacion")
+    descuentos = None
+    if calcular_va:
+        curva = None
+        if origen_descuento != "Tipo fijo":
+            try:
+                curva = cargar_curva_descuento(ruta_curva)
+            except (OSError, ValueError) as e:
+                st.error(f"No se pudo cargar la curva de tipos: {e}")
+                st.stop()
+        descuentos = matriz_descuentos(tasa_descuento if curva is None else 0.0, curva, inflacion)
+
     if st.button("Comparar ofertas (con costes y bonificaciones)"):
         resultados = []
-        for cfg in ofertas_cfg:
-            if cfg["tipo"] == "Fija":
-                res = simulate_offer(
-                    tipo="Fija",
-                    principal=cfg["principal"], years=cfg["years"],
-                    tin_fija=cfg["tin_fija"],
-                    bonus_pp=cfg["bonus_pp"], bonus_cost_anual=cfg["bonus_cost_anual"],
-                    com_apertura_pct=cfg["com_apertura_pct"], com_apertura_fija=cfg["com_apertura_fija"],
-                    com_amort_parcial_pct=cfg["com_amort_parcial_pct"],
-                    amortizaciones=cfg["amortizaciones"]
-                )
-            else:
-                res = simulate_offer(
-                    tipo="Mixta",
-                    principal=cfg["principal"], years=cfg["years"],
-                    years_fixed=cfg["years_fixed"], tin_fijo_mixta=cfg["tin_fijo_mixta"],
-                    euribor=cfg["euribor"], diferencial=cfg["diferencial"],
-                    bonus_pp=cfg["bonus_pp"], bonus_cost_anual=cfg["bonus_cost_anual"],
-                    com_apertura_pct=cfg["com_apertura_pct"], com_apertura_fija=cfg["com_apertura_fija"],
-                    com_amort_parcial_pct=cfg["com_amort_parcial_pct"],
-                    amortizaciones=cfg["amortizaciones"]
-                )
-
+        sensibilidades = []
+        curvas_coste = []
+        progreso = st.progress(0.0, text="Evaluando ofertas…")
+        parcial = st.empty()
+        for i, res in evaluar_ofertas(ofertas_cfg, n_workers=n_workers or None, coste_mensual=True,
+                                      descuentos=descuentos, sensibilidades=calcular_sens):
+            cfg = ofertas_cfg[i]
+            curvas_coste.append(res["coste_acumulado"])
             resultados.append({
                 "Oferta": cfg["nombre"],
                 "Tipo": cfg["tipo"],
@@ -2201,20 +2482,43 @@ elif pagina == "Comparador de Ofertas":
                 "Coste amortizaciones (€)": res["coste_amort_parcial"],
                 "Coste bonificaciones (€)": res["coste_bonificaciones"],
                 "Coste total (€)": res["total_coste"],
-                "Meses pagados": res["meses_pagados"]
+                "Meses pagados": res["meses_pagados"],
+                **columnas_coste_descontado(res)
             })
+            # Derivadas por +1 p.p. de simulate_offer, escaladas a +0,1 p.p.
+            if calcular_sens:
+                sensibilidades.append({
+                    "Oferta": cfg["nombre"],
+                    "Tipo": cfg["tipo"],
+                    "Intereses: TIN fijo": res["sens_intereses_tin"] * PASO_SENSIBILIDAD,
+                    "Intereses: Euríbor": res["sens_intereses_euribor"] * PASO_SENSIBILIDAD,
+                    "Intereses: diferencial": res["sens_intereses_diferencial"] * PASO_SENSIBILIDAD,
+                    "Cuota inicial: TIN fijo": res["sens_cuota_inicial_tin"] * PASO_SENSIBILIDAD,
+                    "Cuota variable: Euríbor": res["sens_cuota_variable_euribor"] * PASO_SENSIBILIDAD,
+                    "Cuota variable: diferencial": res["sens_cuota_variable_diferencial"] * PASO_SENSIBILIDAD
+                })
+            progreso.progress(len(resultados) / len(ofertas_cfg), text=f"Evaluadas {len(resultados)} de {len(ofertas_cfg)} ofertas…")
+            parcial.dataframe(pd.DataFrame(resultados), column_config=config_columnas(FORMATOS_OFERTAS),
+                              use_container_width=True, hide_index=True)
+        progreso.empty()
+        parcial.empty()
 
         df = pd.DataFrame(resultados)
         st.success("¡Comparativa completada!")
         st.write("### Resumen con costes incluidos")
-        st.dataframe(df.style.format({
-            "Cuota inicial (€)": "{:,.2f}",
-            "Intereses totales (€)": "{:,.2f}",
-            "Coste apertura (€)": "{:,.2f}",
-            "Coste amortizaciones (€)": "{:,.2f}",
-            "Coste bonificaciones (€)": "{:,.2f}",
-            "Coste total (€)": "{:,.2f}"
-        }), use_container_width=True)
+        mostrar_tabla(df, FORMATOS_OFERTAS)
+        if descuentos is not None:
+            st.caption("Coste VA: pagos descontados al tipo o curva elegidos menos el capital recibido. "
+                       "Coste real: lo mismo en euros de hoy, deflactando por la inflación prevista.")
+
+        if calcular_sens:
+            st.write("### Sensibilidad a los tipos (€ por +0,1 puntos)")
+            st.caption("Cuánto sube cada importe si el tipo indicado sube 0,1 puntos, sin volver a simular "
+                       "(derivada exacta del cálculo, válida para cambios pequeños). En las mixtas el Euríbor y el "
+                       "diferencial solo afectan a la fase variable.")
+            df_sens = pd.DataFrame(sensibilidades)
+            mostrar_tabla(df_sens, {c: FORMATO_EUROS for c in df_sens.columns if c not in ("Oferta", "Tipo")},
+                          hide_index=True)
 
         # Ranking por coste total
         df_sorted = df.sort_values("Coste total (€)")
@@ -2232,6 +2536,206 @@ elif pagina == "Comparador de Ofertas":
         )
         st.plotly_chart(fig, use_container_width=True)
 
+        # Coste acumulado mes a mes y meses en los que se cruzan las ofertas
+        st.write("### Coste acumulado mes a mes")
+        acumulado = alinear_costes(curvas_coste)
+        cruces = meses_cruce(acumulado)
+        nombres = df["Oferta"].to_numpy()
+        anios_eje = np.arange(1, acumulado.shape[1] + 1) / 12
+        fig = go.Figure()
+        for i, nombre in enumerate(nombres):
+            fig.add_trace(go.Scatter(x=anios_eje, y=acumulado[i], mode="lines", name=nombre))
+        if len(cruces["mes"]):
+            fig.add_trace(go.Scatter(
+                x=cruces["mes"] / 12, y=acumulado[cruces["a"], cruces["mes"] - 1],
+                mode="markers", name="Cruces", marker=dict(symbol="x", size=10, color="black"),
+                text=[f"Mes {m}: {nombres[x]} / {nombres[y]}" for m, x, y in zip(cruces["mes"], cruces["a"], cruces["b"])],
+                hovertemplate="%{text}<extra></extra>"
+            ))
+        fig.update_layout(
+            xaxis_title="Años desde la firma",
+            yaxis_title="Coste acumulado (€)",
+            hovermode="x unified",
+            title="Intereses + apertura + amortizaciones + bonificaciones acumulados"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        if len(cruces["mes"]):
+            st.dataframe(pd.DataFrame({
+                "Mes": cruces["mes"],
+                "Año": (cruces["mes"] - 1) // 12 + 1,
+                "Más barata hasta entonces": nombres[cruces["barata_antes"]],
+                "Pasa a ser más barata": nombres[np.where(cruces["barata_antes"] == cruces["a"], cruces["b"], cruces["a"])],
+            }).sort_values("Mes"), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Ninguna oferta adelanta a otra: el orden de coste acumulado es el mismo todos los meses.")
+
+    # ---------- Prueba de estrés de Euríbor ----------
+    st.divider()
+    st.subheader("Prueba de estrés de Euríbor")
+    st.caption("Desplaza el Euríbor estimado de cada oferta mixta y mira cómo cambia el ranking. Las ofertas fijas no se ven afectadas.")
+    with st.expander("Configuración de escenarios"):
+        c1, c2, c3 = st.columns(3)
+        shock_desde = c1.number_input("Desde (p.p.):", min_value=-5.0, max_value=0.0, value=-1.0, step=0.25, key="cmp_shock_desde")
+        shock_hasta = c2.number_input("Hasta (p.p.):", min_value=0.0, max_value=10.0, value=4.0, step=0.25, key="cmp_shock_hasta")
+        shock_paso = c3.number_input("Paso (p.p.):", min_value=0.05, max_value=2.0, value=0.25, step=0.05, key="cmp_shock_paso")
+        con_rampas = st.checkbox("Añadir escenarios en rampa", value=True, key="cmp_rampas",
+                                 help="El mismo desplazamiento, alcanzado de forma gradual en vez de desde el primer mes.")
+        años_rampa = st.number_input("Años hasta alcanzar el desplazamiento:", min_value=1, max_value=40, value=5, key="cmp_anios_rampa")
+
+    if st.button("Ejecutar prueba de estrés"):
+        desplazamientos = np.round(np.arange(shock_desde, shock_hasta + shock_paso / 2, shock_paso), 4)
+        lote = lote_ofertas(ofertas_cfg)
+        n_meses = int(lote["n_total"].max())
+        nombres_esc, tipos_esc, valores_esc, trayectorias = escenarios_estres(
+            desplazamientos, n_meses, años_rampa if con_rampas else None
+        )
+        with st.spinner(f"Simulando {len(ofertas_cfg) * len(nombres_esc)} combinaciones oferta × escenario…"):
+            estres = estres_ofertas(lote, trayectorias)
+        costes = estres["total_coste"]
+        puestos = estabilidad_ranking(costes)
+        puesto_base = estabilidad_ranking(simular_lote(lote)["total_coste"][:, None])[:, 0]
+
+        df_rank = pd.DataFrame({
+            "Oferta": lote["nombre"],
+            "Tipo": np.where(lote["mixta"], "Mixta", "Fija"),
+            "Puesto base": puesto_base,
+            "Mejor puesto": puestos.min(axis=1),
+            "Peor puesto": puestos.max(axis=1),
+            "% escenarios en 1ª posición": (puestos == 1).mean(axis=1) * 100,
+            "Coste mínimo (€)": costes.min(axis=1),
+            "Coste máximo (€)": costes.max(axis=1),
+        }).sort_values("Puesto base")
+        st.success(f"¡Prueba de estrés completada! ({len(nombres_esc)} escenarios)")
+        st.write("### Estabilidad del ranking")
+        mostrar_tabla(df_rank, {
+            "% escenarios en 1ª posición": "%.1f %%",
+            "Coste mínimo (€)": FORMATO_IMPORTE,
+            "Coste máximo (€)": FORMATO_IMPORTE
+        }, hide_index=True)
+
+        st.write("### Coste total según el desplazamiento del Euríbor")
+        fig = go.Figure()
+        colores = plotly.colors.qualitative.Plotly
+        for i, nombre in enumerate(lote["nombre"]):
+            for tipo_esc, estilo in (("Paralelo", "solid"), ("Rampa", "dash")):
+                sel = tipos_esc == tipo_esc
+                if not sel.any():
+                    continue
+                fig.add_trace(go.Scatter(
+                    x=valores_esc[sel], y=costes[i, sel],
+                    mode="lines+markers", name=f"{nombre} ({tipo_esc.lower()})",
+                    line=dict(color=colores[i % len(colores)], dash=estilo)
+                ))
+        fig.add_vline(x=0, line_dash="dot", line_color="gray")
+        fig.update_layout(
+            xaxis_title="Desplazamiento del Euríbor (p.p.)",
+            yaxis_title="Coste total (€)",
+            hovermode="x unified"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    # ---------- Monte Carlo del Euríbor ----------
+    st.divider()
+    st.subheader("Monte Carlo del Euríbor")
+    st.caption("Simula miles de trayectorias aleatorias del Euríbor (con reversión a la media) y compara el coste de "
+               "las ofertas en todas ellas. Las ofertas fijas no dependen del Euríbor.")
+    with st.expander("Modelo del Euríbor y método"):
+        mc_modelo, mc_caminos, mc_opciones = controles_montecarlo("cmp_mc")
+
+    if st.button("Ejecutar Monte Carlo"):
+        lote = lote_ofertas(ofertas_cfg)
+        with st.spinner(f"Simulando {len(ofertas_cfg)} ofertas × hasta {mc_caminos:,} trayectorias…"):
+            mc = montecarlo_euribor(lote, mc_caminos, mc_modelo, **mc_opciones)
+        mejor = int(np.argmin(mc["media"]))
+        df_mc = pd.DataFrame({
+            "Oferta": lote["nombre"],
+            "Tipo": np.where(lote["mixta"], "Mixta", "Fija"),
+            "Coste medio (€)": mc["media"],
+            "Error estándar (€)": mc["error_estandar"],
+            "Sobrecoste vs. mejor (€)": mc["media"] - mc["media"][mejor],
+            "Error del sobrecoste (€)": mc["error_diferencias"][:, mejor],
+            "P(más barata) (%)": mc["prob_mejor"] * 100,
+            "Desviación (€)": mc["desviacion"],
+            "Coste mínimo (€)": mc["minimo"],
+            "Coste máximo (€)": mc["maximo"],
+        }).sort_values("Coste medio (€)")
+        resumen_parada_montecarlo(mc, mc_caminos)
+        mostrar_tabla(df_mc, {
+            "Coste medio (€)": FORMATO_IMPORTE,
+            "Error estándar (€)": FORMATO_IMPORTE,
+            "Sobrecoste vs. mejor (€)": FORMATO_IMPORTE,
+            "Error del sobrecoste (€)": FORMATO_IMPORTE,
+            "P(más barata) (%)": "%.1f %%",
+            "Desviación (€)": FORMATO_IMPORTE,
+            "Coste mínimo (€)": FORMATO_IMPORTE,
+            "Coste máximo (€)": FORMATO_IMPORTE
+        }, hide_index=True)
+        st.caption("El error estándar mide la incertidumbre de la simulación en el coste medio; la desviación, cuánto varía "
+                   "el coste de una trayectoria de Euríbor a otra. Como todas las ofertas comparten trayectorias, el error "
+                   "del sobrecoste es mucho menor que el de cada coste por separado.")
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=np.arange(len(mc["euribor_medio"])) / 12, y=mc["euribor_medio"],
+                                 mode="lines", name="Euríbor medio"))
+        fig.update_layout(xaxis_title="Años desde la firma", yaxis_title="Euríbor medio simulado (%)")
+        st.plotly_chart(fig, use_container_width=True)
+
+    # ---------- Importar ofertas desde fichero ----------
+    st.divider()
+    st.subheader("Importar ofertas desde fichero")
+    st.caption("Carga cualquier número de ofertas en CSV o JSON y compáralas todas a la vez.")
+    with st.expander("Formato del fichero"):
+        st.markdown("""
+        Una fila (CSV) u objeto (JSON) por oferta, con las columnas:
+        `nombre`, `tipo` (Fija/Mixta), `principal`, `years`, `tin_fija` (fijas),
+        `years_fixed`, `tin_fijo_mixta`, `euribor`, `diferencial` (mixtas) y, opcionalmente,
+        `bonus_pp`, `bonus_cost_anual`, `bonus_pct_saldo` (prima anual en % del capital pendiente),
+        `com_apertura_pct`, `com_apertura_fija`, `com_amort_parcial_pct`
+        y `amortizaciones` (en CSV: `anio:importe:modo;anio:importe:modo`).
+        """)
+        st.download_button(
+            label="Descargar plantilla (CSV)",
+            data=PLANTILLA_CSV.encode("utf-8"),
+            file_name="plantilla_ofertas.csv",
+            mime="text/csv"
+        )
+    fichero_ofertas = st.file_uploader("Fichero de ofertas:", type=["csv", "json"], key="cmp_fichero")
+
+    if fichero_ofertas is not None:
+        try:
+            with st.spinner("Validando y evaluando ofertas…"):
+                df_fich, errores_fich = comparar_ofertas_fichero(fichero_ofertas.getvalue(), fichero_ofertas.name,
+                                                                  descuentos)
+        except (ValueError, KeyError) as e:
+            st.error(f"No se pudo leer el fichero: {e}")
+            st.stop()
+
+        if errores_fich:
+            st.warning(f"Se han descartado {len(errores_fich)} filas con errores.")
+            with st.expander("Ver errores"):
+                st.write("\n".join(f"- {e}" for e in errores_fich[:200]))
+        if df_fich.empty:
+            st.stop()
+        st.success(f"{len(df_fich)} ofertas evaluadas.")
+
+        columnas_orden = [c for c in df_fich.columns if c not in ("Oferta", "Tipo", "Fila")]
+        c1, c2, c3 = st.columns(3)
+        orden = c1.selectbox("Ordenar por:", columnas_orden, index=columnas_orden.index("Coste total (€)"), key="cmp_fich_orden")
+        ascendente = c2.checkbox("Ascendente", value=True, key="cmp_fich_asc")
+        top_k = c3.number_input("Mostrar las mejores:", min_value=1, max_value=len(df_fich),
+                                value=min(50, len(df_fich)), step=10, key="cmp_fich_topk")
+        df_top = df_fich.nsmallest(int(top_k), orden) if ascendente else df_fich.nlargest(int(top_k), orden)
+
+        tam_pagina = st.selectbox("Filas por página:", [10, 25, 50, 100], index=1, key="cmp_fich_tam")
+        mostrar_tabla(df_top, FORMATOS_OFERTAS, clave_pagina="cmp_fich_pag", tam_pagina=tam_pagina, hide_index=True)
+
+        st.download_button(
+            label="Descargar resultados (Excel)",
+            data=descargar_df(df_fich.sort_values("Puesto")),
+            file_name="comparativa_ofertas.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
 
 
 # =============================
@@ -2272,11 +2776,31 @@ elif pagina == "Bonificaciones":
             nombre = st.text_input("Nombre de la bonificación", key=f"boni_nombre_{b}", help="Introduce el nombre del producto o gasto bonificado.")
         else:
             nombre = b
-        sobrecoste = st.number_input(
-            f"Sobrecoste anual de {nombre} (€):",
-            min_value=0.0, value=0.0, step=50.0, key=f"boni_sc_{b}",
-            help="Coste anual extra por contratar este producto."
+        tipo_coste = st.radio(
+            f"Coste de {nombre}:",
+            ("Importe anual", "% del capital pendiente"),
+            horizontal=True, key=f"boni_tipo_coste_{b}",
+            help="Los seguros de vida suelen cobrar una prima proporcional al capital pendiente, que baja a medida que amortizas."
         )
+        sobrecoste, subida_pct, pct_saldo = 0.0, 0.0, 0.0
+        if tipo_coste == "Importe anual":
+            c1, c2 = st.columns(2)
+            sobrecoste = c1.number_input(
+                f"Sobrecoste anual de {nombre} (€):",
+                min_value=0.0, value=0.0, step=50.0, key=f"boni_sc_{b}",
+                help="Coste anual extra por contratar este producto."
+            )
+            subida_pct = c2.number_input(
+                "Subida anual del coste (%):",
+                min_value=0.0, max_value=20.0, value=0.0, step=0.5, key=f"boni_subida_{b}",
+                help="Por ejemplo, primas que suben con la edad."
+            )
+        else:
+            pct_saldo = st.number_input(
+                f"Prima anual de {nombre} (% del capital pendiente):",
+                min_value=0.0, max_value=5.0, value=0.25, step=0.01, key=f"boni_pct_{b}",
+                help="Se aplica al capital pendiente al empezar cada año."
+            )
         bonifica = st.number_input(
             f"Bonificación en el tipo de interés de {nombre} (%):",
             min_value=0.0, max_value=2.0, value=0.1, step=0.01, key=f"boni_b_{b}",
@@ -2285,6 +2809,8 @@ elif pagina == "Bonificaciones":
         bonificaciones.append({
             "nombre": nombre,
             "sobrecoste": sobrecoste,
+            "subida_pct": subida_pct,
+            "pct_saldo": pct_saldo,
             "bonifica": bonifica
         })
 
@@ -2292,62 +2818,42 @@ elif pagina == "Bonificaciones":
 
     if st.button("Calcular si compensa"):
         n = int(years * 12)
-        r_sin = (interest / 100) / 12
-        cuota_sin = principal * (r_sin * (1 + r_sin) ** n) / ((1 + r_sin) ** n - 1)
-        pendiente_sin = principal
-
-        intereses_anuales_sin = []
-        for year in range(1, years + 1):
-            intereses_anual = 0
-            for mes in range(12):
-                interes_mes = pendiente_sin * r_sin
-                capital_mes = cuota_sin - interes_mes
-                intereses_anual += interes_mes
-                pendiente_sin -= capital_mes
-                if pendiente_sin < 0:
-                    pendiente_sin = 0
-            intereses_anuales_sin.append(intereses_anual)
-
         total_bonificacion = sum(b["bonifica"] for b in bonificaciones)
-        total_sobrecoste_anual = sum(b["sobrecoste"] for b in bonificaciones)
-        r_con = ((interest - total_bonificacion) / 100) / 12
-        cuota_con = principal * (r_con * (1 + r_con) ** n) / ((1 + r_con) ** n - 1)
-        pendiente_con = principal
-
-        intereses_anuales_con = []
-        for year in range(1, years + 1):
-            intereses_anual = 0
-            for mes in range(12):
-                interes_mes = pendiente_con * r_con
-                capital_mes = cuota_con - interes_mes
-                intereses_anual += interes_mes
-                pendiente_con -= capital_mes
-                if pendiente_con < 0:
-                    pendiente_con = 0
-            intereses_anuales_con.append(intereses_anual)
-
-        intereses_ahorrados_anual = np.array(intereses_anuales_sin) - np.array(intereses_anuales_con)
-        ahorro_neto_anual = intereses_ahorrados_anual - total_sobrecoste_anual
+        r_sin = (interest / 100) / 12
+        r_con = (max(0.0, interest - total_bonificacion) / 100) / 12
+        # Sin y con bonificaciones en una sola llamada; el saldo de "con" da las primas sobre capital
+        cuadros = cuadro_anual([principal, principal], n, n, [r_sin, r_con], [r_sin, r_con])
+        intereses_anuales_sin = cuadros["Intereses pagados"][0]
+        intereses_anuales_con = cuadros["Intereses pagados"][1]
+        saldo_inicio_con = np.concatenate(([principal], cuadros["Capital pendiente"][1, :-1]))
+        anios_idx = np.arange(years)
+        sobrecoste_anual = np.zeros(years)
+        for b in bonificaciones:
+            sobrecoste_anual += b["sobrecoste"] * (1 + b["subida_pct"] / 100) ** anios_idx + b["pct_saldo"] / 100 * saldo_inicio_con
+        total_sobrecoste_anual = sobrecoste_anual.sum()
+
+        intereses_ahorrados_anual = intereses_anuales_sin - intereses_anuales_con
+        ahorro_neto_anual = intereses_ahorrados_anual - sobrecoste_anual
 
         df = pd.DataFrame({
             "Año": np.arange(1, years+1),
             "Intereses ahorrados ese año": intereses_ahorrados_anual,
-            "Sobrecoste anual": [total_sobrecoste_anual]*years,
+            "Sobrecoste anual": sobrecoste_anual,
             "Ahorro neto anual": ahorro_neto_anual
         })
 
         st.success("¡Cálculo realizado!")
         st.write(f"**Intereses totales SIN bonificaciones:** {sum(intereses_anuales_sin):,.2f} €")
         st.write(f"**Intereses totales CON bonificaciones:** {sum(intereses_anuales_con):,.2f} €")
-        st.write(f"**Sobrecoste anual total por bonificaciones:** {total_sobrecoste_anual:,.2f} €")
+        st.write(f"**Sobrecoste total por bonificaciones (todo el plazo):** {total_sobrecoste_anual:,.2f} €")
 
         st.divider()
         st.write("### Evolución del ahorro neto anual")
-        st.dataframe(df.style.format({
-            "Intereses ahorrados ese año": "{:,.2f} €",
-            "Sobrecoste anual": "{:,.2f} €",
-            "Ahorro neto anual": "{:,.2f} €"
-        }), use_container_width=True)
+        mostrar_tabla(df, {
+            "Intereses ahorrados ese año": FORMATO_EUROS,
+            "Sobrecoste anual": FORMATO_EUROS,
+            "Ahorro neto anual": FORMATO_EUROS
+        })
 
         st.write("### Gráfico de ahorro neto anual")
         fig = go.Figure()
@@ -2364,13 +2870,65 @@ elif pagina == "Bonificaciones":
         )
         st.plotly_chart(fig, use_container_width=True)
 
+    # ---------- Estrategia óptima (se recalcula en vivo) ----------
+    if bonificaciones:
+        st.divider()
+        st.subheader("Estrategia óptima de bonificaciones")
+        st.caption(f"Se evalúan las {2 ** len(bonificaciones)} combinaciones de productos × cada año en que podrías "
+                   "abandonarlos (al abandonarlos se vuelve al tipo sin bonificar y se recalcula la cuota).")
+        nombres_boni = np.array([b["nombre"] or f"Producto {i+1}" for i, b in enumerate(bonificaciones)], dtype=object)
+        opt = optimizar_bonificaciones(
+            principal, int(years * 12), interest,
+            [b["bonifica"] for b in bonificaciones], [b["sobrecoste"] for b in bonificaciones],
+            pct_saldo=[b["pct_saldo"] for b in bonificaciones], subida_pct=[b["subida_pct"] for b in bonificaciones]
+        )
+        s_mejor, d_mejor = opt["mejor"]
+        idx_mejor = d_mejor - 1
+        coste_ninguno = opt["total"][0, 0]
+        coste_todos = opt["total"][-1, -1]
+        coste_mejor = opt["total"][s_mejor, idx_mejor]
+        productos_mejor = nombres_boni[opt["mascaras"][s_mejor]]
+
+        if len(productos_mejor) == 0:
+            st.success("Lo más barato es no contratar ningún producto.")
+        elif d_mejor > years:
+            st.success(f"Lo más barato: contratar {', '.join(productos_mejor)} durante todo el plazo.")
+        else:
+            st.success(f"Lo más barato: contratar {', '.join(productos_mejor)} y abandonarlos al empezar el año {d_mejor}.")
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Coste estrategia óptima", f"{coste_mejor:,.2f} €")
+        c2.metric("Sin bonificaciones", f"{coste_ninguno:,.2f} €", delta=f"{coste_ninguno - coste_mejor:,.2f} € más", delta_color="off")
+        c3.metric("Todas, todo el plazo", f"{coste_todos:,.2f} €", delta=f"{coste_todos - coste_mejor:,.2f} € más", delta_color="off")
+        st.caption("Coste = intereses + coste anual de los productos mientras se mantienen.")
+
+        st.write("### Valor marginal de cada producto")
+        st.caption("Partiendo de la estrategia óptima (mismo año de abandono): ahorro que aporta cada producto. "
+                   "Negativo = sale más caro de lo que ahorra.")
+        mostrar_tabla(pd.DataFrame({
+            "Producto": nombres_boni,
+            "En la estrategia óptima": np.where(opt["mascaras"][s_mejor], "Sí", "No"),
+            "Valor marginal (€)": opt["marginal"],
+        }), {"Valor marginal (€)": FORMATO_EUROS}, hide_index=True)
+
+        st.write("### Mejores estrategias")
+        orden = np.argsort(opt["total"], axis=None)[:10]
+        subconj, col_abandono = np.unravel_index(orden, opt["total"].shape)
+        mostrar_tabla(pd.DataFrame({
+            "Productos": [", ".join(nombres_boni[opt["mascaras"][s_]]) or "Ninguno" for s_ in subconj],
+            "Hasta": ["Todo el plazo" if opt["abandono"][d_] > years else f"Año {opt['abandono'][d_]}" for d_ in col_abandono],
+            "Intereses (€)": opt["intereses"][subconj, col_abandono],
+            "Coste productos (€)": opt["coste_productos"][subconj, col_abandono],
+            "Coste total (€)": opt["total"][subconj, col_abandono],
+        }), {c: FORMATO_EUROS for c in ("Intereses (€)", "Coste productos (€)", "Coste total (€)")}, hide_index=True)
+
 
 # =============================
 # 7. PÁGINA SUBROGACIÓN
 # =============================
 elif pagina == "Subrogación":
     st.title("¿Compensa subrogar tu hipoteca fija?")
-    st.info("Compara el coste y el ahorro de cambiar tu hipoteca fija a otra entidad, incluyendo los gastos de subrogación.")
+    st.info("Compara el coste y el ahorro de cambiar tu hipoteca fija a otra entidad, renegociarla con tu banco o "
+            "cancelarla y firmar otra, incluyendo gastos y comisiones de cada operación.")
     st.divider()
 
     # --- Tu hipoteca actual
@@ -2399,103 +2957,234 @@ elif pagina == "Subrogación":
     # Cálculo de capital pendiente hoy
     n_total = int(años_totales * 12)
     n_pasados = int((año_actual - 1) * 12)
+    n_restantes_actual = n_total - n_pasados
     r_actual = (tipo_actual / 100) / 12
-    cuota_actual = (importe_inicial / n_total) if r_actual == 0 else (
-        importe_inicial * (r_actual * (1 + r_actual) ** n_total) / ((1 + r_actual) ** n_total - 1)
-    )
-    pendiente_hoy = importe_inicial
-    for _ in range(n_pasados):
-        interes_mes = pendiente_hoy * r_actual
-        capital_mes = cuota_actual - interes_mes
-        pendiente_hoy -= capital_mes
-        if pendiente_hoy < 0:
-            pendiente_hoy = 0.0
+    cuota_actual = cuota_francesa(importe_inicial, r_actual, n_total)
+    pendiente_hoy = max(0.0, saldo_tras(importe_inicial, r_actual, cuota_actual, n_pasados))
 
     st.write(f"**Capital pendiente estimado:** {pendiente_hoy:,.2f} €")
+    st.write(f"**Plazo restante:** {n_restantes_actual // 12} años ({n_restantes_actual} meses)")
     st.divider()
 
-    # --- Hipoteca alternativa
-    st.header("Hipoteca alternativa (tras subrogación)")
-    tipo_nuevo = st.number_input(
-        "Tipo de interés alternativo (%):",
-        min_value=0.0, max_value=20.0, value=2.0, step=0.1, key="sub_tin_new",
-        help="TIN de la nueva hipoteca."
-    )
-    años_restantes = st.number_input(
-        "Plazo restante (años):",
-        min_value=1, max_value=40, value=max(1, años_totales - año_actual + 1), key="sub_anios_rest",
-        help="Años que te quedarían por pagar tras subrogar."
-    )
-    gastos_subrogacion = st.number_input(
-        "Coste de subrogación (€):",
-        min_value=0.0, max_value=20000.0, value=1500.0, step=100.0, key="sub_gastos",
-        help="Notaría, gestoría, tasación, etc."
-    )
+    # --- Alternativas
+    st.header("Alternativas")
+    st.caption(
+        "Cada alternativa parte del capital pendiente de hoy con su propio tipo, plazo y costes: "
+        "subrogación a otro banco, novación con tu banco o cancelar y firmar una hipoteca nueva."
+    )
+    tipos_alternativa = ["Subrogación", "Novación", "Cancelación y nueva hipoteca"]
+    num_alternativas = st.number_input(
+        "¿Cuántas alternativas quieres comparar?", min_value=1, max_value=10, value=1, key="sub_n_alt"
+    )
+    alternativas = []
+    for i in range(int(num_alternativas)):
+        st.subheader(f"Alternativa {i+1}")
+        col1, col2 = st.columns(2)
+        with col1:
+            tipo_alt = st.selectbox(f"Operación {i+1}:", tipos_alternativa, key=f"sub_tipo_{i}")
+            nombre_alt = st.text_input(f"Nombre {i+1}:", value=f"Alternativa {i+1}", key=f"sub_nombre_{i}")
+            tipo_nuevo = st.number_input(
+                f"Tipo de interés {i+1} (%):",
+                min_value=0.0, max_value=20.0, value=2.0, step=0.1, key=f"sub_tin_new_{i}",
+                help="TIN de la hipoteca tras la operación."
+            )
+        with col2:
+            años_alt = st.number_input(
+                f"Plazo {i+1} (años):",
+                min_value=1, max_value=40, value=max(1, años_totales - año_actual + 1), key=f"sub_anios_rest_{i}",
+                help="Años que quedarían por pagar tras la operación."
+            )
+            gastos_alt = st.number_input(
+                f"Gastos {i+1} (€):",
+                min_value=0.0, max_value=20000.0, value=1500.0 if tipo_alt != "Novación" else 500.0, step=100.0,
+                key=f"sub_gastos_{i}",
+                help="Notaría, gestoría, tasación, registro, apertura de la nueva hipoteca..."
+            )
+            comision_alt = st.number_input(
+                f"Comisión {i+1} (% del capital pendiente):",
+                min_value=0.0, max_value=5.0, value=0.0, step=0.05, key=f"sub_comision_{i}",
+                help="Compensación por subrogación o cancelación anticipada, o comisión de novación. "
+                     "En una fija, la ley la limita al 2 % los 10 primeros años y al 1,5 % después."
+            )
+        alternativas.append({
+            "nombre": nombre_alt, "tipo": tipo_alt, "tin": tipo_nuevo, "meses": int(años_alt * 12),
+            "gastos": gastos_alt, "comision": comision_alt,
+        })
 
     st.divider()
 
     # Botón con key única
     if st.button("Comparar escenarios", key="sub_btn_compare"):
         # Validaciones rápidas
-        if años_restantes <= 0 or pendiente_hoy <= 0:
+        if n_restantes_actual <= 0 or pendiente_hoy <= 0:
             st.warning("Revisa los datos: plazo restante debe ser > 0 y el capital pendiente también.")
         else:
             with st.spinner("Calculando…"):
-                n_restantes = int(años_restantes * 12)
-
-                # Escenario 1: te quedas como estás
-                intereses_restantes = 0.0
-                cap_pend = pendiente_hoy
-                for _ in range(n_restantes):
-                    interes_mes = cap_pend * r_actual
-                    capital_mes = cuota_actual - interes_mes
-                    intereses_restantes += interes_mes
-                    cap_pend -= capital_mes
-                    if cap_pend < 0:
-                        cap_pend = 0.0
-                total_restante = intereses_restantes + pendiente_hoy
-
-                # Escenario 2: subrogas
-                r_nuevo = (tipo_nuevo / 100) / 12
-                cuota_nueva = (pendiente_hoy / n_restantes) if r_nuevo == 0 else (
-                    pendiente_hoy * (r_nuevo * (1 + r_nuevo) ** n_restantes) / ((1 + r_nuevo) ** n_restantes - 1)
+                res = comparar_alternativas(
+                    pendiente_hoy, r_actual, n_restantes_actual,
+                    [a["tin"] for a in alternativas], [a["meses"] for a in alternativas],
+                    [a["gastos"] for a in alternativas], [a["comision"] for a in alternativas],
                 )
-                intereses_nuevos = 0.0
-                cap_pend = pendiente_hoy
-                for _ in range(n_restantes):
-                    interes_mes = cap_pend * r_nuevo
-                    capital_mes = cuota_nueva - interes_mes
-                    intereses_nuevos += interes_mes
-                    cap_pend -= capital_mes
-                    if cap_pend < 0:
-                        cap_pend = 0.0
-                total_nuevo = intereses_nuevos + pendiente_hoy + gastos_subrogacion
-
-                ahorro_total = total_restante - total_nuevo
+                orden = res["orden"]
+                mejor = int(orden[0])
 
             st.success("¡Comparativa realizada!")
             col1, col2 = st.columns(2)
             with col1:
-                st.write("**Escenario 1: No subrogas**")
-                st.write(f"- Cuota mensual: {cuota_actual:,.2f} €")
-                st.write(f"- Intereses por pagar: {intereses_restantes:,.2f} €")
-                st.write(f"- Total a pagar (incl. capital): {total_restante:,.2f} €")
+                st.write("**Sin cambios: sigues con tu hipoteca**")
+                st.write(f"- Cuota mensual: {res['cuota_actual']:,.2f} €")
+                st.write(f"- Intereses por pagar: {res['intereses_actuales']:,.2f} €")
+                st.write(f"- Total a pagar (incl. capital): {res['intereses_actuales'] + pendiente_hoy:,.2f} €")
             with col2:
-                st.write("**Escenario 2: Subrogas**")
-                st.write(f"- Nueva cuota mensual: {cuota_nueva:,.2f} €")
-                st.write(f"- Intereses por pagar: {intereses_nuevos:,.2f} €")
-                st.write(f"- Total a pagar (capital + intereses + gastos): {total_nuevo:,.2f} €")
-
-            st.write(f"### Ahorro total con la subrogación: {ahorro_total:,.2f} €")
+                st.write(f"**Mejor alternativa: {alternativas[mejor]['nombre']}**")
+                st.write(f"- Nueva cuota mensual: {res['cuota'][mejor]:,.2f} €")
+                st.write(f"- Intereses por pagar: {res['intereses'][mejor]:,.2f} €")
+                st.write(f"- Total a pagar (capital + intereses + costes): "
+                         f"{res['intereses'][mejor] + pendiente_hoy + res['coste_operacion'][mejor]:,.2f} €")
+
+            if res["ahorro"][mejor] > 0:
+                st.write(f"### Ahorro neto con {alternativas[mejor]['nombre']}: {res['ahorro'][mejor]:,.2f} €")
+            else:
+                st.write("### Ninguna alternativa compensa: te conviene seguir con tu hipoteca.")
+
+            df_alt = pd.DataFrame({
+                "Puesto": np.arange(1, len(orden) + 1),
+                "Alternativa": [alternativas[i]["nombre"] for i in orden],
+                "Operación": [alternativas[i]["tipo"] for i in orden],
+                "TIN (%)": [alternativas[i]["tin"] for i in orden],
+                "Plazo (años)": [alternativas[i]["meses"] // 12 for i in orden],
+                "Cuota (€)": res["cuota"][orden],
+                "Intereses (€)": res["intereses"][orden],
+                "Gastos y comisiones (€)": res["coste_operacion"][orden],
+                "Ahorro neto (€)": res["ahorro"][orden],
+                "Recuperación (meses)": res["mes_recuperacion"][orden],
+            })
+            mostrar_tabla(df_alt, FORMATOS_ALTERNATIVAS, hide_index=True)
+            st.caption(
+                "Ahorro neto = intereses que dejas de pagar − gastos y comisiones de la operación. "
+                "Recuperación: mes a partir del cual el ahorro acumulado ya no vuelve a ser negativo."
+            )
             st.divider()
 
             # Grafico
             fig = go.Figure()
+            for i in orden:
+                fig.add_trace(go.Scatter(
+                    x=res["mes"], y=res["ahorro_acumulado"][i], mode="lines", name=alternativas[i]["nombre"]
+                ))
+            fig.add_hline(y=0, line_dash="dash", line_color="gray")
+            fig.update_layout(
+                title="Ahorro acumulado de cada alternativa frente a no cambiar",
+                xaxis_title="Mes desde hoy",
+                yaxis_title="€",
+                hovermode="x unified"
+            )
+            st.plotly_chart(fig, use_container_width=True)
 
 
 
 # =============================
-# 8. PÁGINA GLOSARIO MEJORADO
+# 8. PÁGINA CAPACIDAD DE ENDEUDAMIENTO
+# =============================
+elif pagina == "Capacidad de Endeudamiento":
+    st.title("¿Cuánto me pueden prestar?")
+    st.info("Parte de tu presupuesto: calcula el préstamo máximo para una cuota o un porcentaje de tus ingresos, el plazo que necesitas y el tipo máximo que puedes asumir.")
+    st.divider()
+
+    criterio = st.radio(
+        "Límite de cuota:",
+        ("Según mis ingresos", "Cuota máxima directa"),
+        horizontal=True, key="cap_criterio"
+    )
+    if criterio == "Según mis ingresos":
+        c1, c2, c3 = st.columns(3)
+        ingresos = c1.number_input(
+            "Ingresos netos mensuales (€):",
+            min_value=0.0, max_value=100000.0, value=3000.0, step=100.0, key="cap_ingresos",
+            help="Suma de los ingresos netos mensuales de todos los titulares."
+        )
+        ratio_pct = c2.number_input(
+            "Endeudamiento máximo (%):",
+            min_value=5.0, max_value=60.0, value=35.0, step=1.0, key="cap_ratio",
+            help="Porcentaje de los ingresos que pueden ir a deudas. Los bancos suelen exigir entre el 30 % y el 40 %."
+        )
+        otras_deudas = c3.number_input(
+            "Otras deudas mensuales (€):",
+            min_value=0.0, max_value=100000.0, value=0.0, step=50.0, key="cap_otras",
+            help="Préstamos personales, tarjetas, coche..."
+        )
+        cuota_max = float(cuota_asumible(ingresos, ratio_pct, otras_deudas))
+    else:
+        cuota_max = st.number_input(
+            "Cuota máxima (€):",
+            min_value=0.0, max_value=100000.0, value=1000.0, step=50.0, key="cap_cuota"
+        )
+    c1, c2 = st.columns(2)
+    years = c1.number_input("Plazo (años):", min_value=1, max_value=40, value=30, key="cap_years")
+    interest = c2.number_input("Tipo de interés anual (%):", min_value=0.0, max_value=20.0, value=3.0, step=0.1, key="cap_interest")
+    principal_deseado = st.number_input(
+        "Importe que necesitas (€):",
+        min_value=1000.0, max_value=1_000_000.0, value=200000.0, step=1000.0, key="cap_principal",
+        help="Para calcular el plazo y el tipo con los que ese importe te resulta asumible."
+    )
+    st.divider()
+
+    if cuota_max <= 0:
+        st.warning("Con estos datos no queda margen para una cuota hipotecaria.")
+        st.stop()
+
+    n = int(years * 12)
+    r = (interest / 100) / 12
+    meses_necesarios = float(plazo_para_cuota(principal_deseado, r, cuota_max))
+    tipo_max = float(tipo_maximo(principal_deseado, n, cuota_max))
+
+    c1, c2 = st.columns(2)
+    c1.metric("Cuota máxima", f"{cuota_max:,.2f} €")
+    c2.metric("Préstamo máximo", f"{float(principal_maximo(cuota_max, r, n)):,.2f} €")
+    c1, c2 = st.columns(2)
+    if np.isinf(meses_necesarios):
+        c1.metric("Plazo necesario", "Inalcanzable")
+    else:
+        meses_necesarios = int(meses_necesarios)
+        c1.metric("Plazo necesario", f"{meses_necesarios // 12} años y {meses_necesarios % 12} meses")
+        if meses_necesarios > 480:
+            st.warning("El plazo necesario supera los 40 años que suelen admitir los bancos.")
+    c2.metric(f"Tipo máximo a {years} años", "No asumible" if np.isnan(tipo_max) else f"{tipo_max:.2f} %")
+
+    st.write("### Préstamo máximo según plazo y tipo")
+    plazos_tabla = np.array([10, 15, 20, 25, 30, 35, 40])
+    tipos_tabla = np.arange(0.0, 6.01, 0.5)
+    rejilla = principal_maximo(cuota_max, tipos_tabla[:, None] / 100 / 12, plazos_tabla[None, :] * 12)
+    df_rejilla = pd.DataFrame(rejilla, columns=[f"{p} años" for p in plazos_tabla])
+    df_rejilla.insert(0, "Tipo (%)", tipos_tabla)
+    mostrar_tabla(df_rejilla, dict({c: FORMATO_EUROS for c in df_rejilla.columns[1:]}, **{"Tipo (%)": "%.2f %%"}), hide_index=True)
+
+    st.write(f"### Tipo máximo asumible para {principal_deseado:,.0f} € según el plazo")
+    tipos_max = tipo_maximo(principal_deseado, plazos_tabla * 12, cuota_max)
+    etiquetas_plazo = [f"{p} años" for p in plazos_tabla]
+    no_asumible = np.isnan(tipos_max)
+    fig = go.Figure()
+    # Sin barra (y sin valor 0) en los plazos no asumibles: se rotulan aparte
+    fig.add_trace(go.Bar(x=etiquetas_plazo, y=np.where(no_asumible, None, tipos_max), marker_color="#3498DB",
+                         name="Tipo máximo"))
+    if no_asumible.any():
+        fig.add_trace(go.Scatter(
+            x=[e for e, na in zip(etiquetas_plazo, no_asumible) if na], y=[0.0] * int(no_asumible.sum()),
+            mode="text", text="No asumible", textposition="top center", showlegend=False, hoverinfo="skip"
+        ))
+    fig.update_layout(
+        xaxis_title="Plazo",
+        yaxis_title="Tipo máximo (%)",
+        hovermode="x",
+        showlegend=False
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    if no_asumible.any():
+        st.caption("«No asumible»: con ese plazo el importe no cabe en la cuota máxima ni al 0 %.")
+
+
+# =============================
+# 9. PÁGINA GLOSARIO MEJORADO
 # =============================
 elif pagina == "Glosario":
     st.title("Glosario Hipotecario y Consejos Útiles")
@@ -2542,6 +3231,9 @@ elif pagina == "Glosario":
     **Subrogación:**  
     Cambiar tu hipoteca de un banco a otro para mejorar condiciones (tipo de interés, plazo, etc). Suele tener un coste, pero puede ahorrar mucho dinero si las condiciones son mejores.
 
+    **Novación:**  
+    Renegociar las condiciones de la hipoteca con el mismo banco (tipo, plazo...) sin cambiar de entidad.
+
     **Comisión de apertura:**  
     Cantidad que cobra el banco al formalizar la hipoteca.
 
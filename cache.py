@@ -0,0 +1,376 @@
+# =============================
+# CACHÉ PERSISTENTE DE RESULTADOS
+# =============================
+"""
+Caché de resultados en disco compartida entre procesos y reinicios.
+
+Los resultados se guardan en SQLite (modo WAL, seguro con varios procesos
+leyendo y escribiendo a la vez) bajo una clave que es el hash del contenido
+de la llamada: versión del motor + función + argumentos. Al cambiar
+``motor.VERSION_MOTOR`` las entradas antiguas dejan de usarse y se purgan.
+Cuando el tamaño total supera el límite se expulsan las entradas usadas
+hace más tiempo (LRU). El tamaño total se lleva en una tabla de una fila
+que se actualiza en la misma transacción que cada escritura, así que no
+hay que sumar la tabla entera al guardar.
+
+También incluye una caché en memoria por proceso con presupuesto de bytes
+(``cache_memoria``) para resultados guardados como arrays compactos, que
+guarda además puntos de control de cálculos año a año para reanudarlos
+desde el primer año que cambia (``calcular_con_puntos_control``).
+
+Configuración por variables de entorno:
+  HIPOTECAS_CACHE              ruta del fichero SQLite ("" o "0" desactiva la caché)
+  HIPOTECAS_CACHE_MB           tamaño máximo en disco en MB (por defecto 512)
+  HIPOTECAS_CACHE_MEMORIA_MB   presupuesto de la caché en memoria en MB (por defecto 64)
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from motor import VERSION_MOTOR
+
+RUTA_POR_DEFECTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "resultados.sqlite")
+# Solo se actualiza la fecha de uso si han pasado estos segundos: LRU aproximado sin escribir en cada lectura
+RESOLUCION_LRU_S = 60.0
+
+
+def _actualizar_huella(h, obj):
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        h.update(repr((type(obj).__name__, obj)).encode("utf-8"))
+    elif isinstance(obj, bytes):
+        h.update(b"bytes")
+        h.update(obj)
+    elif isinstance(obj, np.ndarray):
+        h.update(repr(("ndarray", obj.dtype.str, obj.shape)).encode("utf-8"))
+        h.update(np.ascontiguousarray(obj).tobytes() if obj.dtype != object else pickle.dumps(obj.tolist()))
+    elif isinstance(obj, np.generic):
+        _actualizar_huella(h, obj.item())
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode("utf-8"))
+        for x in obj:
+            _actualizar_huella(h, x)
+    elif isinstance(obj, dict):
+        h.update(f"dict{len(obj)}".encode("utf-8"))
+        for k in sorted(obj, key=repr):
+            _actualizar_huella(h, k)
+            _actualizar_huella(h, obj[k])
+    else:
+        h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def clave_contenido(nombre, args=(), kwargs=None, version=VERSION_MOTOR):
+    """Hash SHA-256 de versión + nombre de la función + argumentos."""
+    h = hashlib.sha256()
+    _actualizar_huella(h, (version, nombre, tuple(args), dict(kwargs or {})))
+    return h.hexdigest()
+
+
+class CacheDisco:
+    """Almacén clave → objeto (pickle comprimido) con límite de tamaño y expulsión LRU."""
+
+    def __init__(self, ruta, max_bytes, version=VERSION_MOTOR):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.version = version
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS resultados (
+                    clave TEXT PRIMARY KEY,
+                    version TEXT NOT NULL,
+                    valor BLOB NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    ultimo_acceso REAL NOT NULL
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acceso ON resultados (ultimo_acceso)")
+            con.execute("CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+            con.execute("DELETE FROM resultados WHERE version != ?", (self.version,))
+            # Se recalcula una vez al abrir (también corrige ficheros de versiones sin la tabla)
+            con.execute("INSERT OR REPLACE INTO total (id, bytes) SELECT 0, COALESCE(SUM(tamano), 0) FROM resultados")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=10.0, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def obtener(self, clave):
+        """Devuelve ``(True, valor)`` si la clave está en caché o ``(False, None)``."""
+        con = self._conexion()
+        fila = con.execute("SELECT valor, ultimo_acceso FROM resultados WHERE clave = ?", (clave,)).fetchone()
+        if fila is None:
+            return False, None
+        ahora = time.time()
+        if ahora - fila[1] > RESOLUCION_LRU_S:
+            con.execute("UPDATE resultados SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+        return True, pickle.loads(zlib.decompress(fila[0]))
+
+    def guardar(self, clave, valor):
+        datos = zlib.compress(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(datos) > self.max_bytes:
+            return
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            anterior = con.execute("SELECT tamano FROM resultados WHERE clave = ?", (clave,)).fetchone()
+            con.execute(
+                "INSERT OR REPLACE INTO resultados (clave, version, valor, tamano, ultimo_acceso) VALUES (?, ?, ?, ?, ?)",
+                (clave, self.version, datos, len(datos), time.time()),
+            )
+            self._sumar_total(con, len(datos) - (anterior[0] if anterior else 0))
+            self._expulsar(con)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def _total(self, con):
+        return con.execute("SELECT bytes FROM total WHERE id = 0").fetchone()[0]
+
+    def _sumar_total(self, con, delta):
+        con.execute("UPDATE total SET bytes = bytes + ? WHERE id = 0", (delta,))
+
+    def _expulsar(self, con):
+        total = self._total(con)
+        if total <= self.max_bytes:
+            return
+        sobrante = total - self.max_bytes
+        liberado = 0
+        claves = []
+        for clave, tamano in con.execute("SELECT clave, tamano FROM resultados ORDER BY ultimo_acceso"):
+            claves.append((clave,))
+            liberado += tamano
+            if liberado >= sobrante:
+                break
+        con.executemany("DELETE FROM resultados WHERE clave = ?", claves)
+        self._sumar_total(con, -liberado)
+
+    def estadisticas(self):
+        con = self._conexion()
+        n = con.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+        return {"entradas": n, "bytes": self._total(con), "max_bytes": self.max_bytes, "ruta": self.ruta}
+
+    def vaciar(self):
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute("DELETE FROM resultados")
+            con.execute("UPDATE total SET bytes = 0 WHERE id = 0")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache():
+    """Caché del proceso actual según el entorno, o ``None`` si está desactivada o no disponible."""
+    global _cache, _cache_pid
+    ruta = os.environ.get("HIPOTECAS_CACHE", RUTA_POR_DEFECTO)
+    if ruta in ("", "0"):
+        return None
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid() or _cache.ruta != ruta:
+            max_bytes = int(float(os.environ.get("HIPOTECAS_CACHE_MB", "512")) * 1024 * 1024)
+            try:
+                _cache = CacheDisco(ruta, max_bytes)
+            except (sqlite3.Error, OSError):
+                return None
+            _cache_pid = os.getpid()
+        return _cache
+
+
+def cache_disco(func):
+    """
+    Decorador: memoriza el resultado de ``func`` en la caché de disco.
+
+    Si la caché falla (disco lleno, fichero bloqueado...) se calcula sin ella.
+    """
+    nombre = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def envoltura(*args, **kwargs):
+        cache = obtener_cache()
+        if cache is None:
+            return func(*args, **kwargs)
+        clave = clave_contenido(nombre, args, kwargs)
+        try:
+            encontrado, valor = cache.obtener(clave)
+        except (sqlite3.Error, pickle.UnpicklingError, zlib.error):
+            encontrado = False
+        if encontrado:
+            return valor
+        valor = func(*args, **kwargs)
+        try:
+            cache.guardar(clave, valor)
+        except (sqlite3.Error, pickle.PicklingError, TypeError):
+            pass
+        return valor
+
+    return envoltura
+
+
+# =============================
+# CACHÉ EN MEMORIA CON PRESUPUESTO DE BYTES
+# =============================
+def tamano_residente(valor):
+    """Bytes aproximados que ocupa ``valor`` en memoria (exacto para arrays de NumPy)."""
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, (bytes, str)):
+        return len(valor)
+    if isinstance(valor, (bool, int, float, np.generic)) or valor is None:
+        return 8
+    if isinstance(valor, dict):
+        return sum(tamano_residente(k) + tamano_residente(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sum(tamano_residente(v) for v in valor)
+    return len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class CacheMemoria:
+    """LRU en memoria limitada por bytes; cada entrada guarda su tamaño residente."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            if clave not in self._entradas:
+                self.fallos += 1
+                return False, None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return True, self._entradas[clave][1]
+
+    def contiene(self, clave):
+        """Comprueba si la clave está guardada sin contar acierto ni fallo."""
+        with self._lock:
+            return clave in self._entradas
+
+    def guardar(self, clave, valor, nombre=""):
+        tamano = tamano_residente(valor)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._bytes -= self._entradas.pop(clave)[2]
+            self._entradas[clave] = (nombre, valor, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, _, libre) = self._entradas.popitem(last=False)
+                self._bytes -= libre
+
+    def estadisticas(self):
+        """Total y tamaño residente de cada entrada (de la más a la menos reciente)."""
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "detalle": [
+                    {"funcion": nombre, "clave": clave[:12], "bytes": tamano}
+                    for clave, (nombre, _, tamano) in reversed(self._entradas.items())
+                ],
+            }
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+
+cache_en_memoria = CacheMemoria(int(float(os.environ.get("HIPOTECAS_CACHE_MEMORIA_MB", "64")) * 1024 * 1024))
+
+
+def cache_memoria(func):
+    """
+    Decorador: memoriza el resultado de ``func`` en ``cache_en_memoria``.
+
+    Pensado para funciones que devuelven arrays compactos; la conversión a
+    DataFrame se hace fuera, solo para mostrar.
+    """
+    nombre = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def envoltura(*args, **kwargs):
+        clave = clave_contenido(nombre, args, kwargs)
+        encontrado, valor = cache_en_memoria.obtener(clave)
+        if encontrado:
+            return valor
+        valor = func(*args, **kwargs)
+        cache_en_memoria.guardar(clave, valor, nombre=func.__qualname__)
+        return valor
+
+    return envoltura
+
+
+# =============================
+# PUNTOS DE CONTROL (RECÁLCULO INCREMENTAL)
+# =============================
+def claves_prefijo(nombre, base, pasos, version=VERSION_MOTOR):
+    """
+    Clave del estado tras 0, 1, ..., len(pasos) pasos: hash encadenado de
+    versión + nombre + ``base`` y de cada paso en orden. Dos cálculos con la
+    misma base y los mismos k primeros pasos comparten la clave k.
+    """
+    h = hashlib.sha256()
+    _actualizar_huella(h, (version, nombre, base))
+    claves = [h.hexdigest()]
+    for paso in pasos:
+        _actualizar_huella(h, paso)
+        claves.append(h.hexdigest())
+    return claves
+
+
+def calcular_con_puntos_control(nombre, base, pasos, calcular, cache=cache_en_memoria):
+    """
+    Reanuda un cálculo por pasos desde el punto de control guardado más avanzado.
+
+    ``calcular(punto_control)`` (``None`` = desde el principio) devuelve un
+    dict con ``puntos_control`` {k: estado tras k pasos}; esos estados se
+    guardan en ``cache`` bajo la clave del prefijo de ``pasos`` que los
+    produjo. Al cambiar un paso solo se recalcula desde él en adelante.
+    """
+    claves = claves_prefijo(nombre, base, pasos)
+    punto = None
+    for k in range(len(pasos), 0, -1):
+        if cache.contiene(claves[k]):
+            encontrado, punto = cache.obtener(claves[k])
+            if encontrado:
+                break
+    res = calcular(punto)
+    for k, estado in res.pop("puntos_control", {}).items():
+        cache.guardar(claves[k], estado, nombre=f"{nombre}[{k}]")
+    return res
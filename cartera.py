@@ -0,0 +1,226 @@
+# =============================
+# PROYECCIÓN DE FLUJOS DE UNA CARTERA DE PRÉSTAMOS
+# =============================
+"""
+Flujos mensuales agregados (intereses, capital, amortizaciones anticipadas,
+comisiones y saldo vivo) de toda una cartera de préstamos, por cubeta
+(producto, cosecha u otra columna).
+
+Cada préstamo se simula con las mismas reglas que el resto de la app
+(``motor.simular_lote``, como ``simulate_offer`` y los cuadros de
+amortización). La cartera se procesa por trozos: cada trozo se reduce a un
+array (conceptos, cubetas, meses) y los trozos se suman en orden, así que
+la memoria depende del tamaño del trozo, el número de cubetas y el
+horizonte, no del número de préstamos. Con varios procesos los trozos se
+calculan en el pool de ``paralelo`` con un número acotado de trozos en
+vuelo y el resultado es el mismo que en un solo proceso.
+
+Los préstamos son lotes columnares (``motor.lote_ofertas`` o
+``importacion.validar_ofertas``) con dos columnas opcionales:
+``mes_firma`` (índice de mes año * 12 + mes - 1, como en ``euribor``; por
+defecto el mes de inicio de la proyección) y ``grupo`` (etiqueta de su
+cubeta). Los préstamos firmados antes del inicio se simulan desde su firma
+y solo se cuentan los meses dentro del horizonte.
+
+    python cartera.py cartera.csv --inicio 2025-01 --meses 360 --por tipo --salida flujos.csv
+"""
+import argparse
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from euribor import fechas_de_meses
+from importacion import validar_ofertas
+from motor import CONCEPTOS_FLUJO, simular_lote
+from paralelo import num_workers_por_defecto, obtener_pool
+
+# Préstamos por trozo
+TAM_TROZO = 20_000
+# Trozos enviados al pool por proceso antes de esperar resultados
+TROZOS_EN_VUELO_POR_WORKER = 2
+NOMBRES_CONCEPTOS = {
+    "intereses": "Intereses (€)",
+    "capital": "Capital (€)",
+    "amortizacion_anticipada": "Amortización anticipada (€)",
+    "comisiones": "Comisiones (€)",
+    "saldo_vivo": "Saldo vivo (€)",
+}
+GRUPO_POR_DEFECTO = "Cartera"
+
+
+def mes_indice(fecha):
+    """Índice de mes (año * 12 + mes - 1) de una fecha o texto "AAAA-MM"."""
+    fecha = pd.Timestamp(fecha)
+    return fecha.year * 12 + fecha.month - 1
+
+
+def _flujos_trozo(lote, n_cubetas, horizonte):
+    return simular_lote(lote, horizonte=horizonte, n_cubetas=n_cubetas)["flujos"]
+
+
+def _sumar(total, flujos):
+    # Los trozos enviados antes de aparecer una cubeta nueva traen menos cubetas
+    if flujos.shape[1] > total.shape[1]:
+        total = np.pad(total, ((0, 0), (0, flujos.shape[1] - total.shape[1]), (0, 0)))
+    total[:, :flujos.shape[1]] += flujos
+    return total
+
+
+def proyectar_cartera(trozos, inicio, horizonte, n_workers=None):
+    """
+    Proyecta los flujos mensuales de la cartera durante ``horizonte`` meses
+    desde ``inicio`` (índice de mes, ver ``mes_indice``). ``trozos`` es un
+    iterable de lotes (se consume una sola vez, p. ej. ``leer_cartera_csv``).
+
+    Devuelve un dict con ``cubetas`` (etiquetas, en orden de aparición),
+    ``meses`` (índices de mes del horizonte), ``flujos`` (conceptos de
+    ``motor.CONCEPTOS_FLUJO``, cubetas, meses) y ``prestamos`` por cubeta.
+    """
+    inicio = int(inicio)
+    n_workers = n_workers or num_workers_por_defecto()
+    cubetas = {}
+    total = np.zeros((len(CONCEPTOS_FLUJO), 0, horizonte))
+    prestamos = np.zeros(0, dtype=np.int64)
+    pool = obtener_pool(n_workers) if n_workers > 1 else None
+    en_vuelo = deque()
+    try:
+        for lote in trozos:
+            n = lote["principal"].shape[0]
+            if n == 0:
+                continue
+            grupos = lote.get("grupo", np.full(n, GRUPO_POR_DEFECTO, dtype=object))
+            for g in dict.fromkeys(grupos.tolist()):
+                cubetas.setdefault(g, len(cubetas))
+            lote = dict(lote)
+            lote["cubeta"] = np.array([cubetas[g] for g in grupos.tolist()], dtype=np.int64)
+            lote["mes_inicio"] = np.asarray(lote.get("mes_firma", np.full(n, inicio)), dtype=np.int64) - inicio
+            prestamos = np.pad(prestamos, (0, len(cubetas) - len(prestamos)))
+            prestamos += np.bincount(lote["cubeta"], minlength=len(cubetas))
+
+            if pool is None:
+                total = _sumar(total, _flujos_trozo(lote, len(cubetas), horizonte))
+                continue
+            # Como mucho unos pocos trozos por proceso en vuelo: la memoria no crece con la cartera.
+            # Se suman en orden de envío para que el resultado no dependa del número de procesos.
+            en_vuelo.append(pool.submit(_flujos_trozo, lote, len(cubetas), horizonte))
+            while len(en_vuelo) >= TROZOS_EN_VUELO_POR_WORKER * n_workers:
+                total = _sumar(total, en_vuelo.popleft().result())
+        while en_vuelo:
+            total = _sumar(total, en_vuelo.popleft().result())
+    finally:
+        for futuro in en_vuelo:
+            futuro.cancel()
+
+    total = _sumar(np.zeros((len(CONCEPTOS_FLUJO), len(cubetas), horizonte)), total)
+    return {
+        "cubetas": list(cubetas),
+        "meses": inicio + np.arange(horizonte),
+        "flujos": total,
+        "prestamos": prestamos,
+    }
+
+
+def tabla_flujos(proyeccion, por_cubeta=True):
+    """
+    Tabla de flujos: una fila por mes (y cubeta, con ``por_cubeta``) con los
+    conceptos, el total cobrado (intereses + capital + anticipadas +
+    comisiones) y el saldo vivo al cierre del mes.
+    """
+    flujos = proyeccion["flujos"]
+    cubetas = proyeccion["cubetas"]
+    if not por_cubeta or not cubetas:
+        flujos = flujos.sum(axis=1, keepdims=True)
+        cubetas = ["Total"]
+    n_cubetas, n_meses = flujos.shape[1], flujos.shape[2]
+    df = pd.DataFrame({
+        "Mes": np.tile(fechas_de_meses(proyeccion["meses"]).to_numpy(), n_cubetas),
+        "Cubeta": np.repeat(cubetas, n_meses),
+    })
+    for k, concepto in enumerate(CONCEPTOS_FLUJO):
+        df[NOMBRES_CONCEPTOS[concepto]] = flujos[k].ravel()
+    cobrado = [NOMBRES_CONCEPTOS[c] for c in CONCEPTOS_FLUJO if c != "saldo_vivo"]
+    df.insert(len(df.columns) - 1, "Total cobrado (€)", df[cobrado].sum(axis=1))
+    return df
+
+
+def leer_cartera_csv(ruta, columna_grupo=None, tam_trozo=TAM_TROZO, errores=None):
+    """
+    Generador de lotes de ``tam_trozo`` préstamos leídos de un CSV con las
+    columnas de ``importacion`` más, opcionalmente, ``firma`` (fecha de
+    firma, "AAAA-MM" o fecha completa). ``columna_grupo`` da la cubeta de
+    cada préstamo (sin distinguir mayúsculas, como las demás columnas);
+    "cosecha" usa el año de firma si no existe esa columna.
+    Las filas inválidas se descartan y, si se da la lista ``errores``, se
+    añaden a ella sus mensajes (con el número de fila del fichero).
+    """
+    if columna_grupo is not None:
+        columna_grupo = str(columna_grupo).strip().lower()
+    lector = pd.read_csv(ruta, sep=None, engine="python", dtype=str, keep_default_na=False, chunksize=tam_trozo)
+    desplazamiento = 0
+    for df in lector:
+        df.columns = [str(c).strip().lower() for c in df.columns]
+        lote, textos = validar_ofertas(df.reset_index(drop=True))
+        if errores is not None:
+            errores.extend(_renumerar(t, desplazamiento) for t in textos)
+        filas = lote["fila"] - 1
+        if "firma" in df:
+            firma = pd.to_datetime(df["firma"].iloc[filas].str.strip(), errors="coerce")
+            lote["mes_firma"] = np.where(firma.notna(), firma.dt.year * 12 + firma.dt.month - 1, -1).astype(np.int64)
+            sin_fecha = lote["mes_firma"] < 0
+            if sin_fecha.any():
+                if errores is not None:
+                    errores.extend(f"Fila {desplazamiento + f + 1}: firma inválida" for f in filas[sin_fecha])
+                lote = {k: v[~sin_fecha] for k, v in lote.items()}
+                filas = filas[~sin_fecha]
+        if columna_grupo is not None:
+            if columna_grupo in df:
+                lote["grupo"] = df[columna_grupo].iloc[filas].astype(str).str.strip().to_numpy(dtype=object)
+            elif columna_grupo == "cosecha" and "mes_firma" in lote:
+                lote["grupo"] = (lote["mes_firma"] // 12).astype(str).astype(object)
+            else:
+                raise ValueError(f"El fichero no tiene la columna {columna_grupo!r}")
+        lote["fila"] = lote["fila"] + desplazamiento
+        desplazamiento += len(df)
+        yield lote
+
+
+def _renumerar(texto, desplazamiento):
+    # "Fila N: ..." de un trozo pasa a contar desde el principio del fichero
+    fila, _, resto = texto.partition(":")
+    return f"Fila {int(fila.split()[1]) + desplazamiento}:{resto}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proyección de flujos mensuales de una cartera de préstamos")
+    parser.add_argument("cartera", help="CSV con un préstamo por fila (columnas de la plantilla del comparador y 'firma')")
+    parser.add_argument("--inicio", required=True, help="primer mes de la proyección (AAAA-MM)")
+    parser.add_argument("--meses", type=int, default=360)
+    parser.add_argument("--por", default=None, help="columna para agrupar (p. ej. tipo o cosecha)")
+    parser.add_argument("--trozo", type=int, default=TAM_TROZO)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--salida", default=None, help="CSV de salida (por defecto se imprime un resumen anual)")
+    args = parser.parse_args()
+
+    errores = []
+    proyeccion = proyectar_cartera(
+        leer_cartera_csv(args.cartera, args.por, args.trozo, errores), mes_indice(args.inicio), args.meses, args.workers
+    )
+    for texto in errores[:20]:
+        print(texto)
+    if len(errores) > 20:
+        print(f"... y {len(errores) - 20} filas inválidas más")
+    print(f"{int(proyeccion['prestamos'].sum()):,} préstamos en {len(proyeccion['cubetas'])} cubetas")
+
+    df = tabla_flujos(proyeccion)
+    if args.salida:
+        df.to_csv(args.salida, index=False)
+        print(f"Flujos guardados en {args.salida}")
+    else:
+        anual = df.assign(Año=df["Mes"].dt.year).groupby(["Año", "Cubeta"], sort=True)
+        columnas = [c for c in df.columns if c not in ("Mes", "Cubeta", "Saldo vivo (€)")]
+        print(anual[columnas].sum().round(2).to_string())
+
+
+if __name__ == "__main__":
+    main()
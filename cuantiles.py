@@ -0,0 +1,179 @@
+# =============================
+# CUANTILES EN STREAMING CON MEMORIA FIJA
+# =============================
+"""
+Resúmenes de cuantiles combinables para Monte Carlo con millones de caminos.
+
+En lugar de guardar el resultado de cada camino para calcular percentiles,
+cada bloque de caminos se reduce a conteos por cubeta y los conteos de
+distintos bloques (o procesos) se suman. La memoria es fija por métrica,
+sea cual sea el número de caminos, y combinar es sumar enteros: el
+resultado es exactamente el mismo con cualquier reparto y en cualquier
+orden.
+
+- ``CuantilesLog``: cubetas logarítmicas (la idea de DDSketch). Cualquier
+  cuantil de un valor dentro de ``[minimo, maximo]`` sale con un error
+  relativo de como mucho ``alpha``.
+- ``CuantilesEnteros``: una cubeta por entero de 0 a ``maximo``; exacto.
+
+Los dos llevan una dimensión de ofertas: ``añadir`` recibe una matriz
+(ofertas, caminos) y ``cuantiles``/``intervalos`` devuelven (ofertas,
+cuantiles). ``intervalos`` da, para cada cuantil, el rango en el que está
+con seguridad el valor exacto (el del camino en la posición
+``floor(q * (n - 1))`` de los ordenados).
+"""
+import numpy as np
+
+
+class _ResumenCuantiles:
+    """Parte común: conteos (ofertas, cubetas) y extremos exactos por oferta."""
+
+    def __init__(self, n_ofertas, n_cubetas):
+        self.conteos = np.zeros((n_ofertas, n_cubetas), dtype=np.int64)
+        self.menor = np.full(n_ofertas, np.inf)
+        self.mayor = np.full(n_ofertas, -np.inf)
+
+    @property
+    def n(self):
+        """Valores añadidos por oferta."""
+        return self.conteos.sum(axis=1)
+
+    @property
+    def bytes(self):
+        return self.conteos.nbytes + self.menor.nbytes + self.mayor.nbytes
+
+    def añadir(self, valores):
+        valores = np.atleast_2d(np.asarray(valores, dtype=float))
+        n_ofertas, n_cubetas = self.conteos.shape
+        if valores.shape[1] == 0:
+            return self
+        idx = self._cubetas(valores) + (np.arange(n_ofertas) * n_cubetas)[:, None]
+        self.conteos += np.bincount(idx.ravel(), minlength=n_ofertas * n_cubetas).reshape(n_ofertas, n_cubetas)
+        self.menor = np.minimum(self.menor, valores.min(axis=1))
+        self.mayor = np.maximum(self.mayor, valores.max(axis=1))
+        return self
+
+    def combinar(self, otro):
+        """Suma los conteos de ``otro`` (mismas cubetas) en este resumen."""
+        if type(otro) is not type(self) or otro._config() != self._config():
+            raise ValueError("Solo se pueden combinar resúmenes con las mismas cubetas")
+        self.conteos += otro.conteos
+        self.menor = np.minimum(self.menor, otro.menor)
+        self.mayor = np.maximum(self.mayor, otro.mayor)
+        return self
+
+    def _posiciones(self, conteos, qs):
+        # Cubeta (ofertas, cuantiles) que contiene el valor de rango floor(q * (n - 1))
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        acumulados = np.cumsum(conteos, axis=1)
+        n = acumulados[:, -1]
+        rangos = np.floor(qs[None, :] * np.maximum(n[:, None] - 1, 0))
+        k = np.stack([np.searchsorted(acumulados[o], rangos[o], side="right") for o in range(len(n))])
+        return np.minimum(k, conteos.shape[1] - 1), n == 0
+
+    def _resultado(self, conteos, qs, valores_cubeta):
+        k, vacio = self._posiciones(conteos, qs)
+        valores = np.clip(valores_cubeta[k], self.menor[:, None], self.mayor[:, None])
+        return np.where(vacio[:, None], np.nan, valores)
+
+    def cuantiles(self, qs):
+        """Estimación de cada cuantil ``qs`` (en [0, 1]) por oferta: (ofertas, cuantiles)."""
+        return self._resultado(self.conteos, qs, self._representantes())
+
+    def intervalos(self, qs):
+        """``(inferior, superior)``, cada uno (ofertas, cuantiles): rango garantizado del cuantil exacto."""
+        inferior, superior = self._bordes()
+        return self._resultado(self.conteos, qs, inferior), self._resultado(self.conteos, qs, superior)
+
+
+class CuantilesLog(_ResumenCuantiles):
+    """
+    Cuantiles con error relativo como mucho ``alpha`` para valores en
+    ``[minimo, maximo]`` (``minimo > 0``). Los valores por debajo o por
+    encima van a dos cubetas de desborde; si un cuantil cae en ellas, su
+    intervalo llega hasta el extremo exacto observado. Con ``alpha=0.005``
+    y de 1 a 1e8 son unas 1.850 cubetas (15 KB) por oferta.
+    """
+
+    def __init__(self, n_ofertas, alpha=0.005, minimo=1.0, maximo=1e8):
+        self.alpha = alpha
+        self.minimo = minimo
+        self.maximo = maximo
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = np.log(self._gamma)
+        self._base = int(np.ceil(np.log(minimo) / self._log_gamma))
+        n_interiores = int(np.ceil(np.log(maximo) / self._log_gamma)) - self._base + 1
+        # Cubeta 0: valores < minimo; la última: valores > maximo
+        super().__init__(n_ofertas, n_interiores + 2)
+
+    def _config(self):
+        return (self.alpha, self.minimo, self.maximo)
+
+    def _cubetas(self, valores):
+        ultima = self.conteos.shape[1] - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            i = np.ceil(np.log(valores) / self._log_gamma) - self._base + 1
+        i = np.clip(np.nan_to_num(i, nan=0.0, posinf=0.0, neginf=0.0), 1, ultima - 1)
+        return np.where(valores < self.minimo, 0, np.where(valores > self.maximo, ultima, i)).astype(np.int64)
+
+    def _bordes(self):
+        # La cubeta interior k cubre (gamma^(j - 1), gamma^j] con j = k - 1 + base
+        j = np.arange(self.conteos.shape[1]) - 1 + self._base
+        inferior = self._gamma ** (j - 1.0)
+        superior = self._gamma ** j.astype(float)
+        inferior[0], superior[0] = -np.inf, self.minimo
+        inferior[-1], superior[-1] = self.maximo, np.inf
+        return inferior, superior
+
+    def _representantes(self):
+        # Punto de la cubeta con error relativo como mucho alpha frente a cualquier valor de ella
+        inferior, superior = self._bordes()
+        valores = 2 * superior / (self._gamma + 1)
+        valores[0], valores[-1] = self.minimo, self.maximo
+        return valores
+
+
+class CuantilesEnteros(_ResumenCuantiles):
+    """
+    Cuantiles exactos de enteros entre 0 y ``maximo`` (p. ej. meses); los
+    mayores van a una cubeta de desborde y los negativos cuentan como 0.
+    ``cuantiles`` e ``intervalos`` admiten ``desde`` para ignorar los
+    valores menores (p. ej. 0 = «no ocurre»).
+    """
+
+    def __init__(self, n_ofertas, maximo):
+        self.maximo = int(maximo)
+        super().__init__(n_ofertas, self.maximo + 2)
+
+    def _config(self):
+        return (self.maximo,)
+
+    def _cubetas(self, valores):
+        return np.clip(np.round(valores), 0, self.maximo + 1).astype(np.int64)
+
+    def _bordes(self):
+        valores = np.arange(self.conteos.shape[1], dtype=float)
+        superior = valores.copy()
+        superior[-1] = np.inf
+        return valores, superior
+
+    def _representantes(self):
+        return np.arange(self.conteos.shape[1], dtype=float)
+
+    def _desde(self, desde):
+        conteos = self.conteos.copy()
+        conteos[:, :max(int(desde), 0)] = 0
+        return conteos
+
+    def cuantiles(self, qs, desde=0):
+        return self._resultado(self._desde(desde), qs, self._representantes())
+
+    def intervalos(self, qs, desde=0):
+        inferior, superior = self._bordes()
+        conteos = self._desde(desde)
+        return self._resultado(conteos, qs, inferior), self._resultado(conteos, qs, superior)
+
+    def proporcion(self, desde):
+        """Fracción de valores por oferta que son ``>= desde``."""
+        n = self.n
+        return np.where(n > 0, self.conteos[:, int(desde):].sum(axis=1) / np.maximum(n, 1), np.nan)
@@ -0,0 +1,82 @@
+# =============================
+# SERIES DE EURÍBOR
+# =============================
+"""
+Carga de series históricas de Euríbor 12M y de curvas de tipos para descontar.
+
+El CSV se parsea solo la primera vez: se guarda una copia binaria ``.npy``
+junto al fichero y las siguientes cargas la abren con ``mmap_mode="r"``, sin
+volver a leer el texto ni copiar la serie en memoria.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _ruta_cache(ruta_csv):
+    return os.path.splitext(ruta_csv)[0] + ".npy"
+
+
+def _parsear_csv(ruta_csv):
+    df = pd.read_csv(ruta_csv, sep=None, engine="python")
+    if df.shape[1] < 2:
+        raise ValueError("El CSV debe tener dos columnas: fecha y valor del Euríbor (%).")
+    # Fechas ISO (2024-01-31) o españolas (31/01/2024)
+    texto = df.iloc[:, 0].astype(str).str.strip()
+    fechas = pd.to_datetime(texto, format="ISO8601", errors="coerce")
+    fechas = fechas.fillna(pd.to_datetime(texto, dayfirst=True, errors="coerce"))
+    valores = pd.to_numeric(df.iloc[:, 1].astype(str).str.replace(",", ".", regex=False), errors="coerce")
+    serie = pd.Series(valores.values, index=fechas).dropna()
+    serie = serie[serie.index.notna()]
+    if serie.empty:
+        raise ValueError("No se han encontrado filas válidas (fecha, valor) en el CSV.")
+
+    # Una observación por mes (media si la serie es diaria) y sin huecos
+    serie = serie.groupby(serie.index.year * 12 + serie.index.month - 1).mean().sort_index()
+    meses = np.arange(serie.index[0], serie.index[-1] + 1)
+    serie = serie.reindex(meses).ffill()
+    return np.column_stack([meses.astype(float), serie.values.astype(float)])
+
+
+def cargar_euribor_historico(ruta_csv):
+    """
+    Devuelve la serie mensual como array (meses, 2) de solo lectura.
+
+    Columna 0: índice de mes (año * 12 + mes - 1). Columna 1: Euríbor en %.
+    La copia ``.npy`` se regenera si el CSV es más reciente.
+    """
+    if not os.path.exists(ruta_csv):
+        raise FileNotFoundError(f"No existe el fichero {ruta_csv}")
+    ruta_npy = _ruta_cache(ruta_csv)
+    if not os.path.exists(ruta_npy) or os.path.getmtime(ruta_npy) < os.path.getmtime(ruta_csv):
+        np.save(ruta_npy, _parsear_csv(ruta_csv))
+    return np.load(ruta_npy, mmap_mode="r")
+
+
+def fechas_de_meses(meses):
+    """Convierte índices de mes (año * 12 + mes - 1) en fechas de inicio de mes."""
+    meses = np.asarray(meses, dtype=int)
+    return pd.to_datetime({"year": meses // 12, "month": meses % 12 + 1, "day": 1})
+
+
+def cargar_curva_descuento(ruta_csv):
+    """
+    Curva de tipos cero desde un CSV de dos columnas: plazo en años y tipo
+    anual en % (separador ',' o ';', coma o punto decimal).
+
+    Devuelve un array (plazos, 2) ordenado por plazo, listo para
+    ``motor.factores_descuento``.
+    """
+    if not os.path.exists(ruta_csv):
+        raise FileNotFoundError(f"No existe el fichero {ruta_csv}")
+    df = pd.read_csv(ruta_csv, sep=None, engine="python", dtype=str)
+    if df.shape[1] < 2:
+        raise ValueError("El CSV debe tener dos columnas: plazo (años) y tipo (%).")
+    columnas = [pd.to_numeric(df.iloc[:, i].str.strip().str.replace(",", ".", regex=False), errors="coerce")
+                for i in range(2)]
+    curva = np.column_stack([c.to_numpy(dtype=float) for c in columnas])
+    curva = curva[~np.isnan(curva).any(axis=1) & (curva[:, 0] >= 0)]
+    if curva.shape[0] == 0:
+        raise ValueError("No se han encontrado filas válidas (plazo, tipo) en el CSV.")
+    return curva[np.argsort(curva[:, 0], kind="stable")]
@@ -0,0 +1,174 @@
+# =============================
+# IMPORTACIÓN DE OFERTAS DESDE FICHERO
+# =============================
+"""
+Lectura y validación de ofertas en CSV o JSON para el comparador.
+
+Las columnas son las mismas claves que usa ``ofertas_cfg`` en la página del
+comparador. El resultado es un lote columnar (ver ``motor.lote_ofertas``)
+listo para ``motor.simular_lote``: la validación se hace por columnas, no
+oferta a oferta.
+"""
+import json
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from motor import matrices_eventos
+
+# campo: (mínimo, máximo, valor por defecto; None = obligatorio)
+CAMPOS_OFERTA = {
+    "principal": (1000.0, 1_000_000.0, None),
+    "years": (1, 40, None),
+    "tin_fija": (0.0, 20.0, None),
+    "years_fixed": (1, 40, None),
+    "tin_fijo_mixta": (0.0, 20.0, None),
+    "euribor": (-2.0, 10.0, None),
+    "diferencial": (0.0, 5.0, None),
+    "bonus_pp": (0.0, 20.0, 0.0),
+    "bonus_cost_anual": (0.0, np.inf, 0.0),
+    "bonus_pct_saldo": (0.0, 5.0, 0.0),
+    "com_apertura_pct": (0.0, 5.0, 0.0),
+    "com_apertura_fija": (0.0, 10000.0, 0.0),
+    "com_amort_parcial_pct": (0.0, 5.0, 0.0),
+}
+CAMPOS_SOLO_FIJA = ("tin_fija",)
+CAMPOS_SOLO_MIXTA = ("years_fixed", "tin_fijo_mixta", "euribor", "diferencial")
+CAMPOS_ENTEROS = ("years", "years_fixed")
+
+PLANTILLA_CSV = (
+    "nombre,tipo,principal,years,tin_fija,years_fixed,tin_fijo_mixta,euribor,diferencial,"
+    "bonus_pp,bonus_cost_anual,bonus_pct_saldo,com_apertura_pct,com_apertura_fija,com_amort_parcial_pct,amortizaciones\n"
+    "Banco A,Fija,150000,25,2.9,,,,,0.3,400,0,0,0,0,\n"
+    "Banco B,Mixta,150000,25,,10,2.2,2.5,0.8,0.2,100,0.25,0.5,0,1,5:10000:Plazo;10:5000:Cuota\n"
+)
+
+
+def leer_ofertas(contenido, nombre_fichero):
+    """Lee un CSV (separador ',' o ';') o un JSON (lista de objetos) a DataFrame."""
+    if nombre_fichero.lower().endswith(".json"):
+        datos = json.loads(contenido.decode("utf-8"))
+        if isinstance(datos, dict):
+            datos = datos.get("ofertas", [])
+        df = pd.DataFrame(datos)
+    else:
+        df = pd.read_csv(BytesIO(contenido), sep=None, engine="python", dtype=str, keep_default_na=False)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+
+def _parsear_amortizaciones(valor):
+    """
+    Acepta la lista de dicts de ``ofertas_cfg`` (JSON) o el texto
+    "anio:importe:modo;anio:importe:modo" (CSV).
+    """
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return []
+    if isinstance(valor, list):
+        return [{"anio": int(ev["anio"]), "importe": float(ev["importe"]), "modo": ev.get("modo", "Plazo")} for ev in valor]
+    eventos = []
+    for trozo in str(valor).split(";"):
+        if not trozo.strip():
+            continue
+        partes = [p.strip() for p in trozo.split(":")]
+        eventos.append({
+            "anio": int(partes[0]),
+            "importe": float(partes[1].replace(",", ".")),
+            "modo": partes[2] if len(partes) > 2 else "Plazo",
+        })
+    return eventos
+
+
+def validar_ofertas(df):
+    """
+    Valida las ofertas del DataFrame y construye el lote con las filas válidas.
+
+    Devuelve ``(lote, errores)``; ``errores`` es una lista de textos
+    "Fila N: ..." (N empieza en 1) de las filas descartadas. El lote incluye
+    ``fila`` con el número de fila original de cada oferta.
+    """
+    n = len(df)
+    errores = {}
+
+    def error(mask, texto):
+        for i in np.flatnonzero(mask):
+            errores.setdefault(int(i), []).append(texto)
+
+    tipo = df["tipo"].astype(str).str.strip().str.capitalize() if "tipo" in df else pd.Series([""] * n)
+    mixta = (tipo == "Mixta").to_numpy()
+    error(~tipo.isin(["Fija", "Mixta"]).to_numpy(), "tipo debe ser 'Fija' o 'Mixta'")
+
+    valores = {}
+    for campo, (minimo, maximo, defecto) in CAMPOS_OFERTA.items():
+        if campo in df:
+            texto = df[campo].astype(str).str.strip().str.replace(",", ".", regex=False)
+            vacio = texto.isin(["", "nan", "None"]).to_numpy()
+            col = pd.to_numeric(texto.mask(vacio), errors="coerce").to_numpy(dtype=float)
+        else:
+            vacio = np.ones(n, dtype=bool)
+            col = np.full(n, np.nan)
+        no_numerico = np.isnan(col) & ~vacio
+        falta = vacio
+        if defecto is not None:
+            col = np.where(falta, defecto, col)
+            falta = np.zeros(n, dtype=bool)
+        aplica = np.ones(n, dtype=bool)
+        if campo in CAMPOS_SOLO_FIJA:
+            aplica = ~mixta
+        elif campo in CAMPOS_SOLO_MIXTA:
+            aplica = mixta
+        error(aplica & falta, f"falta {campo}")
+        error(aplica & no_numerico, f"{campo}: valor no numérico")
+        error(aplica & ~falta & ((col < minimo) | (col > maximo)), f"{campo} fuera de rango [{minimo}, {maximo}]")
+        if campo in CAMPOS_ENTEROS:
+            error(aplica & ~falta & ~no_numerico & ((col % 1) != 0), f"{campo} debe ser un número entero de años")
+        valores[campo] = np.where(aplica, col, 0.0)
+
+    years = np.nan_to_num(valores["years"])
+    error(mixta & (valores["years_fixed"] > years), "years_fixed no puede superar years")
+
+    amortizaciones = []
+    columna_amort = df["amortizaciones"].tolist() if "amortizaciones" in df else [None] * n
+    for i, valor in enumerate(columna_amort):
+        try:
+            eventos = _parsear_amortizaciones(valor)
+        except (ValueError, KeyError, IndexError, TypeError):
+            errores.setdefault(i, []).append("amortizaciones con formato inválido (anio:importe:modo;...)")
+            eventos = []
+        for ev in eventos:
+            if ev["modo"] not in ("Plazo", "Cuota") or not 1 <= ev["anio"] <= years[i] or ev["importe"] < 0:
+                errores.setdefault(i, []).append(f"amortización inválida (año {ev['anio']}, modo {ev['modo']})")
+                break
+        amortizaciones.append(eventos)
+
+    validas = np.ones(n, dtype=bool)
+    validas[list(errores)] = False
+    idx = np.flatnonzero(validas)
+
+    if "nombre" in df:
+        nombres = df["nombre"].astype(str).str.strip().to_numpy(dtype=object)
+    else:
+        nombres = np.full(n, "", dtype=object)
+    vacios = (nombres == "") | (nombres == "nan")
+    nombres[vacios] = [f"Oferta {i+1}" for i in np.flatnonzero(vacios)]
+
+    n_total = (years * 12).astype(np.int64)
+    lote = {
+        "nombre": nombres[idx],
+        "fila": idx + 1,
+        "mixta": mixta[idx],
+        "principal": valores["principal"][idx],
+        "n_total": n_total[idx],
+        "n_fijo": np.where(mixta, np.nan_to_num(valores["years_fixed"]) * 12, n_total).astype(np.int64)[idx],
+        "tin_fijo": np.where(mixta, valores["tin_fijo_mixta"], valores["tin_fija"])[idx],
+        "euribor": valores["euribor"][idx],
+        "diferencial": valores["diferencial"][idx],
+    }
+    for campo in ("bonus_pp", "bonus_cost_anual", "bonus_pct_saldo", "com_apertura_pct", "com_apertura_fija",
+                  "com_amort_parcial_pct"):
+        lote[campo] = valores[campo][idx]
+    lote.update(matrices_eventos([amortizaciones[i] for i in idx]))
+
+    textos = [f"Fila {i+1}: " + "; ".join(msgs) for i, msgs in sorted(errores.items())]
+    return lote, textos
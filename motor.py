@@ -0,0 +1,1601 @@
+# =============================
+# MOTOR DE CÁLCULO VECTORIZADO
+# =============================
+"""
+Funciones de cálculo de hipotecas sin dependencias de Streamlit.
+
+Reproducen las reglas de las páginas de la app (cuota francesa, mixta con
+recálculo de cuota al pasar a variable, etc.) pero trabajando con arrays de
+NumPy, de modo que muchos escenarios se evalúan en una sola llamada.
+"""
+import numpy as np
+
+from nucleo import HAY_JIT, simular_meses
+
+# Súbelo al cambiar cualquier regla de cálculo: invalida los resultados guardados en caché
+VERSION_MOTOR = "3"
+# Conceptos de ``simular_lote(..., horizonte=...)["flujos"]``, en este orden
+CONCEPTOS_FLUJO = ("intereses", "capital", "amortizacion_anticipada", "comisiones", "saldo_vivo")
+
+
+def _escalar_si_0d(x):
+    return x[()] if np.ndim(x) == 0 else x
+
+
+def cuota_francesa(P, r, n):
+    """Cuota mensual del sistema francés. Admite escalares o arrays (broadcasting)."""
+    P = np.asarray(P, dtype=float)
+    r = np.asarray(r, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        f = (1 + r) ** n
+        cuota = np.where(r == 0, P / n, P * r * f / (f - 1))
+    cuota = np.where(n > 0, cuota, 0.0)
+    return _escalar_si_0d(cuota)
+
+
+def derivadas_cuota(P, r, n):
+    """
+    Derivadas parciales de ``cuota_francesa`` respecto al capital y al tipo
+    mensual: ``(dcuota/dP, dcuota/dr)``. Con ``r == 0`` se usa el límite.
+    """
+    P = np.asarray(P, dtype=float)
+    r = np.asarray(r, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        f = (1 + r) ** n
+        a = np.where(r == 0, 1 / n, r * f / (f - 1))
+        da = np.where(r == 0, (n + 1) / (2 * n), f / (f - 1) - r * n * f / ((1 + r) * (f - 1) ** 2))
+    positivo = n > 0
+    return _escalar_si_0d(np.where(positivo, a, 0.0)), _escalar_si_0d(np.where(positivo, P * da, 0.0))
+
+
+def saldo_tras(P, r, cuota, k):
+    """Capital pendiente tras pagar ``k`` cuotas constantes a tipo mensual ``r``."""
+    P = np.asarray(P, dtype=float)
+    r = np.asarray(r, dtype=float)
+    k = np.asarray(k, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        f = (1 + r) ** k
+        saldo = np.where(r == 0, P - cuota * k, P * f - cuota * (f - 1) / r)
+    return _escalar_si_0d(saldo)
+
+
+def intereses_fija(principal, r, n):
+    """Intereses totales de una hipoteca fija en forma cerrada (cuota * n - principal)."""
+    cuota = cuota_francesa(principal, r, n)
+    return cuota * n - principal
+
+
+def mixta_revision_anual(principal, n_fijo, n_total, r_fijo, euribor_anual, diferencial):
+    """
+    Hipoteca mixta cuya fase variable se revisa cada 12 meses.
+
+    ``euribor_anual`` tiene forma (escenarios, revisiones) en %: el Euríbor de
+    cada revisión anual de la fase variable. La cuota de la fase fija se
+    calcula a plazo completo (como en ``cuadro_amortizacion_mixta``) y en cada
+    revisión se recalcula sobre el capital pendiente y el plazo restante. Cada
+    tramo de 12 meses se liquida en forma cerrada, así que el bucle es sobre
+    revisiones y no sobre meses ni escenarios.
+
+    Devuelve un dict con arrays de longitud ``escenarios``.
+    """
+    eur = np.atleast_2d(np.asarray(euribor_anual, dtype=float))
+    n_esc = eur.shape[0]
+    n_var = max(0, int(n_total) - int(n_fijo))
+
+    cuota_fija = cuota_francesa(principal, r_fijo, n_total)
+    saldo_fijo = saldo_tras(principal, r_fijo, cuota_fija, n_fijo)
+    intereses = np.full(n_esc, cuota_fija * n_fijo - (principal - saldo_fijo))
+    saldo = np.full(n_esc, float(saldo_fijo))
+    cuota_variable = np.zeros(n_esc)
+    cuota_maxima = np.full(n_esc, float(cuota_fija))
+
+    k = 0
+    mes = 0
+    while mes < n_var:
+        meses = min(12, n_var - mes)
+        r_var = (eur[:, min(k, eur.shape[1] - 1)] + diferencial) / 100 / 12
+        cuota = cuota_francesa(saldo, r_var, n_var - mes)
+        nuevo_saldo = np.maximum(saldo_tras(saldo, r_var, cuota, meses), 0.0)
+        intereses += cuota * meses - (saldo - nuevo_saldo)
+        if k == 0:
+            cuota_variable = cuota
+        cuota_maxima = np.maximum(cuota_maxima, cuota)
+        saldo = nuevo_saldo
+        mes += meses
+        k += 1
+
+    return {
+        "cuota_fija": float(cuota_fija),
+        "cuota_variable": cuota_variable,
+        "cuota_maxima": cuota_maxima,
+        "intereses": intereses,
+    }
+
+
+def hipoteca_cerrada(principal, n_fijo, n_total, r_fijo, r_var):
+    """
+    Cuotas e intereses de las páginas Hipoteca Fija/Mixta en forma cerrada.
+
+    Cuota de la fase fija a plazo completo y, al pasar a variable, nueva cuota
+    sobre el capital pendiente. Una fija es ``n_fijo == n_total``. Todos los
+    argumentos admiten arrays, así que se evalúan muchas hipotecas a la vez.
+    """
+    principal = np.asarray(principal, dtype=float)
+    n_fijo = np.minimum(n_fijo, n_total)
+    n_var = np.asarray(n_total) - n_fijo
+    cuota_fija = cuota_francesa(principal, r_fijo, n_total)
+    saldo_fijo = saldo_tras(principal, r_fijo, cuota_fija, n_fijo)
+    cuota_variable = cuota_francesa(saldo_fijo, r_var, n_var)
+    intereses = (cuota_fija * n_fijo - (principal - saldo_fijo)) + (cuota_variable * n_var - np.where(n_var > 0, saldo_fijo, 0.0))
+    return {
+        "cuota_fija": cuota_fija,
+        "cuota_variable": cuota_variable,
+        "intereses": _escalar_si_0d(np.asarray(intereses)),
+    }
+
+
+def cuadro_anual(principal, n_fijo, n_total, r_fijo, r_var):
+    """
+    Cuadro de amortización anual en forma cerrada para una o varias hipotecas.
+
+    Mismas columnas que ``cuadro_amortizacion_fija``/``mixta`` como matrices
+    (hipotecas, años); los años posteriores al plazo de cada hipoteca son NaN.
+    """
+    principal = np.atleast_1d(np.asarray(principal, dtype=float))
+    n_total = np.broadcast_to(np.asarray(n_total), principal.shape)
+    n_fijo = np.minimum(np.broadcast_to(np.asarray(n_fijo), principal.shape), n_total)
+    r_fijo = np.broadcast_to(np.asarray(r_fijo, dtype=float), principal.shape)
+    r_var = np.broadcast_to(np.asarray(r_var, dtype=float), principal.shape)
+    res = hipoteca_cerrada(principal, n_fijo, n_total, r_fijo, r_var)
+    cuota_fija = res["cuota_fija"][:, None]
+    cuota_variable = res["cuota_variable"][:, None]
+    saldo_fijo = saldo_tras(principal, r_fijo, res["cuota_fija"], n_fijo)[:, None]
+
+    anios = int(-(-n_total.max() // 12))
+    mes = 12 * np.arange(0, anios + 1)[None, :]
+    nf = n_fijo[:, None]
+    saldo = np.where(
+        mes <= nf,
+        saldo_tras(principal[:, None], r_fijo[:, None], cuota_fija, mes),
+        saldo_tras(saldo_fijo, r_var[:, None], cuota_variable, mes - nf),
+    )
+    saldo = np.maximum(saldo, 0.0)
+    meses_fijo = np.clip(np.minimum(mes[:, 1:], nf) - mes[:, :-1], 0, 12)
+    pagado = cuota_fija * meses_fijo + cuota_variable * (12 - meses_fijo)
+    capital = saldo[:, :-1] - saldo[:, 1:]
+    dentro = mes[:, 1:] <= n_total[:, None]
+    nan = np.full(capital.shape, np.nan)
+    return {
+        "Año": np.arange(1, anios + 1),
+        "Cuota total pagada": np.where(dentro, np.where(mes[:, 1:] <= nf, cuota_fija, cuota_variable) * 12, nan),
+        "Intereses pagados": np.where(dentro, pagado - capital, nan),
+        "Capital amortizado": np.where(dentro, capital, nan),
+        "Capital pendiente": np.where(dentro, saldo[:, 1:], nan),
+    }
+
+
+def backtest_fija_vs_mixta(euribor_hist, principal, n_fija, r_fija,
+                           n_fijo, n_total, r_fijo_mixta, diferencial):
+    """
+    Compara una fija y una mixta empezando en cada mes de la serie histórica.
+
+    Para el inicio ``s`` la revisión ``k`` de la mixta usa el Euríbor del mes
+    ``s + n_fijo + 12k``. Las ventanas se construyen todas a la vez con
+    indexado (rolling) y, si la hipoteca se sale del histórico, se repite el
+    último valor conocido; ``cobertura`` indica qué fracción de revisiones
+    usa datos reales.
+
+    ``diferencia`` = intereses mixta - intereses fija (negativo: gana la mixta).
+    """
+    eur = np.asarray(euribor_hist, dtype=float)
+    n_hist = eur.shape[0]
+    n_var = max(0, int(n_total) - int(n_fijo))
+    n_rev = max(1, -(-n_var // 12))
+
+    idx = np.arange(n_hist)[:, None] + int(n_fijo) + 12 * np.arange(n_rev)[None, :]
+    observado = idx < n_hist
+    eur_rev = eur[np.minimum(idx, n_hist - 1)]
+
+    mixta = mixta_revision_anual(principal, n_fijo, n_total, r_fijo_mixta, eur_rev, diferencial)
+    int_fija = float(intereses_fija(principal, r_fija, n_fija))
+    return {
+        "intereses_fija": int_fija,
+        "intereses_mixta": mixta["intereses"],
+        "diferencia": mixta["intereses"] - int_fija,
+        "cuota_variable": mixta["cuota_variable"],
+        "cuota_maxima": mixta["cuota_maxima"],
+        "cobertura": observado.mean(axis=1) if n_var > 0 else np.ones(n_hist),
+    }
+
+
+def curva_intereses_euribor(euribors, principal, n_fija, r_fija,
+                            n_fijo, n_total, r_fijo_mixta, diferencial):
+    """
+    Intereses totales de la fija y de la mixta para cada Euríbor (en %,
+    constante en toda la fase variable) de ``euribors``.
+
+    Las dos hipotecas y todos los puntos de la rejilla se evalúan en una sola
+    llamada a ``hipoteca_cerrada``: la primera fila es la fija y el resto la
+    mixta con cada Euríbor.
+    """
+    eur = np.atleast_1d(np.asarray(euribors, dtype=float))
+    g = eur.shape[0]
+    res = hipoteca_cerrada(
+        np.full(g + 1, float(principal)),
+        np.concatenate(([n_fija], np.full(g, n_fijo))),
+        np.concatenate(([n_fija], np.full(g, n_total))),
+        np.concatenate(([r_fija], np.full(g, r_fijo_mixta))),
+        np.concatenate(([r_fija], (eur + diferencial) / 100 / 12)),
+    )
+    return {
+        "euribor": eur,
+        "intereses_fija": np.full(g, res["intereses"][0]),
+        "intereses_mixta": res["intereses"][1:],
+        "cuota_variable": res["cuota_variable"][1:],
+    }
+
+
+def euribor_equilibrio(principal, n_fija, r_fija, n_fijo, n_total, r_fijo_mixta, diferencial,
+                       minimo=-5.0, maximo=20.0, tolerancia=1e-6, max_iter=100):
+    """
+    Euríbor constante (en %) a partir del cual la mixta paga más intereses
+    que la fija, por bisección.
+
+    Los intereses de la mixta crecen con el Euríbor, así que basta con
+    acotar el cruce en ``[minimo, maximo]``. Todos los argumentos admiten
+    arrays: cada iteración evalúa todos los casos a la vez con
+    ``hipoteca_cerrada``. Devuelve NaN donde no hay cruce en el intervalo
+    (la mixta es siempre más barata o siempre más cara, o no tiene fase
+    variable).
+    """
+    forma = np.broadcast(principal, n_fija, r_fija, n_fijo, n_total, r_fijo_mixta, diferencial).shape
+    objetivo = intereses_fija(principal, r_fija, n_fija)
+
+    def exceso(eur):
+        r_var = (eur + diferencial) / 100 / 12
+        return hipoteca_cerrada(principal, n_fijo, n_total, r_fijo_mixta, r_var)["intereses"] - objetivo
+
+    bajo = np.full(forma, float(minimo))
+    alto = np.full(forma, float(maximo))
+    valido = (exceso(bajo) < 0) & (exceso(alto) > 0)
+    for _ in range(max_iter):
+        if np.max(alto - bajo, initial=0.0) <= tolerancia:
+            break
+        medio = 0.5 * (bajo + alto)
+        arriba = exceso(medio) > 0
+        alto = np.where(arriba, medio, alto)
+        bajo = np.where(arriba, bajo, medio)
+    return _escalar_si_0d(np.where(valido, 0.5 * (bajo + alto), np.nan))
+
+
+# =============================
+# AMORTIZACIÓN ANTICIPADA
+# =============================
+def plazo_restante(saldo, r, pago):
+    """
+    Meses (fraccionarios) que tarda en amortizarse ``saldo`` pagando ``pago``
+    al mes a tipo mensual ``r``: n = -ln(1 - r·saldo/pago) / ln(1 + r).
+
+    Si el pago no cubre los intereses (``pago <= r·saldo``) el préstamo no se
+    amortiza nunca y se devuelve ``inf``.
+    """
+    saldo = np.asarray(saldo, dtype=float)
+    r = np.asarray(r, dtype=float)
+    pago = np.asarray(pago, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        meses = np.where(r == 0, saldo / pago, -np.log1p(-r * saldo / pago) / np.log1p(r))
+    meses = np.where((pago <= 0) | (pago <= r * saldo), np.inf, meses)
+    return _escalar_si_0d(np.where(saldo <= 0, 0.0, meses))
+
+
+def eventos_anuales(n, anticipadas=None, extra_mensual=0.0, extra_anual=0.0, desde_anio=1, hasta_anio=None,
+                    indexacion_pct=0.0):
+    """
+    Dinero extra de cada año del préstamo como array (años, 2): columna 0,
+    lo que se amortiza al empezar el año (puntuales + aportación anual);
+    columna 1, la aportación de cada mes de ese año.
+
+    Es todo lo que ``amortizacion_anticipada`` necesita de las
+    amortizaciones: dos planes con las mismas filas hasta el año k tienen
+    el mismo cuadro hasta ese año.
+    """
+    n_anios = -(-int(n) // 12)
+    hasta_anio = hasta_anio if hasta_anio is not None else int(n) // 12
+    eventos = np.zeros((n_anios, 2))
+    for ev in anticipadas or []:
+        if 1 <= int(ev["anio"]) <= n_anios:
+            eventos[int(ev["anio"]) - 1, 0] += float(ev["importe"])
+    anios = np.arange(1, n_anios + 1)
+    periodica = (desde_anio <= anios) & (anios <= hasta_anio)
+    factor = np.array([(1 + indexacion_pct / 100) ** int(a - desde_anio) for a in anios])
+    eventos[:, 0] += np.where(periodica, extra_anual * factor, 0.0)
+    eventos[:, 1] = np.where(periodica, extra_mensual * factor, 0.0)
+    return eventos
+
+
+def amortizacion_anticipada(principal, r, n, anticipadas=None, modo="Plazo",
+                            extra_mensual=0.0, extra_anual=0.0, desde_anio=1, hasta_anio=None,
+                            indexacion_pct=0.0, eventos=None, punto_control=None):
+    """
+    Hipoteca fija con amortizaciones anticipadas puntuales y aportaciones periódicas.
+
+    ``anticipadas`` es una lista de dicts {anio, importe}: se amortizan al
+    empezar ese año (tras ``(anio - 1) * 12`` cuotas). Las aportaciones
+    periódicas (``extra_mensual`` cada mes, ``extra_anual`` al empezar cada
+    año) van de ``desde_anio`` a ``hasta_anio`` y crecen un
+    ``indexacion_pct`` % al año. En lugar de todo eso se puede pasar
+    directamente ``eventos`` (ver ``eventos_anuales``).
+
+    En modo "Plazo" se mantiene la cuota y se acorta el plazo; en modo
+    "Cuota" se recalcula la cuota al empezar cada año sobre el capital y el
+    plazo restantes. Dentro de un año el pago mensual es constante, así que
+    cada año se liquida en forma cerrada (``saldo_tras``) y el mes de
+    cancelación sale de ``plazo_restante``: como mucho un paso por año.
+
+    Devuelve un dict con intereses, meses pagados, cuotas inicial y final,
+    total amortizado, ``amortiza`` (False si el pago no cubre los intereses),
+    un cuadro anual y lo amortizado al empezar cada año
+    (``anticipado_inicio``, sin las aportaciones mensuales).
+
+    El resultado incluye además ``puntos_control``: el estado (capital,
+    cuota, intereses y meses acumulados y filas del cuadro) al terminar cada
+    año, indexado por años transcurridos. Con uno de ellos como parámetro
+    ``punto_control`` el cálculo sigue desde ese año con el mismo resultado
+    que desde el principio, siempre que los ``eventos`` de los años
+    anteriores no hayan cambiado.
+    """
+    n = int(n)
+    if eventos is None:
+        eventos = eventos_anuales(n, anticipadas, extra_mensual, extra_anual, desde_anio, hasta_anio, indexacion_pct)
+
+    cuota_inicial = float(cuota_francesa(float(principal), r, n))
+    if punto_control is None:
+        inicio, saldo, cuota, intereses, meses, aportado = 0, float(principal), cuota_inicial, 0.0, 0, 0.0
+        filas = []
+    else:
+        inicio = punto_control["anios"]
+        saldo, cuota = punto_control["saldo"], punto_control["cuota"]
+        intereses, meses, aportado = punto_control["intereses"], punto_control["meses"], punto_control["aportado"]
+        filas = [tuple(f) for f in punto_control["filas"]]
+    amortiza = True
+    puntos = {}
+    for anio in range(inicio + 1, -(-n // 12) + 1):
+        if saldo <= 1e-8:
+            break
+        anticipado = min(float(eventos[anio - 1, 0]), saldo)
+        saldo -= anticipado
+        aportado += anticipado
+        if modo == "Cuota":
+            cuota = float(cuota_francesa(saldo, r, n - meses)) if saldo > 1e-8 else 0.0
+        extra = float(eventos[anio - 1, 1])
+        pago = cuota + extra
+
+        meses_anio = min(12, n - meses) if modo == "Cuota" else 12
+        m = float(plazo_restante(saldo, r, pago))
+        if np.isinf(m):
+            amortiza = False
+            break
+        if saldo <= 1e-8:
+            k, interes, saldo_fin = 0, 0.0, 0.0
+        elif m > meses_anio - 1e-9:
+            k = meses_anio
+            saldo_fin = float(saldo_tras(saldo, r, pago, k))
+            interes = pago * k - (saldo - saldo_fin)
+        else:
+            # Se cancela este año: k - 1 pagos completos y un último pago por el resto
+            k = max(1, int(np.ceil(m - 1e-9)))
+            saldo_prev = float(saldo_tras(saldo, r, pago, k - 1))
+            interes = pago * (k - 1) - (saldo - saldo_prev) + saldo_prev * r
+            saldo_fin = 0.0
+        aportado += extra * k
+        intereses += interes
+        meses += k
+        filas.append((anio, cuota, anticipado + extra * k, interes, max(saldo_fin, 0.0), anticipado))
+        saldo = saldo_fin
+        puntos[anio] = {
+            "anios": anio, "saldo": saldo, "cuota": cuota, "intereses": intereses, "meses": meses,
+            "aportado": aportado, "filas": np.array(filas, dtype=float),
+        }
+
+    cuadro = np.array(filas, dtype=float).reshape(-1, 6)
+    return {
+        "intereses": intereses,
+        "meses": meses,
+        "cuota_inicial": cuota_inicial,
+        "cuota_final": cuota,
+        "amortizado": aportado,
+        "amortiza": amortiza,
+        "anticipado_inicio": cuadro[:, 5],
+        "cuadro": {
+            "Año": cuadro[:, 0].astype(int),
+            "Cuota": cuadro[:, 1],
+            "Amortización anticipada": cuadro[:, 2],
+            "Intereses pagados": cuadro[:, 3],
+            "Capital pendiente": cuadro[:, 4],
+        },
+        "puntos_control": puntos,
+    }
+
+
+def _flujos_anuales(res, principal, n_anios):
+    """Pagos al banco por año (cuotas + amortizaciones) y capital pendiente al final de cada año."""
+    cuadro = res["cuadro"]
+    k = len(cuadro["Año"])
+    saldo_fin = np.zeros(n_anios)
+    saldo_fin[:k] = cuadro["Capital pendiente"]
+    saldo_ini = np.concatenate(([float(principal)], saldo_fin[:-1]))
+    intereses = np.zeros(n_anios)
+    intereses[:k] = cuadro["Intereses pagados"]
+    anticipado = np.zeros(n_anios)
+    anticipado[:k] = cuadro["Amortización anticipada"]
+    inicio = np.zeros(n_anios)
+    inicio[:k] = res["anticipado_inicio"]
+    pagado = np.where(np.arange(n_anios) < k, intereses + saldo_ini - saldo_fin, 0.0)
+    return pagado, anticipado, inicio, saldo_fin
+
+
+def amortizar_o_invertir(principal, r, n, anticipadas=None, modo="Plazo", com_amort_pct=0.0,
+                         rentabilidad_pct=5.0, volatilidad_pct=15.0, n_caminos=100_000, semilla=0,
+                         percentiles=(5, 50, 95), punto_control=None, cada_anios=5, **periodicas):
+    """
+    Monte Carlo de "amortizar" frente a "invertir" el mismo dinero.
+
+    Las dos estrategias dedican cada año el mismo dinero: la que amortiza
+    paga las amortizaciones de ``amortizacion_anticipada`` (más la comisión
+    ``com_amort_pct``) y la que invierte mete esas cantidades en una cartera
+    y sigue con el cuadro original. Cuando la cuota de la que amortiza baja
+    o su préstamo termina antes, es ella la que invierte la diferencia.
+
+    Rentabilidad anual lognormal con media ``rentabilidad_pct`` y
+    volatilidad ``volatilidad_pct``; las amortizaciones al empezar el año se
+    invierten todo el año y los flujos mensuales a mitad de año. El bucle es
+    sobre años y cada paso opera sobre todos los caminos (array de
+    ``n_caminos``), reproducible con ``semilla``.
+
+    Patrimonio de cada estrategia = cartera - capital pendiente. Devuelve por
+    año la probabilidad de que amortizar deje más patrimonio y percentiles
+    de la diferencia (amortizar - invertir).
+
+    El resultado incluye ``puntos_control``: cada ``cada_anios`` años, la
+    cartera de todos los caminos, el estado del generador aleatorio y los
+    resultados hasta ese año (con 100.000 caminos, unos 800 kB por punto).
+    El año k solo depende de las amortizaciones hasta el año k, así que
+    pasando como parámetro ``punto_control`` uno de un plan que coincide
+    hasta ahí se simulan solo los años siguientes, con los mismos números
+    que desde el principio.
+    """
+    n = int(n)
+    n_anios = -(-n // 12)
+    base = amortizacion_anticipada(principal, r, n)
+    plan = amortizacion_anticipada(principal, r, n, anticipadas, modo, **periodicas)
+    pagado_base, _, _, saldo_base = _flujos_anuales(base, principal, n_anios)
+    pagado_plan, anticipado_plan, inicio_plan, saldo_plan = _flujos_anuales(plan, principal, n_anios)
+
+    com = com_amort_pct / 100
+    # Dinero de más que dedica la estrategia "amortizar" (negativo: invierte ella)
+    flujo_inicio = inicio_plan * (1 + com)
+    flujo_mensual = (pagado_plan - inicio_plan) + com * (anticipado_plan - inicio_plan) - pagado_base
+
+    sigma = np.log1p((volatilidad_pct / 100) ** 2 / (1 + rentabilidad_pct / 100) ** 2) ** 0.5
+    mu = np.log1p(rentabilidad_pct / 100) - 0.5 * sigma ** 2
+    rng = np.random.default_rng(semilla)
+    cartera = np.zeros(n_caminos)
+    prob = np.zeros(n_anios)
+    media = np.zeros(n_anios)
+    cuantiles = np.zeros((len(percentiles), n_anios))
+    inicio = 0
+    if punto_control is not None:
+        inicio = punto_control["anios"]
+        rng.bit_generator.state = punto_control["rng"]
+        cartera = punto_control["cartera"].copy()
+        prob[:inicio] = punto_control["prob"]
+        media[:inicio] = punto_control["media"]
+        cuantiles[:, :inicio] = punto_control["cuantiles"]
+    puntos = {}
+    for a in range(inicio, n_anios):
+        crecimiento = np.exp(mu + sigma * rng.standard_normal(n_caminos))
+        cartera = (cartera + flujo_inicio[a]) * crecimiento + flujo_mensual[a] * np.sqrt(crecimiento)
+        diferencia = saldo_base[a] - saldo_plan[a] - cartera
+        prob[a] = np.mean(diferencia > 0)
+        media[a] = diferencia.mean()
+        cuantiles[:, a] = np.percentile(diferencia, percentiles)
+        if (a + 1) % cada_anios == 0 and a + 1 < n_anios:
+            puntos[a + 1] = {
+                "anios": a + 1, "cartera": cartera.copy(), "rng": rng.bit_generator.state,
+                "prob": prob[:a + 1].copy(), "media": media[:a + 1].copy(), "cuantiles": cuantiles[:, :a + 1].copy(),
+            }
+    return {
+        "anio": np.arange(1, n_anios + 1),
+        "prob_amortizar": prob,
+        "media": media,
+        "percentiles": dict(zip(percentiles, cuantiles)),
+        "intereses_ahorrados": base["intereses"] - plan["intereses"],
+        "comision": com * plan["amortizado"],
+        "puntos_control": puntos,
+    }
+
+
+# =============================
+# CAPACIDAD DE ENDEUDAMIENTO (BÚSQUEDA DE OBJETIVOS)
+# =============================
+def cuota_asumible(ingresos, ratio_pct, otras_deudas=0.0):
+    """Cuota máxima para no superar ``ratio_pct`` % de los ingresos con todas las deudas (nunca negativa)."""
+    cuota = np.asarray(ingresos, dtype=float) * np.asarray(ratio_pct, dtype=float) / 100 - otras_deudas
+    return _escalar_si_0d(np.maximum(cuota, 0.0))
+
+
+def principal_maximo(cuota, r, n):
+    """
+    Mayor capital que se amortiza con ``cuota`` en ``n`` meses a tipo mensual
+    ``r`` (inversa de ``cuota_francesa``): cuota * (1 - (1 + r)^-n) / r.
+    Admite arrays, por ejemplo una rejilla plazos × tipos.
+    """
+    cuota = np.asarray(cuota, dtype=float)
+    r = np.asarray(r, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        principal = np.where(r == 0, cuota * n, cuota * -np.expm1(-n * np.log1p(r)) / r)
+    return _escalar_si_0d(np.where(n > 0, principal, 0.0))
+
+
+def plazo_para_cuota(principal, r, cuota):
+    """
+    Meses enteros necesarios para amortizar ``principal`` sin pagar más de
+    ``cuota`` al mes (``plazo_restante`` redondeado hacia arriba); ``inf``
+    si la cuota no cubre los intereses.
+    """
+    meses = np.asarray(plazo_restante(principal, r, cuota), dtype=float)
+    return _escalar_si_0d(np.where(np.isfinite(meses), np.ceil(meses - 1e-9), np.inf))
+
+
+def tipo_maximo(principal, n, cuota, maximo_pct=30.0, tolerancia=1e-9, max_iter=100):
+    """
+    Mayor tipo anual (%) con el que la cuota de ``principal`` a ``n`` meses
+    no supera ``cuota``.
+
+    No hay forma cerrada: bisección sobre ``cuota_francesa``, que crece con
+    el tipo, evaluando todos los casos (arrays) en cada iteración. NaN si ni
+    al 0 % es asumible; ``maximo_pct`` si lo es incluso a ese tipo.
+    """
+    forma = np.broadcast(principal, n, cuota).shape
+    bajo = np.zeros(forma)
+    alto = np.full(forma, maximo_pct / 100 / 12)
+    asumible = cuota_francesa(principal, bajo, n) <= cuota
+    tope = cuota_francesa(principal, alto, n) <= cuota
+    for _ in range(max_iter):
+        if np.max(alto - bajo, initial=0.0) <= tolerancia:
+            break
+        medio = 0.5 * (bajo + alto)
+        caro = cuota_francesa(principal, medio, n) > cuota
+        alto = np.where(caro, medio, alto)
+        bajo = np.where(caro, bajo, medio)
+    tipo = np.where(tope, maximo_pct, bajo * 12 * 100)
+    return _escalar_si_0d(np.where(asumible, tipo, np.nan))
+
+
+# =============================
+# BONIFICACIONES: SUBCONJUNTOS Y AÑO DE ABANDONO
+# =============================
+def optimizar_bonificaciones(principal, n, tin, bonificaciones_pp, costes_anuales, pct_saldo=None, subida_pct=None):
+    """
+    Evalúa a la vez cada subconjunto de productos bonificados × año de abandono.
+
+    Un escenario mantiene un subconjunto de productos hasta el inicio del año
+    ``d`` (d = 1: ninguno; d = años + 1: todo el plazo). Mientras se mantienen,
+    el TIN baja la suma de sus bonificaciones (sin bajar de 0) y se paga su
+    coste; al abandonarlos, la cuota se recalcula al TIN sin
+    bonificar sobre el capital y el plazo restantes. Es la misma estructura
+    que una mixta, así que todos los escenarios salen de una llamada a
+    ``cuadro_anual`` (2^productos × (años + 1) filas).
+
+    El coste de cada producto en el año ``y`` es
+    ``costes_anuales * (1 + subida_pct/100)^(y-1) + pct_saldo/100 * capital
+    pendiente al empezar el año``, con el capital de cada escenario tomado
+    del mismo cuadro (p. ej. un seguro de vida que baja con el saldo).
+
+    Devuelve matrices (subconjuntos, años de abandono) de intereses, costes
+    y total, las máscaras de cada subconjunto, el mejor escenario y el
+    valor marginal de cada producto en él (cuánto más costaría la
+    estrategia óptima sin ese producto, o cuánto ahorraría añadiéndolo).
+    """
+    bonif = np.asarray(bonificaciones_pp, dtype=float)
+    costes = np.asarray(costes_anuales, dtype=float)
+    k = bonif.shape[0]
+    pct_saldo = np.zeros(k) if pct_saldo is None else np.asarray(pct_saldo, dtype=float)
+    subida = np.zeros(k) if subida_pct is None else np.asarray(subida_pct, dtype=float)
+    n = int(n)
+    n_anios = -(-n // 12)
+    mascaras = ((np.arange(2 ** k)[:, None] >> np.arange(k)[None, :]) & 1).astype(bool)
+    abandono = np.arange(1, n_anios + 2)
+
+    r_con = np.maximum(0.0, tin - mascaras @ bonif) / 100 / 12
+    r_sin = max(0.0, tin) / 100 / 12
+    meses_con = np.minimum((abandono - 1) * 12, n)
+    cuadro = cuadro_anual(
+        np.full(2 ** k * abandono.shape[0], float(principal)),
+        np.tile(meses_con, 2 ** k),
+        n,
+        np.repeat(r_con, abandono.shape[0]),
+        r_sin,
+    )
+    forma = (2 ** k, abandono.shape[0])
+    intereses_anuales = np.nan_to_num(cuadro["Intereses pagados"])
+    saldo_inicio = np.concatenate(
+        (np.full((cuadro["Capital pendiente"].shape[0], 1), float(principal)), np.nan_to_num(cuadro["Capital pendiente"][:, :-1])),
+        axis=1,
+    )
+    con_productos = np.arange(n_anios)[None, :] < np.tile(abandono - 1, 2 ** k)[:, None]
+    # Coste fijo por producto y año (con su subida) y % sobre el saldo de cada escenario
+    fijos = costes[:, None] * (1 + subida[:, None] / 100) ** np.arange(n_anios)[None, :]
+    costes_anuales_esc = (
+        np.repeat(mascaras @ fijos, abandono.shape[0], axis=0)
+        + np.repeat(mascaras @ pct_saldo / 100, abandono.shape[0])[:, None] * saldo_inicio
+    ) * con_productos
+
+    intereses = intereses_anuales.sum(axis=1).reshape(forma)
+    coste_productos = costes_anuales_esc.sum(axis=1).reshape(forma)
+    total = intereses + coste_productos
+    s_mejor, d_mejor = np.unravel_index(np.argmin(total), forma)
+    # Subconjunto con / sin cada producto, con el mismo año de abandono
+    bits = 1 << np.arange(k)
+    con = s_mejor | bits
+    sin = s_mejor & ~bits
+    marginal = total[sin, d_mejor] - total[con, d_mejor]
+    return {
+        "mascaras": mascaras,
+        "abandono": abandono,
+        "intereses": intereses,
+        "coste_productos": coste_productos,
+        "total": total,
+        "intereses_anuales": intereses_anuales.reshape(forma + (n_anios,)),
+        "costes_anuales": costes_anuales_esc.reshape(forma + (n_anios,)),
+        "mejor": (int(s_mejor), int(abandono[d_mejor])),
+        "marginal": marginal,
+    }
+
+
+# =============================
+# SUBROGACIÓN, NOVACIÓN Y CANCELACIÓN CON NUEVA HIPOTECA
+# =============================
+def intereses_acumulados(principal, r, n, meses):
+    """
+    Intereses pagados hasta cada mes de ``meses`` por un préstamo francés
+    (cuota * m - capital amortizado). Con ``principal``, ``r`` y ``n`` de
+    forma (k, 1) y ``meses`` de forma (M,) devuelve la matriz (k, M).
+    """
+    cuota = cuota_francesa(principal, r, n)
+    m = np.minimum(meses, n)
+    return cuota * m - (principal - np.maximum(saldo_tras(principal, r, cuota, m), 0.0))
+
+
+def comparar_alternativas(saldo, r_actual, n_restantes, tin_pct, meses, gastos, comision_pct):
+    """
+    Compara seguir con la hipoteca actual frente a varias alternativas
+    (subrogación, novación o cancelar y firmar otra) sobre el mismo capital
+    pendiente ``saldo``.
+
+    Cada alternativa tiene su TIN anual ``tin_pct`` (%), su plazo en
+    ``meses``, unos gastos fijos ``gastos`` (€) y una comisión
+    ``comision_pct`` (% del saldo: compensación por subrogación o
+    cancelación, comisión de novación...). Todas se evalúan a la vez con
+    la forma cerrada, incluida la hipoteca actual como primera fila.
+
+    El ahorro acumulado en el mes m es la diferencia de intereses pagados
+    hasta m menos el coste de la operación; al final de ambos plazos es el
+    ahorro neto. Devuelve arrays por alternativa (``cuota``, ``intereses``,
+    ``coste_operacion``, ``ahorro``, ``mes_recuperacion``: primer mes desde
+    el que el ahorro acumulado ya no vuelve a ser negativo, NaN si nunca),
+    la matriz ``ahorro_acumulado`` (alternativas, meses 0..M) y ``orden``
+    (índices de mayor a menor ahorro neto).
+    """
+    tin_pct = np.atleast_1d(np.asarray(tin_pct, dtype=float))
+    meses = np.broadcast_to(np.asarray(meses, dtype=np.int64), tin_pct.shape)
+    gastos = np.broadcast_to(np.asarray(gastos, dtype=float), tin_pct.shape)
+    comision_pct = np.broadcast_to(np.asarray(comision_pct, dtype=float), tin_pct.shape)
+    n_restantes = int(n_restantes)
+
+    r = np.concatenate(([float(r_actual)], tin_pct / 100 / 12))[:, None]
+    n = np.concatenate(([n_restantes], meses))[:, None]
+    eje = np.arange(0, max(n_restantes, int(meses.max(initial=0))) + 1)
+    intereses = intereses_acumulados(np.full(n.shape, float(saldo)), r, n, eje[None, :])
+
+    coste_operacion = gastos + comision_pct / 100 * saldo
+    ahorro_acumulado = intereses[:1] - intereses[1:] - coste_operacion[:, None]
+    ahorro = ahorro_acumulado[:, -1]
+    negativo = ahorro_acumulado < 0
+    ultimo_negativo = np.where(negativo.any(axis=1), eje.shape[0] - 1 - np.argmax(negativo[:, ::-1], axis=1), -1)
+    cuotas = cuota_francesa(saldo, r[:, 0], n[:, 0])
+    return {
+        "cuota_actual": float(cuotas[0]),
+        "intereses_actuales": float(intereses[0, -1]),
+        "cuota": cuotas[1:],
+        "intereses": intereses[1:, -1],
+        "coste_operacion": coste_operacion,
+        "ahorro": ahorro,
+        "mes_recuperacion": np.where(ahorro >= 0, ultimo_negativo + 1, np.nan).astype(float),
+        "mes": eje,
+        "ahorro_acumulado": ahorro_acumulado,
+        "orden": np.argsort(-ahorro, kind="stable"),
+    }
+
+
+# =============================
+# LOTES DE OFERTAS (COMPARADOR)
+# =============================
+def lote_ofertas(ofertas_cfg):
+    """
+    Convierte la lista de ofertas del comparador (``ofertas_cfg``) en un lote
+    columnar: un dict de arrays con una posición por oferta.
+
+    Las amortizaciones parciales quedan en matrices (ofertas, eventos)
+    rellenas con mes 0 (sin evento) y ordenadas por mes dentro de cada oferta.
+    """
+    lote = {
+        "nombre": np.array([cfg.get("nombre", f"Oferta {i+1}") for i, cfg in enumerate(ofertas_cfg)], dtype=object),
+        "mixta": np.array([cfg["tipo"] == "Mixta" for cfg in ofertas_cfg], dtype=bool),
+    }
+    lote["principal"] = np.array([cfg["principal"] for cfg in ofertas_cfg], dtype=float)
+    lote["n_total"] = np.array([int(cfg["years"] * 12) for cfg in ofertas_cfg], dtype=np.int64)
+    lote["n_fijo"] = np.array([
+        int(cfg["years_fixed"] * 12) if cfg["tipo"] == "Mixta" else int(cfg["years"] * 12)
+        for cfg in ofertas_cfg
+    ], dtype=np.int64)
+    lote["tin_fijo"] = np.array([
+        cfg["tin_fijo_mixta"] if cfg["tipo"] == "Mixta" else cfg["tin_fija"] for cfg in ofertas_cfg
+    ], dtype=float)
+    for col in ("euribor", "diferencial"):
+        lote[col] = np.array([cfg.get(col) or 0.0 for cfg in ofertas_cfg], dtype=float)
+    for col in ("bonus_pp", "bonus_cost_anual", "bonus_pct_saldo", "com_apertura_pct", "com_apertura_fija",
+                "com_amort_parcial_pct"):
+        lote[col] = np.array([cfg.get(col, 0.0) for cfg in ofertas_cfg], dtype=float)
+    lote.update(matrices_eventos([cfg.get("amortizaciones") for cfg in ofertas_cfg]))
+    return lote
+
+
+def matrices_eventos(listas_amortizaciones):
+    """Matrices (ofertas, eventos) de mes, importe y modo "Cuota", ordenadas por mes."""
+    n = len(listas_amortizaciones)
+    max_ev = max([len(lista or []) for lista in listas_amortizaciones] + [0])
+    ev_mes = np.zeros((n, max_ev), dtype=np.int64)
+    ev_importe = np.zeros((n, max_ev))
+    ev_cuota = np.zeros((n, max_ev), dtype=bool)
+    for i, lista in enumerate(listas_amortizaciones):
+        eventos = sorted(
+            ({"mes": max(1, int(ev["anio"] * 12)), "importe": float(ev["importe"]), "modo": ev["modo"]}
+             for ev in (lista or [])),
+            key=lambda x: x["mes"]
+        )
+        for j, ev in enumerate(eventos):
+            ev_mes[i, j] = ev["mes"]
+            ev_importe[i, j] = ev["importe"]
+            ev_cuota[i, j] = ev["modo"] == "Cuota"
+    return {"ev_mes": ev_mes, "ev_importe": ev_importe, "ev_cuota": ev_cuota}
+
+
+def indexar_lote(lote, idx):
+    """Subconjunto (o repetición) de filas de un lote."""
+    return {k: v[idx] for k, v in lote.items()}
+
+
+def tipos_mensuales(lote, euribor=None):
+    """
+    Tipos mensuales efectivos (fijo, variable) tras aplicar la bonificación.
+
+    Igual que en el comparador: la bonificación reduce el TIN fijo y el
+    diferencial (sin bajar de 0) y el Euríbor tiene un mínimo de -5 %.
+    """
+    euribor = lote["euribor"] if euribor is None else euribor
+    r_fijo = np.maximum(0.0, lote["tin_fijo"] - lote["bonus_pp"]) / 100.0 / 12.0
+    diff_eff = np.maximum(0.0, lote["diferencial"] - lote["bonus_pp"]) / 100.0
+    r_var = (np.maximum(-5.0, euribor) / 100.0 + diff_eff) / 12.0
+    return r_fijo, r_var
+
+
+# Parámetros respecto a los que se derivan los resultados (todos en puntos porcentuales)
+PARAMETROS_SENSIBILIDAD = ("tin", "euribor", "diferencial")
+
+
+def tangentes_tipos(lote, euribor=None):
+    """
+    Derivadas de los tipos mensuales de ``tipos_mensuales`` respecto a cada
+    parámetro de ``PARAMETROS_SENSIBILIDAD`` (+1 p.p.): dos arrays
+    (parámetros, ofertas). Donde actúa un mínimo (bonificación que deja el
+    tipo en 0, Euríbor en -5 %) la derivada es 0.
+    """
+    euribor = lote["euribor"] if euribor is None else euribor
+    n = lote["principal"].shape[0]
+    paso = 1.0 / 100.0 / 12.0
+    dr_fijo = np.zeros((3, n))
+    dr_var = np.zeros((3, n))
+    dr_fijo[0] = np.where(lote["tin_fijo"] - lote["bonus_pp"] > 0, paso, 0.0)
+    dr_var[1] = np.where(euribor > -5.0, paso, 0.0)
+    dr_var[2] = np.where(lote["diferencial"] - lote["bonus_pp"] > 0, paso, 0.0)
+    return dr_fijo, dr_var
+
+
+def factores_descuento(n_meses, tasa_pct=0.0, curva=None):
+    """
+    Factor de descuento al final de cada mes 1..``n_meses``: (1 + z)^-t con
+    t en años.
+
+    Sin ``curva``, z es el tipo anual fijo ``tasa_pct`` (%). Con ``curva``
+    (array (plazos, 2): plazo en años y tipo cero anual en %, p. ej. de
+    ``euribor.cargar_curva_descuento``) z se interpola linealmente por plazo
+    y se mantiene constante fuera de los plazos dados. Para deflactar por
+    inflación basta pasar la inflación anual como ``tasa_pct``.
+    """
+    t = np.arange(1, int(n_meses) + 1) / 12
+    if curva is None:
+        z = np.full(t.shape, float(tasa_pct))
+    else:
+        curva = np.asarray(curva, dtype=float)
+        z = np.interp(t, curva[:, 0], curva[:, 1])
+    return (1 + z / 100) ** -t
+
+
+def _simular_lote_compilado(lote, euribor_mensual, coste_mensual, descuentos, umbral_subida, horizonte, n_cubetas):
+    """``simular_lote`` sin sensibilidades con el bucle compilado de ``nucleo``."""
+    n = lote["principal"].shape[0]
+    principal = lote["principal"].astype(float)
+    n_total = lote["n_total"].astype(np.int64)
+    n_meses = int(n_total.max(initial=0))
+    r_fijo, r_var = tipos_mensuales(lote)
+    if euribor_mensual is not None:
+        trayectoria = np.broadcast_to(np.asarray(euribor_mensual, dtype=float), (n, np.shape(euribor_mensual)[-1]))
+    else:
+        trayectoria = np.zeros((n, 0))
+    if descuentos is not None:
+        descuentos = np.atleast_2d(np.asarray(descuentos, dtype=float))
+        if descuentos.shape[1] < n_meses:
+            raise ValueError(f"descuentos necesita al menos {n_meses} meses")
+    else:
+        descuentos = np.zeros((0, 0))
+    coste_apertura = principal * (lote["com_apertura_pct"] / 100.0) + lote["com_apertura_fija"]
+    res = {
+        "cuota_inicial": np.zeros(n),
+        "cuota_variable": np.zeros(n),
+        "cuota_maxima": np.zeros(n),
+        "intereses": np.zeros(n),
+        "coste_apertura": coste_apertura,
+        "coste_amort_parcial": np.zeros(n),
+        "coste_bonificaciones": np.zeros(n),
+        "meses_pagados": np.zeros(n, dtype=np.int64),
+        "mes_subida": np.zeros(n, dtype=np.int64),
+    }
+    acumulado = np.zeros((n, n_meses if coste_mensual else 0))
+    coste_descontado = np.zeros((descuentos.shape[0], n))
+    if horizonte is not None:
+        flujos = np.zeros((len(CONCEPTOS_FLUJO), n_cubetas, horizonte))
+        cubeta = lote.get("cubeta", np.zeros(n, dtype=np.int64)).astype(np.int64)
+        mes_inicio = lote.get("mes_inicio", np.zeros(n, dtype=np.int64)).astype(np.int64)
+    else:
+        flujos = np.zeros((0, 0, 0))
+        cubeta = mes_inicio = np.zeros(0, dtype=np.int64)
+    simular_meses(
+        principal, n_total, lote["n_fijo"].astype(np.int64), np.ascontiguousarray(r_fijo, dtype=float),
+        np.ascontiguousarray(r_var, dtype=float),
+        np.maximum(0.0, lote["diferencial"] - lote["bonus_pp"]) / 100.0, np.ascontiguousarray(trayectoria),
+        lote["ev_mes"].astype(np.int64), lote["ev_importe"].astype(float), lote["ev_cuota"].astype(bool),
+        lote["com_amort_parcial_pct"] / 100.0, coste_apertura, lote["bonus_cost_anual"].astype(float),
+        lote["bonus_pct_saldo"] / 100.0, n_meses, acumulado, np.ascontiguousarray(descuentos),
+        res["cuota_inicial"], res["cuota_variable"], res["intereses"], res["coste_amort_parcial"],
+        res["coste_bonificaciones"], res["meses_pagados"], coste_descontado,
+        -1.0 if umbral_subida is None else float(umbral_subida), res["cuota_maxima"], res["mes_subida"],
+        cubeta, mes_inicio, flujos,
+    )
+    res["total_coste"] = res["intereses"] + coste_apertura + res["coste_amort_parcial"] + res["coste_bonificaciones"]
+    # Mismo orden de claves que el bucle de NumPy
+    claves = ("cuota_inicial", "cuota_variable", "cuota_maxima", "intereses", "coste_apertura",
+              "coste_amort_parcial", "coste_bonificaciones", "total_coste", "meses_pagados")
+    res = {k: res[k] for k in claves + (("mes_subida",) if umbral_subida is not None else ())}
+    if coste_mensual:
+        res["coste_acumulado"] = acumulado
+    if descuentos.shape[0]:
+        res["coste_descontado"] = (coste_descontado + coste_apertura - principal).T
+    if horizonte is not None:
+        res["flujos"] = flujos
+    return res
+
+
+def simular_lote(lote, euribor_mensual=None, sensibilidades=False, coste_mensual=False, descuentos=None,
+                 compilado=None, umbral_subida=None, horizonte=None, n_cubetas=1):
+    """
+    Simula mes a mes todas las ofertas del lote a la vez.
+
+    Mismas reglas que ``simulate_offer``: recálculo de cuota al entrar en la
+    fase variable, amortizaciones parciales (plazo o cuota) con su comisión,
+    comisión de apertura y coste anual de bonificaciones por año pagado: un
+    importe fijo (``bonus_cost_anual``) más un % del capital pendiente al
+    empezar el año (``bonus_pct_saldo``, p. ej. un seguro de vida cuya prima
+    baja con el saldo). El bucle es sobre meses; cada paso opera sobre todas
+    las ofertas.
+
+    ``euribor_mensual`` (opcional, en %, forma (meses,) o (ofertas, meses))
+    da una trayectoria de Euríbor por mes del préstamo. La fase variable toma
+    el valor del mes de cada revisión anual y, si el tipo cambia, recalcula
+    la cuota sobre el capital y el plazo restantes. Sin trayectoria se usa el
+    Euríbor constante de cada oferta.
+
+    ``cuota_variable`` es la cuota recalculada al entrar en la fase variable
+    (la inicial en las fijas) y ``cuota_maxima`` la mayor cuota de cualquier
+    mes pagado. Con ``umbral_subida`` (p. ej. 0.2) se añade ``mes_subida``:
+    primer mes en que la cuota supera en más de ese tanto por uno a la
+    inicial (0 si no ocurre nunca). Con ``sensibilidades=True`` se propagan en el
+    mismo bucle las derivadas (modo directo) de saldo, cuota e intereses y
+    se añaden ``sens_<resultado>_<parámetro>``: € por +1 p.p. de TIN fijo,
+    Euríbor (desplazamiento paralelo de la trayectoria) y diferencial, para
+    ``intereses``, ``cuota_inicial`` y ``cuota_variable``.
+
+    Con ``coste_mensual=True`` se añade ``coste_acumulado`` (ofertas, meses):
+    coste total acumulado al final de cada mes (apertura desde el inicio,
+    intereses, comisiones de amortización y el coste anual de bonificaciones
+    al empezar cada año pagado), en un eje de meses común a todas las
+    ofertas; tras la cancelación se mantiene constante.
+
+    ``descuentos`` (opcional, forma (curvas, meses), ver ``factores_descuento``)
+    añade ``coste_descontado`` (ofertas, curvas): apertura + Σ flujo del mes ×
+    factor del mes − principal, donde el flujo es todo lo pagado ese mes
+    (cuota, amortizaciones parciales con su comisión y bonificaciones). Es el
+    producto escalar flujos · factores, acumulado mes a mes en el mismo bucle
+    para no guardar la matriz (ofertas, meses) de flujos. Con factores 1 es
+    ``total_coste``.
+
+    Con ``horizonte`` (meses) se añade ``flujos`` (conceptos, cubetas,
+    meses): lo cobrado cada mes de calendario sumado por cubeta, con los
+    conceptos de ``CONCEPTOS_FLUJO`` (intereses, capital de la cuota,
+    amortizaciones anticipadas, comisiones de apertura y amortización y
+    saldo vivo al cierre del mes). Cada oferta cae en la cubeta
+    ``lote["cubeta"]`` (0..``n_cubetas`` - 1) y su mes 1 es la columna
+    ``lote["mes_inicio"]``, que puede ser negativa para préstamos ya en
+    marcha; los meses fuera de [0, horizonte) se descartan. Se acumula en
+    el mismo bucle, sin guardar flujos por oferta.
+
+    ``compilado`` elige el bucle: ``None`` usa el de ``nucleo`` (numba) si
+    está disponible, ``False`` fuerza el de NumPy. Las sensibilidades solo
+    están en el de NumPy.
+    """
+    if compilado is None:
+        compilado = HAY_JIT
+    if compilado and not sensibilidades:
+        return _simular_lote_compilado(lote, euribor_mensual, coste_mensual, descuentos, umbral_subida, horizonte,
+                                       n_cubetas)
+
+    n = lote["principal"].shape[0]
+    principal = lote["principal"].astype(float)
+    n_total = lote["n_total"]
+    n_fijo = lote["n_fijo"]
+    tiene_var = n_fijo < n_total
+    r_fijo, r_var = tipos_mensuales(lote)
+    filas = np.arange(n)
+    if euribor_mensual is not None:
+        trayectoria = np.broadcast_to(np.asarray(euribor_mensual, dtype=float), (n, np.shape(euribor_mensual)[-1]))
+
+    ev_mes = lote["ev_mes"]
+    ev_importe = lote["ev_importe"]
+    ev_cuota = lote["ev_cuota"]
+    meses_evento = set(np.unique(ev_mes[ev_mes > 0]).tolist())
+    pct_amort = lote["com_amort_parcial_pct"] / 100.0
+
+    saldo = principal.copy()
+    r = np.where(n_fijo >= 1, r_fijo, r_var)
+    cuota = cuota_francesa(saldo, r, n_total)
+    cuota_inicial = cuota.copy()
+    cuota_variable = cuota.copy()
+    cuota_maxima = np.zeros(n)
+    mes_subida = np.zeros(n, dtype=np.int64)
+    intereses = np.zeros(n)
+    com_amort = np.zeros(n)
+    meses_pagados = np.zeros(n, dtype=np.int64)
+    coste_apertura = principal * (lote["com_apertura_pct"] / 100.0) + lote["com_apertura_fija"]
+    n_meses = int(n_total.max(initial=0))
+    coste_bonis = np.zeros(n)
+    pct_saldo = lote["bonus_pct_saldo"] / 100.0
+    if coste_mensual:
+        acumulado = np.zeros((n, n_meses))
+    if descuentos is not None:
+        descuentos = np.atleast_2d(np.asarray(descuentos, dtype=float))
+        if descuentos.shape[1] < n_meses:
+            raise ValueError(f"descuentos necesita al menos {n_meses} meses")
+        coste_descontado = np.zeros((descuentos.shape[0], n))
+    if horizonte is not None:
+        flujos = np.zeros((len(CONCEPTOS_FLUJO), n_cubetas, horizonte))
+        celda_base = lote.get("cubeta", np.zeros(n, dtype=np.int64)) * horizonte
+        mes_inicio = lote.get("mes_inicio", np.zeros(n, dtype=np.int64))
+
+    if sensibilidades:
+        # Tangentes (parámetros, ofertas) de saldo, cuota e intereses
+        dr_fijo, dr_var = tangentes_tipos(lote)
+        dr = np.where(n_fijo >= 1, dr_fijo, dr_var)
+        d_saldo = np.zeros((3, n))
+        d_cuota = derivadas_cuota(saldo, r, n_total)[1] * dr
+        d_cuota_inicial = d_cuota.copy()
+        d_cuota_variable = d_cuota.copy()
+        d_intereses = np.zeros((3, n))
+
+    mes = 0
+    for mes in range(1, n_meses + 1):
+        activo = (saldo > 1e-8) & (mes <= n_total)
+        if not activo.any():
+            mes -= 1
+            break
+        restantes = n_total - mes + 1
+        saldo_inicio_mes = saldo
+        pagado_mes = np.zeros(n)
+        anticipada_mes = np.zeros(n)
+        comision_mes = coste_apertura if mes == 1 else np.zeros(n)
+
+        # Tipo del mes y recálculo de cuota al entrar en variable (o en cada revisión)
+        en_var = mes > n_fijo
+        recalc = tiene_var & (mes == n_fijo + 1)
+        if euribor_mensual is not None:
+            meses_var = mes - n_fijo - 1
+            revision = n_fijo + 12 * (np.maximum(meses_var, 0) // 12)
+            idx = np.minimum(revision, trayectoria.shape[1] - 1)
+            _, r_var_mes = tipos_mensuales(lote, trayectoria[filas, idx])
+            recalc |= en_var & (meses_var > 0) & (meses_var % 12 == 0) & (r_var_mes != r)
+            if sensibilidades:
+                _, dr_var = tangentes_tipos(lote, trayectoria[filas, idx])
+        else:
+            r_var_mes = r_var
+        r = np.where(en_var, r_var_mes, r_fijo)
+        recalc &= activo
+        entra_var = recalc & (mes == n_fijo + 1)
+        if recalc.any():
+            cuota = np.where(recalc, cuota_francesa(saldo, r, restantes), cuota)
+            cuota_variable = np.where(entra_var, cuota, cuota_variable)
+        if sensibilidades:
+            dr = np.where(en_var, dr_var, dr_fijo)
+            if recalc.any():
+                dc_dp, dc_dr = derivadas_cuota(saldo, r, restantes)
+                d_cuota = np.where(recalc, dc_dp * d_saldo + dc_dr * dr, d_cuota)
+                d_cuota_variable = np.where(entra_var, d_cuota, d_cuota_variable)
+
+        # Amortizaciones parciales de este mes (antes de calcular intereses)
+        if mes in meses_evento:
+            cortado = np.zeros(n, dtype=bool)
+            for j in range(ev_mes.shape[1]):
+                aplica = activo & ~cortado & (ev_mes[:, j] == mes)
+                if not aplica.any():
+                    continue
+                importe = np.where(aplica, np.minimum(ev_importe[:, j], saldo), 0.0)
+                aplica &= importe > 0
+                com_amort += np.where(aplica, importe * pct_amort, 0.0)
+                pagado_mes += np.where(aplica, importe * (1 + pct_amort), 0.0)
+                anticipada_mes = anticipada_mes + np.where(aplica, importe, 0.0)
+                comision_mes = comision_mes + np.where(aplica, importe * pct_amort, 0.0)
+                if sensibilidades:
+                    # Si se amortiza todo el saldo, el importe hereda su derivada
+                    d_saldo = np.where(aplica & (ev_importe[:, j] >= saldo), 0.0, d_saldo)
+                saldo = np.where(aplica, np.maximum(saldo - importe, 0.0), saldo)
+                # En modo "Cuota" se recalcula la cuota y no se aplican más eventos ese mes
+                a_cuota = aplica & ev_cuota[:, j]
+                if a_cuota.any():
+                    cuota = np.where(a_cuota, cuota_francesa(saldo, r, restantes), cuota)
+                    cortado |= a_cuota
+                    if sensibilidades:
+                        dc_dp, dc_dr = derivadas_cuota(saldo, r, restantes)
+                        d_cuota = np.where(a_cuota, dc_dp * d_saldo + dc_dr * dr, d_cuota)
+            activo &= saldo > 1e-8
+
+        interes = np.where(activo, saldo * r, 0.0)
+        capital = np.where(activo, np.minimum(np.maximum(cuota - interes, 0.0), saldo), 0.0)
+        if sensibilidades:
+            d_interes = np.where(activo, d_saldo * r + saldo * dr, 0.0)
+            bruto = cuota - interes
+            d_capital = np.where(activo & (bruto > 0), np.where(bruto < saldo, d_cuota - d_interes, d_saldo), 0.0)
+            d_intereses += d_interes
+            d_saldo = d_saldo - d_capital
+        intereses += interes
+        saldo = saldo - capital
+        meses_pagados += activo
+        cuota_maxima = np.where(activo, np.maximum(cuota_maxima, cuota), cuota_maxima)
+        if umbral_subida is not None:
+            sube = activo & (mes_subida == 0) & (cuota > cuota_inicial * (1 + umbral_subida))
+            mes_subida = np.where(sube, mes, mes_subida)
+        pagado_mes += interes + capital
+        if (mes - 1) % 12 == 0:
+            # Bonificaciones: se pagan al empezar cada año en el que queda algo por pagar
+            bonis_mes = np.where(activo, lote["bonus_cost_anual"] + pct_saldo * saldo_inicio_mes, 0.0)
+            coste_bonis += bonis_mes
+            pagado_mes += bonis_mes
+        if descuentos is not None:
+            coste_descontado += descuentos[:, mes - 1, None] * pagado_mes
+        if coste_mensual:
+            acumulado[:, mes - 1] = coste_apertura + intereses + com_amort + coste_bonis
+        if horizonte is not None:
+            columna = mes_inicio + mes - 1
+            dentro = (columna >= 0) & (columna < horizonte)
+            if dentro.any():
+                celda = celda_base[dentro] + columna[dentro]
+                for k, valores in enumerate((interes, capital, anticipada_mes, comision_mes, saldo)):
+                    flujos[k] += np.bincount(celda, valores[dentro], minlength=n_cubetas * horizonte).reshape(n_cubetas, horizonte)
+
+    res = {
+        "cuota_inicial": cuota_inicial,
+        "cuota_variable": cuota_variable,
+        "cuota_maxima": cuota_maxima,
+        "intereses": intereses,
+        "coste_apertura": coste_apertura,
+        "coste_amort_parcial": com_amort,
+        "coste_bonificaciones": coste_bonis,
+        "total_coste": intereses + coste_apertura + com_amort + coste_bonis,
+        "meses_pagados": meses_pagados,
+    }
+    if umbral_subida is not None:
+        res["mes_subida"] = mes_subida
+    if coste_mensual:
+        acumulado[:, mes:] = acumulado[:, [mes - 1]] if mes > 0 else coste_apertura[:, None]
+        res["coste_acumulado"] = acumulado
+    if descuentos is not None:
+        res["coste_descontado"] = (coste_descontado + coste_apertura - principal).T
+    if horizonte is not None:
+        res["flujos"] = flujos
+    if sensibilidades:
+        for k, parametro in enumerate(PARAMETROS_SENSIBILIDAD):
+            res[f"sens_intereses_{parametro}"] = d_intereses[k]
+            res[f"sens_cuota_inicial_{parametro}"] = d_cuota_inicial[k]
+            res[f"sens_cuota_variable_{parametro}"] = d_cuota_variable[k]
+    return res
+
+
+def simulate_offer(
+    tipo, principal, years,
+    # Fija
+    tin_fija=None,
+    # Mixta
+    years_fixed=None, tin_fijo_mixta=None, euribor=None, diferencial=None,
+    # Bonificaciones
+    bonus_pp=0.0, bonus_cost_anual=0.0, bonus_pct_saldo=0.0,
+    # Comisiones
+    com_apertura_pct=0.0, com_apertura_fija=0.0, com_amort_parcial_pct=0.0,
+    # Amortizaciones parciales
+    amortizaciones=None, # lista de dicts: {anio:int, importe:float, modo:str in {"Plazo","Cuota"}}
+    # Curva de coste acumulado mes a mes
+    coste_mensual=False,
+    # Factores de descuento (curvas, meses) para el coste en valor actual
+    descuentos=None,
+    # Derivadas respecto a los tipos (solo con el bucle de NumPy)
+    sensibilidades=False,
+):
+    """
+    Devuelve: dict con métricas y un pequeño resumen.
+    Simulación mes a mes (lote de una sola oferta en ``simular_lote``) con:
+      - recalculo de cuota al pasar de fijo->variable (mixta)
+      - amortizaciones parciales (reducir plazo o cuota)
+      - comisiones (apertura y amortización)
+      - costes anuales de bonificaciones hasta el último mes pagado (fijos
+        y/o un % del capital pendiente al empezar cada año)
+    Con ``sensibilidades=True`` incluye las sensibilidades ``sens_*`` (€ por
+    +1 p.p.) de ``simular_lote``; sin ellas se usa el bucle compilado si está
+    disponible. Con ``coste_mensual=True``, el array ``coste_acumulado`` (un
+    valor por mes) y con ``descuentos``, el array ``coste_descontado`` (un
+    valor por curva).
+    """
+    cfg = {
+        "tipo": tipo, "principal": principal, "years": years,
+        "tin_fija": tin_fija, "years_fixed": years_fixed, "tin_fijo_mixta": tin_fijo_mixta,
+        "euribor": euribor, "diferencial": diferencial,
+        "bonus_pp": bonus_pp, "bonus_cost_anual": bonus_cost_anual, "bonus_pct_saldo": bonus_pct_saldo,
+        "com_apertura_pct": com_apertura_pct, "com_apertura_fija": com_apertura_fija,
+        "com_amort_parcial_pct": com_amort_parcial_pct, "amortizaciones": amortizaciones,
+    }
+    res = simular_lote(lote_ofertas([cfg]), sensibilidades=sensibilidades, coste_mensual=coste_mensual,
+                       descuentos=descuentos)
+    salida = {
+        k: (int(v[0]) if k == "meses_pagados" else float(v[0]))
+        for k, v in res.items() if k not in ("coste_acumulado", "coste_descontado")
+    }
+    if coste_mensual:
+        salida["coste_acumulado"] = res["coste_acumulado"][0]
+    if descuentos is not None:
+        salida["coste_descontado"] = res["coste_descontado"][0]
+    return salida
+
+
+def argumentos_oferta(cfg):
+    """Argumentos de ``simulate_offer`` para una oferta de ``ofertas_cfg``."""
+    comunes = dict(
+        tipo=cfg["tipo"], principal=cfg["principal"], years=cfg["years"],
+        bonus_pp=cfg.get("bonus_pp", 0.0), bonus_cost_anual=cfg.get("bonus_cost_anual", 0.0),
+        bonus_pct_saldo=cfg.get("bonus_pct_saldo", 0.0),
+        com_apertura_pct=cfg.get("com_apertura_pct", 0.0), com_apertura_fija=cfg.get("com_apertura_fija", 0.0),
+        com_amort_parcial_pct=cfg.get("com_amort_parcial_pct", 0.0),
+        amortizaciones=cfg.get("amortizaciones"),
+    )
+    if cfg["tipo"] == "Fija":
+        return dict(comunes, tin_fija=cfg["tin_fija"])
+    return dict(
+        comunes, years_fixed=cfg["years_fixed"], tin_fijo_mixta=cfg["tin_fijo_mixta"],
+        euribor=cfg["euribor"], diferencial=cfg["diferencial"],
+    )
+
+
+def alinear_costes(curvas):
+    """
+    Apila curvas de coste acumulado de distinta longitud en una matriz
+    (ofertas, meses); las más cortas repiten su último valor.
+    """
+    n_meses = max([len(c) for c in curvas] + [1])
+    matriz = np.zeros((len(curvas), n_meses))
+    for i, c in enumerate(curvas):
+        c = np.asarray(c, dtype=float)
+        if len(c):
+            matriz[i, :len(c)] = c
+            matriz[i, len(c):] = c[-1]
+    return matriz
+
+
+def meses_cruce(acumulado):
+    """
+    Meses en los que se invierte el orden de coste acumulado entre cada par
+    de ofertas (filas de ``acumulado``).
+
+    Se calcula la diferencia de todos los pares a la vez y se buscan los
+    cambios de signo entre meses consecutivos (los empates mantienen el
+    signo anterior). Devuelve arrays ``a``, ``b`` (índices de las ofertas),
+    ``mes`` (1 = primer mes) y ``barata_antes`` (índice de la que era más
+    barata hasta ese mes).
+    """
+    acumulado = np.asarray(acumulado, dtype=float)
+    a, b = np.triu_indices(acumulado.shape[0], 1)
+    signo = np.sign(acumulado[a] - acumulado[b])
+    # Propaga el último signo distinto de cero sobre los empates
+    pos = np.where(signo != 0, np.arange(signo.shape[1]), 0)
+    signo = np.take_along_axis(signo, np.maximum.accumulate(pos, axis=1), axis=1)
+    par, col = np.nonzero(signo[:, 1:] * signo[:, :-1] < 0)
+    return {
+        "a": a[par],
+        "b": b[par],
+        "mes": col + 2,
+        "barata_antes": np.where(signo[par, col] < 0, a[par], b[par]),
+    }
+
+
+# =============================
+# PRUEBAS DE ESTRÉS DE EURÍBOR
+# =============================
+def escenarios_estres(desplazamientos, n_meses, años_rampa=None):
+    """
+    Trayectorias de desplazamiento del Euríbor (p.p. por mes del préstamo).
+
+    Para cada desplazamiento se genera un escenario paralelo (salto desde el
+    primer mes) y, si se indica ``años_rampa``, otro en rampa que llega al
+    mismo desplazamiento linealmente en ese número de años.
+    Devuelve (nombres, tipos, desplazamientos, trayectorias (escenarios, meses)).
+    """
+    d = np.asarray(desplazamientos, dtype=float)
+    t = np.arange(n_meses)
+    trayectorias = [np.repeat(d[:, None], n_meses, axis=1)]
+    tipos = ["Paralelo"] * len(d)
+    valores = list(d)
+    if años_rampa:
+        trayectorias.append(d[:, None] * np.minimum(t / (años_rampa * 12.0), 1.0)[None, :])
+        tipos += ["Rampa"] * len(d)
+        valores += list(d)
+    nombres = [f"{tipo} {v:+.2f} p.p." for tipo, v in zip(tipos, valores)]
+    return nombres, np.array(tipos), np.array(valores), np.vstack(trayectorias)
+
+
+def estres_ofertas(lote, trayectorias):
+    """
+    Evalúa cada par oferta × escenario en una sola llamada a ``simular_lote``.
+
+    ``trayectorias`` (escenarios, meses) se suma al Euríbor estimado de cada
+    oferta. Devuelve los resultados con forma (ofertas, escenarios).
+    """
+    n_ofertas = lote["principal"].shape[0]
+    tray = np.atleast_2d(np.asarray(trayectorias, dtype=float))
+    n_esc = tray.shape[0]
+    n_meses = max(int(lote["n_total"].max(initial=0)), 1)
+    if tray.shape[1] < n_meses:
+        tray = np.pad(tray, ((0, 0), (0, n_meses - tray.shape[1])), mode="edge")
+
+    grande = indexar_lote(lote, np.repeat(np.arange(n_ofertas), n_esc))
+    euribor = (lote["euribor"][:, None, None] + tray[None, :, :n_meses]).reshape(n_ofertas * n_esc, n_meses)
+    res = simular_lote(grande, euribor_mensual=euribor)
+    return {k: v.reshape(n_ofertas, n_esc) for k, v in res.items()}
+
+
+def estabilidad_ranking(costes):
+    """
+    Puestos de cada oferta (filas) en cada escenario (columnas), 1 = más barata.
+    """
+    costes = np.asarray(costes, dtype=float)
+    return np.argsort(np.argsort(costes, axis=0, kind="stable"), axis=0, kind="stable") + 1
+
+
+# =============================
+# MONTE CARLO DE EURÍBOR
+# =============================
+def generar_euribor(rng, n_caminos, n_meses, inicial, media, reversion, volatilidad, out=None):
+    """
+    Trayectorias mensuales de Euríbor (%) con reversión a la media (Vasicek).
+
+    El mes 0 es ``inicial``; después cada mes el Euríbor se acerca a
+    ``media`` a velocidad ``reversion`` (por año) con ``volatilidad`` p.p.
+    por raíz de año, discretizado de forma exacta. El bucle es sobre meses
+    y cada paso usa ``n_caminos`` normales de ``rng``. Si se da ``out``
+    (caminos, meses) se escribe ahí, p. ej. en memoria compartida.
+    """
+    dt = 1.0 / 12.0
+    a = np.exp(-reversion * dt)
+    sd = volatilidad * (np.sqrt((1 - a ** 2) / (2 * reversion)) if reversion > 0 else np.sqrt(dt))
+    out = np.empty((n_caminos, n_meses)) if out is None else out
+    x = np.full(n_caminos, float(inicial))
+    for t in range(n_meses):
+        out[:, t] = x
+        x = x * a + media * (1 - a) + sd * rng.standard_normal(n_caminos)
+    return out
+
+
+def resultados_por_camino(lote, trayectorias, claves=("total_coste",), umbral_subida=None):
+    """
+    Resultados ``claves`` de ``simular_lote`` (cada uno (ofertas, caminos))
+    de cada oferta del lote con cada trayectoria de Euríbor (caminos,
+    meses), que sustituye al Euríbor estimado de las mixtas. Una llamada a
+    ``simular_lote`` por oferta que lee las trayectorias sin copiarlas.
+    """
+    n_ofertas, n_caminos = lote["principal"].shape[0], trayectorias.shape[0]
+    salida = {}
+    for o in range(n_ofertas):
+        res = simular_lote(indexar_lote(lote, np.full(n_caminos, o)), euribor_mensual=trayectorias,
+                           umbral_subida=umbral_subida)
+        for k in claves:
+            salida.setdefault(k, np.empty((n_ofertas, n_caminos), dtype=res[k].dtype))[o] = res[k]
+    return salida
+
+
+def costes_por_camino(lote, trayectorias):
+    """Coste total (ofertas, caminos) con cada trayectoria (ver ``resultados_por_camino``)."""
+    return resultados_por_camino(lote, trayectorias)["total_coste"]
+
+
+def resumen_costes(costes, agrupar=1):
+    """
+    Resumen combinable de una matriz de costes (ofertas, caminos): media,
+    suma de cuadrados de las desviaciones por camino (``m2_caminos``),
+    extremos y veces que cada oferta es la más barata.
+
+    Para el error estándar se usan unidades independientes: cada camino, o
+    la media de cada grupo de ``agrupar`` caminos consecutivos (pares
+    antitéticos, réplicas de Sobol). De ellas se guarda la matriz de
+    co-momentos entre ofertas (``co_m2``), de la que salen también los
+    errores de las diferencias entre ofertas.
+    """
+    n_ofertas, n_caminos = costes.shape
+    media = costes.mean(axis=1)
+    unidades = costes.reshape(n_ofertas, -1, agrupar).mean(axis=2) if agrupar > 1 else costes
+    desv = unidades - media[:, None]
+    return {
+        "n": unidades.shape[1],
+        "n_caminos": n_caminos,
+        "media": media,
+        "m2_caminos": ((costes - media[:, None]) ** 2).sum(axis=1),
+        "co_m2": desv @ desv.T,
+        "minimo": costes.min(axis=1),
+        "maximo": costes.max(axis=1),
+        "veces_mejor": np.bincount(np.argmin(costes, axis=0), minlength=n_ofertas),
+    }
+
+
+def combinar_resumenes(resumenes):
+    """
+    Une resúmenes de ``resumen_costes`` en el orden dado (fórmula de Chan
+    para media y varianza, sin restar sumas de cuadrados grandes) y calcula
+    media, desviación por camino, error estándar de la media, error
+    estándar de cada diferencia entre ofertas (matriz) y probabilidad de
+    ser la más barata. Con el mismo orden el resultado no depende de cómo
+    se repartió el trabajo.
+    """
+    n, n_caminos, media, m2_caminos, co_m2 = 0, 0, 0.0, 0.0, 0.0
+    for r in resumenes:
+        n_total, caminos_total = n + r["n"], n_caminos + r["n_caminos"]
+        delta = r["media"] - media
+        media = media + delta * (r["n_caminos"] / caminos_total)
+        m2_caminos = m2_caminos + r["m2_caminos"] + delta ** 2 * (n_caminos * r["n_caminos"] / caminos_total)
+        co_m2 = co_m2 + r["co_m2"] + np.outer(delta, delta) * (n * r["n"] / n_total)
+        n, n_caminos = n_total, caminos_total
+    # Covarianza del estimador de la media entre cada par de ofertas
+    cov_media = co_m2 / (max(n - 1, 1) * n)
+    var_media = np.diag(cov_media)
+    var_diferencias = var_media[:, None] + var_media[None, :] - 2 * cov_media
+    return {
+        "n_caminos": n_caminos,
+        "n_unidades": n,
+        "media": media,
+        "desviacion": np.sqrt(m2_caminos / max(n_caminos - 1, 1)),
+        "error_estandar": np.sqrt(var_media),
+        "error_diferencias": np.sqrt(np.maximum(var_diferencias, 0.0)),
+        "minimo": np.min([r["minimo"] for r in resumenes], axis=0),
+        "maximo": np.max([r["maximo"] for r in resumenes], axis=0),
+        "prob_mejor": np.sum([r["veces_mejor"] for r in resumenes], axis=0) / n_caminos,
+    }
+
+
+def ranking_decidido(media, error_diferencias, z, solo_mejor=False):
+    """
+    True si el orden por coste medio es estadísticamente claro: cada oferta
+    se separa de la siguiente (o, con ``solo_mejor``, la más barata de todas
+    las demás) en al menos ``z`` errores estándar de su diferencia. Dos
+    ofertas con el mismo coste en todos los caminos cuentan como separadas.
+    """
+    orden = np.argsort(media, kind="stable")
+    if solo_mejor:
+        a, b = np.full(len(orden) - 1, orden[0]), orden[1:]
+    else:
+        a, b = orden[:-1], orden[1:]
+    return bool(np.all(media[b] - media[a] >= z * error_diferencias[a, b]))
+
+
+# =============================
+# REDUCCIÓN DE VARIANZA: ANTITÉTICAS Y SOBOL
+# =============================
+# Trayectorias por unidad independiente de cada método: un camino, un par
+# antitético o una réplica de Sobol (PUNTOS_SOBOL puntos y sus antitéticos).
+PUNTOS_SOBOL = 256
+GRUPO_METODO = {"aleatorio": 1, "antitetico": 2, "sobol": 2 * PUNTOS_SOBOL}
+
+# Números de dirección de Sobol (Joe y Kuo) de las dimensiones 2 en adelante:
+# grado del polinomio primitivo, sus coeficientes interiores y los valores
+# iniciales m_k. La dimensión 1 es la secuencia de van der Corput.
+DIRECCIONES_SOBOL = [
+    (1, 0, (1,)), (2, 1, (1, 3)), (3, 1, (1, 3, 1)), (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)), (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)), (5, 4, (1, 1, 5, 5, 5)), (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)), (5, 13, (1, 1, 1, 3, 11)), (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)), (6, 13, (1, 1, 1, 15, 21, 21)), (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)), (6, 22, (1, 3, 1, 15, 13, 25)), (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)), (7, 4, (1, 3, 7, 13, 13, 15, 69)), (7, 7, (1, 1, 3, 13, 7, 35, 63)),
+    (7, 8, (1, 3, 5, 9, 1, 25, 53)), (7, 14, (1, 3, 1, 13, 9, 35, 107)), (7, 19, (1, 3, 1, 5, 27, 61, 31)),
+    (7, 21, (1, 1, 5, 11, 19, 41, 61)), (7, 28, (1, 3, 5, 3, 3, 13, 69)), (7, 31, (1, 1, 7, 13, 1, 19, 1)),
+    (7, 32, (1, 3, 7, 5, 13, 19, 59)),
+]
+BITS_SOBOL = 32
+
+# Coeficientes de la inversa de la normal (Wichura, AS241), de mayor a menor grado
+_AS241 = {
+    "centro": ([2.5090809287301226727e+3, 3.3430575583588128105e+4, 6.7265770927008700853e+4,
+                4.5921953931549871457e+4, 1.3731693765509461125e+4, 1.9715909503065514427e+3,
+                1.3314166789178437745e+2, 3.3871328727963666080e+0],
+               [5.2264952788528545610e+3, 2.8729085735721942674e+4, 3.9307895800092710610e+4,
+                2.1213794301586595867e+4, 5.3941960214247511077e+3, 6.8718700749205790830e+2,
+                4.2313330701600911252e+1, 1.0]),
+    "medio": ([7.74545014278341407640e-4, 2.27238449892691845833e-2, 2.41780725177450611770e-1,
+               1.27045825245236838258e+0, 3.64784832476320460504e+0, 5.76949722146069140550e+0,
+               4.63033784615654529590e+0, 1.42343711074968357734e+0],
+              [1.05075007164441684324e-9, 5.47593808499534494600e-4, 1.51986665636164571966e-2,
+               1.48103976427480074590e-1, 6.89767334985100004550e-1, 1.67638483018380384940e+0,
+               2.05319162663775882187e+0, 1.0]),
+    "cola": ([2.01033439929228813265e-7, 2.71155556874348757815e-5, 1.24266094738807843860e-3,
+              2.65321895265761230930e-2, 2.96560571828504891230e-1, 1.78482653991729133580e+0,
+              5.46378491116411436990e+0, 6.65790464350110377720e+0],
+             [2.04426310338993978564e-15, 1.42151175831644588870e-7, 1.84631831751005468180e-5,
+              7.86869131145613259100e-4, 1.48753612908506148525e-2, 1.36929880922735805310e-1,
+              5.99832206555887937690e-1, 1.0]),
+}
+
+
+def normal_inversa(u):
+    """Inversa de la función de distribución normal estándar (AS241), vectorizada."""
+    u = np.asarray(u, dtype=float)
+    q = u - 0.5
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centro = 0.180625 - q * q
+        x_centro = q * np.polyval(_AS241["centro"][0], centro) / np.polyval(_AS241["centro"][1], centro)
+        r = np.sqrt(-np.log(np.minimum(u, 1 - u)))
+        x_medio = np.polyval(_AS241["medio"][0], r - 1.6) / np.polyval(_AS241["medio"][1], r - 1.6)
+        x_cola = np.polyval(_AS241["cola"][0], r - 5.0) / np.polyval(_AS241["cola"][1], r - 5.0)
+    x_lado = np.where(r <= 5.0, x_medio, x_cola)
+    return _escalar_si_0d(np.where(np.abs(q) <= 0.425, x_centro, np.where(q < 0, -x_lado, x_lado)))
+
+
+def _direcciones_sobol(dim):
+    # Números de dirección v[d, k] = m_k * 2^(BITS - 1 - k) de cada dimensión
+    v = np.empty((dim, BITS_SOBOL), dtype=np.uint64)
+    v[0] = [1 << (BITS_SOBOL - 1 - k) for k in range(BITS_SOBOL)]
+    for d, (s, a, m) in enumerate(DIRECCIONES_SOBOL[:dim - 1], start=1):
+        m = list(m)
+        for k in range(s, BITS_SOBOL):
+            nuevo = m[k - s] ^ (m[k - s] << s)
+            for j in range(1, s):
+                if (a >> (s - 1 - j)) & 1:
+                    nuevo ^= m[k - j] << j
+            m.append(nuevo)
+        v[d] = [m[k] << (BITS_SOBOL - 1 - k) for k in range(BITS_SOBOL)]
+    return v
+
+
+def sobol(n_puntos, dim, desplazamiento=None):
+    """
+    Primeros ``n_puntos`` de la secuencia de Sobol en ``dim`` dimensiones
+    (como mucho ``len(DIRECCIONES_SOBOL) + 1``), en (0, 1). ``desplazamiento``
+    (enteros de 32 bits, uno por dimensión) aplica un desplazamiento digital
+    aleatorio: cada réplica desplazada es un punto de Sobol uniforme e
+    independiente de las demás, lo que permite estimar el error.
+    """
+    if dim > len(DIRECCIONES_SOBOL) + 1:
+        raise ValueError(f"Sobol admite como mucho {len(DIRECCIONES_SOBOL) + 1} dimensiones")
+    v = _direcciones_sobol(dim)
+    i = np.arange(n_puntos, dtype=np.uint64)
+    gray = i ^ (i >> np.uint64(1))
+    x = np.zeros((n_puntos, dim), dtype=np.uint64)
+    for k in range(max(int(n_puntos - 1).bit_length(), 1)):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        x[bit] ^= v[:, k]
+    if desplazamiento is not None:
+        x ^= np.asarray(desplazamiento, dtype=np.uint64)
+    return (x + 0.5) / 2.0 ** BITS_SOBOL
+
+
+_PCA_EURIBOR = {}
+
+
+def pca_euribor(n_meses, inicial, media, reversion, volatilidad):
+    """
+    Media (meses,) y matriz ``L`` (meses, meses - 1) del Euríbor de
+    ``generar_euribor``: las trayectorias son ``media + Z @ L.T`` con ``Z``
+    normales independientes. Las columnas de ``L`` son las componentes
+    principales ordenadas por varianza, así que las primeras normales
+    deciden casi todo el recorrido (y son las que conviene tomar de Sobol).
+    Se guarda por parámetros: cada bloque del Monte Carlo la reutiliza.
+    """
+    clave = (int(n_meses), float(inicial), float(media), float(reversion), float(volatilidad))
+    # Una sola lectura atómica: otro hilo (sesiones de Streamlit) puede vaciar la caché en cualquier momento
+    guardado = _PCA_EURIBOR.get(clave)
+    if guardado is not None:
+        return guardado
+    t = np.arange(n_meses, dtype=float)
+    a = np.exp(-reversion / 12.0)
+    tendencia = media + (inicial - media) * a ** t
+    s = t[1:, None]
+    u = t[None, 1:]
+    if reversion > 0:
+        cov = volatilidad ** 2 / (2 * reversion) * (a ** np.abs(s - u) - a ** (s + u))
+    else:
+        cov = volatilidad ** 2 / 12.0 * np.minimum(s, u)
+    valores, vectores = np.linalg.eigh(cov)
+    L = np.zeros((n_meses, n_meses - 1))
+    L[1:] = vectores[:, ::-1] * np.sqrt(np.maximum(valores[::-1], 0.0))
+    _PCA_EURIBOR.clear()
+    _PCA_EURIBOR[clave] = (tendencia, L)
+    return tendencia, L
+
+
+def trayectorias_euribor(rng, n_caminos, n_meses, inicial, media, reversion, volatilidad, metodo="aleatorio", out=None):
+    """
+    Trayectorias de Euríbor (caminos, meses) del mismo modelo que
+    ``generar_euribor`` con reducción de varianza:
+
+    - ``"aleatorio"``: ``generar_euribor`` tal cual.
+    - ``"antitetico"``: por cada vector de normales ``z`` también ``-z``
+      (caminos consecutivos), construidos por componentes principales.
+    - ``"sobol"``: réplicas de ``PUNTOS_SOBOL`` puntos de Sobol con
+      desplazamiento digital aleatorio para las primeras componentes
+      principales (normales de ``rng`` para el resto) y sus antitéticos.
+
+    ``n_caminos`` debe ser múltiplo de ``GRUPO_METODO[metodo]``.
+    """
+    grupo = GRUPO_METODO[metodo]
+    if n_caminos % grupo:
+        raise ValueError(f"El número de caminos debe ser múltiplo de {grupo} con el método {metodo!r}")
+    if metodo == "aleatorio":
+        return generar_euribor(rng, n_caminos, n_meses, inicial, media, reversion, volatilidad, out=out)
+
+    out = np.empty((n_caminos, n_meses)) if out is None else out
+    tendencia, L = pca_euribor(n_meses, inicial, media, reversion, volatilidad)
+    n_pares, dim = n_caminos // 2, n_meses - 1
+    if metodo == "sobol":
+        dim_sobol = min(dim, len(DIRECCIONES_SOBOL) + 1)
+        z = np.empty((n_pares, dim))
+        for i in range(0, n_pares, PUNTOS_SOBOL):
+            desplazamiento = rng.integers(0, 2 ** BITS_SOBOL, dim_sobol, dtype=np.uint64)
+            z[i:i + PUNTOS_SOBOL, :dim_sobol] = normal_inversa(sobol(PUNTOS_SOBOL, dim_sobol, desplazamiento))
+            z[i:i + PUNTOS_SOBOL, dim_sobol:] = rng.standard_normal((PUNTOS_SOBOL, dim - dim_sobol))
+    else:
+        z = rng.standard_normal((n_pares, dim))
+    desvio = z @ L.T
+    out[0::2] = tendencia + desvio
+    out[1::2] = tendencia - desvio
+    return out
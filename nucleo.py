@@ -0,0 +1,165 @@
+# =============================
+# NÚCLEO COMPILADO DE LA SIMULACIÓN MES A MES
+# =============================
+"""
+Bucle mensual de ``motor.simular_lote`` compilado con numba.
+
+La versión de NumPy recorre los meses y en cada paso opera sobre todas las
+ofertas; aquí se recorre cada oferta mes a mes en código compilado, sin
+arrays temporales por paso y saliendo del bucle en cuanto la oferta se
+cancela. Las reglas son las mismas y los resultados coinciden con los de
+NumPy salvo el último decimal (~1e-13 relativo: la potencia vectorial de
+NumPy no siempre redondea igual que la escalar).
+
+numba es opcional: si no está instalado (o con HIPOTECAS_JIT=0) ``HAY_JIT``
+es False y ``motor`` usa el bucle de NumPy. La compilación se guarda en
+disco (``cache=True``, en ``__pycache__``), así que solo el primer arranque
+tras instalar o cambiar este fichero paga el tiempo de compilar.
+"""
+import os
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAY_JIT = numba is not None and os.environ.get("HIPOTECAS_JIT", "1") != "0"
+
+
+def _compilar(func):
+    return numba.njit(cache=True, nogil=True)(func) if numba is not None else func
+
+
+@_compilar
+def _cuota(saldo, r, n):
+    # Igual que motor.cuota_francesa para un escalar
+    if n <= 0:
+        return 0.0
+    if r == 0.0:
+        return saldo / n
+    f = (1.0 + r) ** n
+    return saldo * r * f / (f - 1.0)
+
+
+@_compilar
+def simular_meses(principal, n_total, n_fijo, r_fijo, r_var, diff_eff, trayectoria,
+                  ev_mes, ev_importe, ev_cuota, pct_amort, coste_apertura, bonus_cost_anual, pct_saldo,
+                  n_meses, acumulado, descuentos,
+                  cuota_inicial, cuota_variable, intereses, com_amort, coste_bonis, meses_pagados,
+                  coste_descontado, umbral_subida, cuota_maxima, mes_subida, cubeta, mes_inicio, flujos):
+    """
+    Simula cada oferta mes a mes y escribe los resultados en los arrays de
+    salida (mismos nombres que el dict de ``simular_lote``).
+
+    ``trayectoria`` (ofertas, meses) es el Euríbor en % por mes, o una
+    matriz de 0 columnas para usar ``r_var`` constante. ``acumulado`` y
+    ``descuentos`` con 0 columnas desactivan el coste acumulado y el coste
+    descontado. ``umbral_subida`` negativo desactiva ``mes_subida`` y
+    ``flujos`` con 0 conceptos desactiva los flujos por cubeta y mes.
+    """
+    n = principal.shape[0]
+    con_trayectoria = trayectoria.shape[1] > 0
+    con_acumulado = acumulado.shape[1] > 0
+    con_descuento = descuentos.shape[1] > 0
+    con_flujos = flujos.shape[0] > 0
+    for i in range(n):
+        saldo = principal[i]
+        r = r_fijo[i] if n_fijo[i] >= 1 else r_var[i]
+        cuota = _cuota(saldo, r, float(n_total[i]))
+        cuota_inicial[i] = cuota
+        cuota_variable[i] = cuota
+        tiene_var = n_fijo[i] < n_total[i]
+        total_int = 0.0
+        total_com = 0.0
+        total_bonis = 0.0
+        pagados = 0
+        mes_fin = 0
+        cuota_max = 0.0
+        subida = 0
+        for mes in range(1, n_meses + 1):
+            if not (saldo > 1e-8 and mes <= n_total[i]):
+                break
+            mes_fin = mes
+            restantes = float(n_total[i] - mes + 1)
+            saldo_inicio_mes = saldo
+            pagado_mes = 0.0
+            anticipada_mes = 0.0
+            comision_mes = coste_apertura[i] if mes == 1 else 0.0
+
+            # Tipo del mes y recálculo de cuota al entrar en variable (o en cada revisión)
+            en_var = mes > n_fijo[i]
+            recalc = tiene_var and mes == n_fijo[i] + 1
+            r_var_mes = r_var[i]
+            if con_trayectoria:
+                meses_var = mes - n_fijo[i] - 1
+                revision = n_fijo[i] + 12 * (max(meses_var, 0) // 12)
+                idx = min(revision, trayectoria.shape[1] - 1)
+                r_var_mes = (max(-5.0, trayectoria[i, idx]) / 100.0 + diff_eff[i]) / 12.0
+                if en_var and meses_var > 0 and meses_var % 12 == 0 and r_var_mes != r:
+                    recalc = True
+            r = r_var_mes if en_var else r_fijo[i]
+            if recalc:
+                cuota = _cuota(saldo, r, restantes)
+                if mes == n_fijo[i] + 1:
+                    cuota_variable[i] = cuota
+
+            # Amortizaciones parciales de este mes (antes de calcular intereses)
+            for j in range(ev_mes.shape[1]):
+                if ev_mes[i, j] != mes:
+                    continue
+                importe = min(ev_importe[i, j], saldo)
+                if importe <= 0:
+                    continue
+                total_com += importe * pct_amort[i]
+                pagado_mes += importe * (1 + pct_amort[i])
+                anticipada_mes += importe
+                comision_mes += importe * pct_amort[i]
+                saldo = max(saldo - importe, 0.0)
+                # En modo "Cuota" se recalcula la cuota y no se aplican más eventos ese mes
+                if ev_cuota[i, j]:
+                    cuota = _cuota(saldo, r, restantes)
+                    break
+
+            activo = saldo > 1e-8
+            interes = 0.0
+            capital = 0.0
+            if activo:
+                interes = saldo * r
+                capital = min(max(cuota - interes, 0.0), saldo)
+                pagados += 1
+                if cuota > cuota_max:
+                    cuota_max = cuota
+                if umbral_subida >= 0 and subida == 0 and cuota > cuota_inicial[i] * (1 + umbral_subida):
+                    subida = mes
+            total_int += interes
+            saldo = saldo - capital
+            pagado_mes += interes + capital
+            if (mes - 1) % 12 == 0 and activo:
+                bonis_mes = bonus_cost_anual[i] + pct_saldo[i] * saldo_inicio_mes
+                total_bonis += bonis_mes
+                pagado_mes += bonis_mes
+            if con_descuento:
+                for k in range(descuentos.shape[0]):
+                    coste_descontado[k, i] += descuentos[k, mes - 1] * pagado_mes
+            if con_acumulado:
+                acumulado[i, mes - 1] = coste_apertura[i] + total_int + total_com + total_bonis
+            if con_flujos:
+                columna = mes_inicio[i] + mes - 1
+                if 0 <= columna < flujos.shape[2]:
+                    b = cubeta[i]
+                    flujos[0, b, columna] += interes
+                    flujos[1, b, columna] += capital
+                    flujos[2, b, columna] += anticipada_mes
+                    flujos[3, b, columna] += comision_mes
+                    flujos[4, b, columna] += saldo
+
+        if con_acumulado:
+            final = coste_apertura[i] + total_int + total_com + total_bonis
+            for m in range(mes_fin, n_meses):
+                acumulado[i, m] = final
+        intereses[i] = total_int
+        com_amort[i] = total_com
+        coste_bonis[i] = total_bonis
+        meses_pagados[i] = pagados
+        cuota_maxima[i] = cuota_max
+        mes_subida[i] = subida
@@ -0,0 +1,352 @@
+# =============================
+# EVALUACIÓN EN PARALELO
+# =============================
+"""
+Pool de procesos persistente para evaluar ofertas en varios núcleos.
+
+El pool se crea una sola vez por proceso de Streamlit y se reutiliza entre
+ejecuciones del script. Los trabajos pequeños se calculan en el propio
+proceso, porque el coste de enviar las ofertas a otro proceso superaría al
+del cálculo.
+
+El Monte Carlo de Euríbor (``montecarlo_euribor``) deja las trayectorias en
+memoria compartida: cada proceso genera y evalúa sus bloques de caminos
+sobre el mismo buffer, sin recibir copias.
+"""
+import atexit
+import copy
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cache import cache_disco
+from cuantiles import CuantilesEnteros, CuantilesLog
+from motor import (
+    GRUPO_METODO, argumentos_oferta, combinar_resumenes, indexar_lote, normal_inversa, ranking_decidido,
+    resultados_por_camino, resumen_costes, simulate_offer, simular_lote, trayectorias_euribor,
+)
+
+# Meses simulados (contando cada amortización parcial como una pasada más)
+# por debajo de los cuales no compensa usar el pool.
+MIN_TRABAJO_POOL = 5000
+# Filas de un lote por debajo de las cuales no se reparte entre procesos.
+MIN_FILAS_POOL = 20000
+# Caminos por bloque del Monte Carlo: cada bloque tiene su propio flujo
+# aleatorio, así que el resultado no depende del número de procesos.
+BLOQUE_CAMINOS = 2048
+# Caminos por debajo de los cuales el Monte Carlo se hace en el propio proceso.
+MIN_CAMINOS_POOL = 8192
+# Bloques por ronda del Monte Carlo con parada anticipada (fijo, para que el
+# momento de parar no dependa del número de procesos) y unidades
+# independientes mínimas antes de fiarse del error estándar.
+BLOQUES_RONDA = 4
+MIN_UNIDADES_PARADA = 16
+# Subida de la cuota sobre la inicial (tanto por uno) a partir de la cual se anota el mes de la subida
+UMBRAL_SUBIDA_CUOTA = 0.2
+# Métricas por camino que se resumen en cuantiles (ver ``nuevos_cuantiles``)
+METRICAS_CUANTILES = ("intereses", "cuota_maxima", "mes_subida")
+
+_pool = None
+_pool_workers = 0
+_lock = threading.Lock()
+
+
+def num_workers_por_defecto():
+    """Procesos del pool: variable de entorno HIPOTECAS_WORKERS o número de CPUs."""
+    valor = os.environ.get("HIPOTECAS_WORKERS")
+    return max(1, int(valor)) if valor else (os.cpu_count() or 1)
+
+
+def obtener_pool(n_workers=None):
+    """Devuelve el pool persistente, recreándolo solo si cambia el número de procesos."""
+    global _pool, _pool_workers
+    n_workers = n_workers or num_workers_por_defecto()
+    with _lock:
+        if _pool is None or _pool_workers != n_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            # "spawn": el proceso de Streamlit tiene hilos y no es seguro hacer fork
+            _pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = n_workers
+        return _pool
+
+
+def cerrar_pool():
+    global _pool, _pool_workers
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+
+
+atexit.register(cerrar_pool)
+
+
+@cache_disco
+def _simulate_offer_cache(**kwargs):
+    # Función de módulo (no lambda) para que el pool pueda enviarla a los procesos
+    return simulate_offer(**kwargs)
+
+
+def trabajo_estimado(ofertas_cfg):
+    return sum(int(cfg["years"] * 12) * (1 + len(cfg.get("amortizaciones") or [])) for cfg in ofertas_cfg)
+
+
+def evaluar_ofertas(ofertas_cfg, n_workers=None, min_trabajo=MIN_TRABAJO_POOL, coste_mensual=False,
+                    descuentos=None, sensibilidades=False):
+    """
+    Generador de ``(indice, resultado de simulate_offer)`` en el orden de envío.
+    Los resultados pasan por la caché de disco compartida (``cache.py``).
+    ``coste_mensual``, ``descuentos`` y ``sensibilidades`` se pasan a
+    ``simulate_offer``.
+
+    Con trabajo suficiente y más de un proceso las ofertas se envían al pool
+    y cada resultado se entrega en cuanto está listo su turno, para poder ir
+    pintándolos; si no, se calculan una a una en el proceso actual.
+    """
+    opciones = {"coste_mensual": coste_mensual}
+    if descuentos is not None:
+        opciones["descuentos"] = descuentos
+    if sensibilidades:
+        opciones["sensibilidades"] = True
+    n_workers = n_workers or num_workers_por_defecto()
+    if n_workers <= 1 or len(ofertas_cfg) <= 1 or trabajo_estimado(ofertas_cfg) < min_trabajo:
+        for i, cfg in enumerate(ofertas_cfg):
+            yield i, _simulate_offer_cache(**argumentos_oferta(cfg), **opciones)
+        return
+
+    pool = obtener_pool(n_workers)
+    futuros = [
+        pool.submit(_simulate_offer_cache, **argumentos_oferta(cfg), **opciones)
+        for cfg in ofertas_cfg
+    ]
+    try:
+        for i, futuro in enumerate(futuros):
+            yield i, futuro.result()
+    finally:
+        # Si se interrumpe el consumo (p. ej. rerun de Streamlit) no dejamos trabajo pendiente
+        for futuro in futuros:
+            futuro.cancel()
+
+
+def simular_lote_paralelo(lote, n_workers=None, min_filas=MIN_FILAS_POOL, euribor_mensual=None, descuentos=None):
+    """
+    ``simular_lote`` repartiendo las filas del lote en bloques entre procesos.
+
+    Los resultados se concatenan en el orden original. Lotes pequeños se
+    simulan directamente en el proceso actual.
+    """
+    n_filas = lote["principal"].shape[0]
+    n_workers = n_workers or num_workers_por_defecto()
+    if n_workers <= 1 or n_filas < min_filas:
+        return simular_lote(lote, euribor_mensual=euribor_mensual, descuentos=descuentos)
+
+    por_fila = euribor_mensual is not None and np.ndim(euribor_mensual) == 2
+    pool = obtener_pool(n_workers)
+    futuros = [
+        pool.submit(
+            simular_lote, indexar_lote(lote, idx),
+            euribor_mensual=np.asarray(euribor_mensual)[idx] if por_fila else euribor_mensual,
+            descuentos=descuentos,
+        )
+        for idx in np.array_split(np.arange(n_filas), n_workers) if len(idx)
+    ]
+    partes = [f.result() for f in futuros]
+    return {k: np.concatenate([p[k] for p in partes]) for k in partes[0]}
+
+
+# =============================
+# MONTE CARLO DE EURÍBOR EN MEMORIA COMPARTIDA
+# =============================
+def bloques_caminos(n_caminos, tam_bloque=BLOQUE_CAMINOS):
+    """Tramos ``(inicio, fin)`` de caminos; solo dependen de ``n_caminos``."""
+    return [(i, min(i + tam_bloque, n_caminos)) for i in range(0, n_caminos, tam_bloque)]
+
+
+def _generar_en(trayectorias, semilla, bloque, inicio, fin, modelo, metodo):
+    # Flujo aleatorio propio de cada bloque: hijo ``bloque`` de SeedSequence(semilla)
+    rng = np.random.default_rng(np.random.SeedSequence(semilla, spawn_key=(bloque,)))
+    trayectorias_euribor(rng, fin - inicio, trayectorias.shape[1], metodo=metodo, out=trayectorias[inicio:fin], **modelo)
+
+
+def nuevos_cuantiles(n_ofertas, n_meses):
+    """
+    Resúmenes de cuantiles vacíos de las métricas por camino del Monte
+    Carlo: intereses totales y cuota máxima (error relativo 0,5 %) y mes de
+    la subida de cuota (exacto; 0 = la cuota no sube).
+    """
+    return {
+        "intereses": CuantilesLog(n_ofertas, minimo=1.0, maximo=1e8),
+        "cuota_maxima": CuantilesLog(n_ofertas, minimo=1.0, maximo=1e7),
+        "mes_subida": CuantilesEnteros(n_ofertas, n_meses),
+    }
+
+
+def _evaluar_en(trayectorias, lote, inicio, fin, agrupar, umbral_subida=None):
+    tramo = trayectorias[inicio:fin]
+    if umbral_subida is None:
+        por_camino = resultados_por_camino(lote, tramo)
+    else:
+        por_camino = resultados_por_camino(lote, tramo, ("total_coste",) + METRICAS_CUANTILES, umbral_subida)
+    resumen = resumen_costes(por_camino["total_coste"], agrupar)
+    resumen["suma_euribor"] = tramo.sum(axis=0)
+    if umbral_subida is not None:
+        # Cada camino se reduce a conteos: la memoria no crece con el número de caminos
+        resumen["cuantiles"] = {
+            k: c.añadir(por_camino[k])
+            for k, c in nuevos_cuantiles(lote["principal"].shape[0], trayectorias.shape[1]).items()
+        }
+    return resumen
+
+
+def _adjuntar(nombre, forma):
+    memoria = shared_memory.SharedMemory(name=nombre)
+    return memoria, np.ndarray(forma, dtype=np.float64, buffer=memoria.buf)
+
+
+def _generar_bloque(nombre, forma, semilla, bloque, inicio, fin, modelo, metodo):
+    memoria, trayectorias = _adjuntar(nombre, forma)
+    try:
+        _generar_en(trayectorias, semilla, bloque, inicio, fin, modelo, metodo)
+    finally:
+        del trayectorias
+        memoria.close()
+
+
+def _evaluar_bloque(nombre, forma, lote, inicio, fin, agrupar, umbral_subida):
+    memoria, trayectorias = _adjuntar(nombre, forma)
+    try:
+        return _evaluar_en(trayectorias, lote, inicio, fin, agrupar, umbral_subida)
+    finally:
+        del trayectorias
+        memoria.close()
+
+
+def montecarlo_progresivo(lote, n_caminos, modelo, semilla=0, metodo="aleatorio", bloques_por_ronda=BLOQUES_RONDA,
+                          cuantiles=False, umbral_subida=UMBRAL_SUBIDA_CUOTA, n_workers=None,
+                          min_caminos=MIN_CAMINOS_POOL):
+    """
+    Generador del Monte Carlo de Euríbor por rondas: tras cada ronda de
+    ``bloques_por_ronda`` bloques produce el resultado
+    acumulado hasta ese momento, con lo mismo que ``montecarlo_euribor``
+    (``motor.combinar_resumenes`` más ``euribor_medio``). Con ``cuantiles``
+    incluye también ``cuantiles``: los resúmenes de ``nuevos_cuantiles``
+    (intereses, cuota máxima y primer mes en que la cuota supera en
+    ``umbral_subida`` a la inicial) de todos los caminos hasta esa ronda.
+    Ocupan lo mismo con mil caminos que con decenas de millones y se
+    combinan de forma exacta entre bloques y procesos.
+
+    ``modelo`` son los argumentos de ``motor.generar_euribor`` salvo ``rng``
+    y ``metodo`` el de ``motor.trayectorias_euribor``; ``n_caminos`` se
+    redondea al alza a múltiplo de su grupo y es el máximo a simular.
+
+    Las trayectorias de cada ronda se generan en memoria compartida: el pool
+    genera cada bloque de ``BLOQUE_CAMINOS`` con su propio flujo aleatorio
+    y después evalúa los bloques leyendo del mismo buffer. El buffer es de
+    una ronda y se reutiliza en todas, así que la memoria no crece con
+    ``n_caminos``. Los resúmenes se
+    combinan en orden de bloque, así que con la misma ``semilla`` cada
+    ronda da lo mismo con cualquier número de procesos, también sin pool
+    para pocos caminos.
+
+    Quien itera decide cuándo parar: al cerrar el generador (``close()``,
+    ``break`` o una excepción en el bucle que lo consume) se cancelan los
+    bloques pendientes y se libera la memoria compartida.
+    """
+    if int(n_caminos) <= 0:
+        raise ValueError(f"El número de caminos debe ser positivo (recibido: {n_caminos})")
+    agrupar = GRUPO_METODO[metodo]
+    n_caminos = -(-int(n_caminos) // agrupar) * agrupar
+    n_meses = max(int(lote["n_total"].max(initial=0)), 1)
+    bloques = bloques_caminos(n_caminos)
+    por_ronda = max(int(bloques_por_ronda), 1)
+    forma = (min(por_ronda * BLOQUE_CAMINOS, n_caminos), n_meses)
+    n_workers = n_workers or num_workers_por_defecto()
+    usar_pool = n_workers > 1 and n_caminos >= min_caminos
+
+    if usar_pool:
+        pool = obtener_pool(n_workers)
+        memoria = shared_memory.SharedMemory(create=True, size=8 * forma[0] * forma[1])
+    else:
+        trayectorias = np.empty(forma)
+    umbral_subida = umbral_subida if cuantiles else None
+    acumulados = nuevos_cuantiles(lote["principal"].shape[0], n_meses) if cuantiles else None
+    resumenes, futuros = [], []
+    try:
+        for r0 in range(0, len(bloques), por_ronda):
+            # Bloques de la ronda con su posición dentro del buffer
+            ronda = [(b, inicio - bloques[r0][0], fin - bloques[r0][0])
+                     for b, (inicio, fin) in enumerate(bloques[r0:r0 + por_ronda], start=r0)]
+            if usar_pool:
+                futuros = [pool.submit(_generar_bloque, memoria.name, forma, semilla, b, inicio, fin, modelo, metodo)
+                           for b, inicio, fin in ronda]
+                for futuro in futuros:
+                    futuro.result()
+                futuros = [pool.submit(_evaluar_bloque, memoria.name, forma, lote, inicio, fin, agrupar, umbral_subida)
+                           for _, inicio, fin in ronda]
+                nuevos = [futuro.result() for futuro in futuros]
+            else:
+                for b, inicio, fin in ronda:
+                    _generar_en(trayectorias, semilla, b, inicio, fin, modelo, metodo)
+                nuevos = [_evaluar_en(trayectorias, lote, inicio, fin, agrupar, umbral_subida) for _, inicio, fin in ronda]
+            if cuantiles:
+                for r in nuevos:
+                    for k, c in r.pop("cuantiles").items():
+                        acumulados[k].combinar(c)
+            resumenes += nuevos
+
+            res = combinar_resumenes(resumenes)
+            res["euribor_medio"] = np.sum([r["suma_euribor"] for r in resumenes], axis=0) / res["n_caminos"]
+            if cuantiles:
+                res["cuantiles"] = copy.deepcopy(acumulados)
+            yield res
+    finally:
+        if usar_pool:
+            for futuro in futuros:
+                futuro.cancel()
+            memoria.close()
+            memoria.unlink()
+
+
+def montecarlo_euribor(lote, n_caminos, modelo, semilla=0, metodo="aleatorio", confianza=None, solo_mejor=False,
+                       n_workers=None, min_caminos=MIN_CAMINOS_POOL):
+    """
+    Coste de cada oferta del lote bajo ``n_caminos`` trayectorias aleatorias
+    de Euríbor (``modelo``: argumentos de ``motor.generar_euribor`` salvo
+    ``rng``, p. ej. ``{"inicial": 2.5, "media": 2.5, "reversion": 0.3,
+    "volatilidad": 1.0}``). Todas las ofertas se valoran sobre los mismos
+    caminos, así que las diferencias entre ellas tienen mucho menos error
+    que cada coste por separado.
+
+    ``metodo`` es el de ``motor.trayectorias_euribor`` ("aleatorio",
+    "antitetico" o "sobol"); ``n_caminos`` se redondea al alza a múltiplo
+    de su grupo. Los caminos se simulan por rondas de ``BLOQUES_RONDA``
+    bloques y, con ``confianza`` (p. ej. 0.95), se para en cuanto el
+    ranking está decidido (``motor.ranking_decidido``; con ``solo_mejor``,
+    solo la más barata), sin pasar de ``n_caminos``. El reparto entre procesos es el de
+    ``montecarlo_progresivo``: el resultado y el momento de parar no
+    dependen del número de procesos.
+
+    Devuelve lo de ``motor.combinar_resumenes`` (arrays por oferta) más
+    ``euribor_medio`` por mes y, con ``confianza``, ``ranking_decidido``.
+    """
+    z = None if confianza is None else float(normal_inversa(0.5 + confianza / 2))
+    progreso = montecarlo_progresivo(lote, n_caminos, modelo, semilla, metodo, BLOQUES_RONDA,
+                                     n_workers=n_workers, min_caminos=min_caminos)
+    decidido = False
+    try:
+        for res in progreso:
+            if z is not None and res["n_unidades"] >= MIN_UNIDADES_PARADA and ranking_decidido(
+                    res["media"], res["error_diferencias"], z, solo_mejor):
+                decidido = True
+                break
+    finally:
+        progreso.close()
+    if z is not None:
+        res["ranking_decidido"] = decidido
+    return res
@@ -0,0 +1,429 @@
+# =============================
+# SERVICIO HTTP DE CÁLCULO
+# =============================
+"""
+Servicio HTTP local (JSON) con los cálculos de la app, sin Streamlit.
+
+Rutas:
+  POST /fija    {"principal", "years", "interest", "cuadro"?}
+  POST /mixta   {"principal", "years_fixed", "years_total", "tipo_fijo", "euribor", "diferencial", "cuadro"?}
+  POST /oferta  una oferta con las claves de ``ofertas_cfg`` del comparador y
+                "sensibilidades"? (con true la respuesta incluye las ``sens_*``
+                de ``simular_lote``)
+  GET  /metricas  throughput, latencias y tamaño medio de lote
+  GET  /salud
+
+Las peticiones concurrentes a una misma ruta que llegan dentro de una
+ventana de unos milisegundos se agrupan en un único cálculo vectorizado
+(micro-lotes). Solo usa la biblioteca estándar y el motor de la app.
+
+Uso:
+  python servicio.py servir --puerto 8502 --ventana-ms 5
+  python servicio.py carga --ruta oferta --peticiones 5000 --concurrencia 64
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from motor import cuadro_anual, hipoteca_cerrada, lote_ofertas, simular_lote
+
+TIMEOUT_S = 30
+
+
+# ---------- Validación de entradas ----------
+def _numero(payload, campo, minimo, maximo, entero=False):
+    if campo not in payload:
+        raise ValueError(f"falta '{campo}'")
+    try:
+        valor = float(payload[campo])
+    except (TypeError, ValueError):
+        raise ValueError(f"'{campo}' debe ser numérico")
+    if not minimo <= valor <= maximo:
+        raise ValueError(f"'{campo}' fuera de rango [{minimo}, {maximo}]")
+    if entero and valor != int(valor):
+        raise ValueError(f"'{campo}' debe ser entero")
+    return int(valor) if entero else valor
+
+
+def _booleano(payload, campo):
+    valor = payload.get(campo, False)
+    if not isinstance(valor, bool):
+        raise ValueError(f"'{campo}' debe ser true o false")
+    return valor
+
+
+def _entrada_fija(payload):
+    return {
+        "principal": _numero(payload, "principal", 1000.0, 1_000_000.0),
+        "years": _numero(payload, "years", 1, 40, entero=True),
+        "interest": _numero(payload, "interest", -2.0, 20.0),
+        "cuadro": _booleano(payload, "cuadro"),
+    }
+
+
+def _entrada_mixta(payload):
+    entrada = {
+        "principal": _numero(payload, "principal", 1000.0, 1_000_000.0),
+        "years_fixed": _numero(payload, "years_fixed", 1, 40, entero=True),
+        "years_total": _numero(payload, "years_total", 1, 40, entero=True),
+        "tipo_fijo": _numero(payload, "tipo_fijo", -2.0, 20.0),
+        "euribor": _numero(payload, "euribor", -3.0, 10.0),
+        "diferencial": _numero(payload, "diferencial", 0.0, 5.0),
+        "cuadro": _booleano(payload, "cuadro"),
+    }
+    if entrada["years_total"] < entrada["years_fixed"]:
+        raise ValueError("'years_total' no puede ser menor que 'years_fixed'")
+    return entrada
+
+
+def _entrada_oferta(payload):
+    tipo = payload.get("tipo")
+    if tipo not in ("Fija", "Mixta"):
+        raise ValueError("'tipo' debe ser 'Fija' o 'Mixta'")
+    # Solo los campos validados: los que no aplican al tipo no llegan al lote
+    cfg = {"tipo": tipo}
+    if "nombre" in payload:
+        cfg["nombre"] = str(payload["nombre"])
+    cfg["principal"] = _numero(payload, "principal", 1000.0, 1_000_000.0)
+    cfg["years"] = _numero(payload, "years", 1, 40, entero=True)
+    if tipo == "Fija":
+        cfg["tin_fija"] = _numero(payload, "tin_fija", 0.0, 20.0)
+    else:
+        cfg["years_fixed"] = _numero(payload, "years_fixed", 1, cfg["years"], entero=True)
+        cfg["tin_fijo_mixta"] = _numero(payload, "tin_fijo_mixta", 0.0, 20.0)
+        cfg["euribor"] = _numero(payload, "euribor", -2.0, 10.0)
+        cfg["diferencial"] = _numero(payload, "diferencial", 0.0, 5.0)
+    for campo in ("bonus_pp", "bonus_cost_anual", "bonus_pct_saldo", "com_apertura_pct", "com_apertura_fija",
+                  "com_amort_parcial_pct"):
+        cfg[campo] = _numero(payload, campo, 0.0, 1e9) if campo in payload else 0.0
+    amortizaciones = payload.get("amortizaciones") or []
+    if not isinstance(amortizaciones, list):
+        raise ValueError("'amortizaciones' debe ser una lista")
+    cfg["sensibilidades"] = _booleano(payload, "sensibilidades")
+    cfg["amortizaciones"] = []
+    for ev in amortizaciones:
+        if not isinstance(ev, dict) or ev.get("modo", "Plazo") not in ("Plazo", "Cuota"):
+            raise ValueError("cada amortización es {anio, importe, modo: Plazo|Cuota}")
+        cfg["amortizaciones"].append({
+            "anio": _numero(ev, "anio", 1, cfg["years"], entero=True),
+            "importe": _numero(ev, "importe", 0.0, 1e9),
+            "modo": ev.get("modo", "Plazo"),
+        })
+    return cfg
+
+
+# ---------- Cálculos por lote ----------
+def _con_cuadro(salidas, entradas, principal, n_fijo, n_total, r_fijo, r_var):
+    idx = [i for i, e in enumerate(entradas) if e["cuadro"]]
+    if idx:
+        cuadros = cuadro_anual(principal[idx], n_fijo[idx], n_total[idx], r_fijo[idx], r_var[idx])
+        for fila, i in enumerate(idx):
+            anios = int(n_total[i] // 12)
+            salidas[i]["cuadro"] = [
+                {col: (int(v[k]) if col == "Año" else float(v[fila, k])) for col, v in cuadros.items()}
+                for k in range(anios)
+            ]
+    return salidas
+
+
+def calcular_fijas(entradas):
+    principal = np.array([e["principal"] for e in entradas])
+    n = np.array([e["years"] * 12 for e in entradas])
+    r = np.array([e["interest"] for e in entradas]) / 100 / 12
+    res = hipoteca_cerrada(principal, n, n, r, r)
+    salidas = [
+        {"cuota": float(res["cuota_fija"][i]), "intereses_totales": float(res["intereses"][i])}
+        for i in range(len(entradas))
+    ]
+    return _con_cuadro(salidas, entradas, principal, n, n, r, r)
+
+
+def calcular_mixtas(entradas):
+    principal = np.array([e["principal"] for e in entradas])
+    n_fijo = np.array([e["years_fixed"] * 12 for e in entradas])
+    n_total = np.array([e["years_total"] * 12 for e in entradas])
+    r_fijo = np.array([e["tipo_fijo"] for e in entradas]) / 100 / 12
+    r_var = np.array([e["euribor"] + e["diferencial"] for e in entradas]) / 100 / 12
+    res = hipoteca_cerrada(principal, n_fijo, n_total, r_fijo, r_var)
+    salidas = [
+        {
+            "cuota_fija": float(res["cuota_fija"][i]),
+            "cuota_variable": float(res["cuota_variable"][i]),
+            "intereses_totales": float(res["intereses"][i]),
+        }
+        for i in range(len(entradas))
+    ]
+    return _con_cuadro(salidas, entradas, principal, n_fijo, n_total, r_fijo, r_var)
+
+
+def calcular_ofertas(entradas):
+    # Las sensibilidades obligan al bucle de NumPy: solo si alguna petición del lote las pide
+    con_sens = any(e["sensibilidades"] for e in entradas)
+    res = simular_lote(lote_ofertas(entradas), sensibilidades=con_sens)
+    return [
+        {k: (int(v[i]) if k == "meses_pagados" else float(v[i]))
+         for k, v in res.items() if e["sensibilidades"] or not k.startswith("sens_")}
+        for i, e in enumerate(entradas)
+    ]
+
+
+RUTAS = {
+    "/fija": (_entrada_fija, calcular_fijas),
+    "/mixta": (_entrada_mixta, calcular_mixtas),
+    "/oferta": (_entrada_oferta, calcular_ofertas),
+}
+
+
+# ---------- Métricas ----------
+class Metricas:
+    """Contadores, latencias recientes y tamaños de lote, seguros entre hilos."""
+
+    def __init__(self, max_muestras=20000):
+        self._lock = threading.Lock()
+        self.inicio = time.monotonic()
+        self.peticiones = {}
+        self.errores = {}
+        self.lotes = {}
+        self._latencias = deque(maxlen=max_muestras)
+
+    def peticion(self, ruta, latencia_s, ok):
+        with self._lock:
+            self.peticiones[ruta] = self.peticiones.get(ruta, 0) + 1
+            if not ok:
+                self.errores[ruta] = self.errores.get(ruta, 0) + 1
+            self._latencias.append((time.monotonic(), ruta, latencia_s))
+
+    def lote(self, ruta, tamano):
+        with self._lock:
+            n, total, maximo = self.lotes.get(ruta, (0, 0, 0))
+            self.lotes[ruta] = (n + 1, total + tamano, max(maximo, tamano))
+
+    def resumen(self):
+        with self._lock:
+            ahora = time.monotonic()
+            muestras = list(self._latencias)
+            rutas = {}
+            for ruta, total in self.peticiones.items():
+                lat = np.array([l for _, r, l in muestras if r == ruta]) * 1000
+                n_lotes, items, maximo = self.lotes.get(ruta, (0, 0, 0))
+                rutas[ruta] = {
+                    "peticiones": total,
+                    "errores": self.errores.get(ruta, 0),
+                    "latencia_ms": {
+                        p: float(np.percentile(lat, q)) if lat.size else None
+                        for p, q in (("p50", 50), ("p95", 95), ("p99", 99))
+                    },
+                    "lotes": n_lotes,
+                    "tamano_medio_lote": items / n_lotes if n_lotes else None,
+                    "tamano_max_lote": maximo,
+                }
+            uptime = ahora - self.inicio
+            recientes = sum(1 for t, _, _ in muestras if ahora - t <= 60)
+            return {
+                "uptime_s": uptime,
+                "peticiones": sum(self.peticiones.values()),
+                "peticiones_por_s": sum(self.peticiones.values()) / uptime if uptime else 0.0,
+                "peticiones_por_s_ultimo_minuto": recientes / min(60.0, uptime) if uptime else 0.0,
+                "rutas": rutas,
+            }
+
+
+# ---------- Micro-lotes ----------
+class MicroLotes:
+    """
+    Agrupa las entradas que llegan en ``ventana_s`` (o hasta ``max_lote``) y
+    las calcula con una sola llamada a ``funcion(lista_de_entradas)``.
+    """
+
+    def __init__(self, ruta, funcion, metricas, ventana_s=0.005, max_lote=1024):
+        self.ruta = ruta
+        self.funcion = funcion
+        self.metricas = metricas
+        self.ventana_s = ventana_s
+        self.max_lote = max_lote
+        self._cola = queue.Queue()
+        threading.Thread(target=self._bucle, name=f"lotes{ruta}", daemon=True).start()
+
+    def enviar(self, entrada):
+        futuro = Future()
+        self._cola.put((entrada, futuro))
+        return futuro
+
+    def _bucle(self):
+        while True:
+            lote = [self._cola.get()]
+            limite = time.monotonic() + self.ventana_s
+            while len(lote) < self.max_lote:
+                resto = limite - time.monotonic()
+                if resto <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=resto))
+                except queue.Empty:
+                    break
+            try:
+                salidas = self.funcion([entrada for entrada, _ in lote])
+            except Exception:
+                # Si falla el lote se calcula cada entrada por separado: el error
+                # solo llega a la petición que lo provoca, no a las demás del lote
+                for entrada, futuro in lote:
+                    try:
+                        salida = self.funcion([entrada])[0]
+                    except Exception as e:
+                        futuro.set_exception(e)
+                        continue
+                    self.metricas.lote(self.ruta, 1)
+                    futuro.set_result(salida)
+                continue
+            self.metricas.lote(self.ruta, len(lote))
+            for (_, futuro), salida in zip(lote, salidas):
+                futuro.set_result(salida)
+
+
+# ---------- Servidor ----------
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+    # Cola de conexiones amplia: con la de por defecto (5) una ráfaga de clientes concurrentes recibe resets
+    request_queue_size = 1024
+
+
+def crear_servidor(host="127.0.0.1", puerto=8502, ventana_ms=5.0, max_lote=1024):
+    metricas = Metricas()
+    lotes = {
+        ruta: MicroLotes(ruta, funcion, metricas, ventana_s=ventana_ms / 1000, max_lote=max_lote)
+        for ruta, (_, funcion) in RUTAS.items()
+    }
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, codigo, cuerpo):
+            datos = json.dumps(cuerpo).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            if self.path == "/metricas":
+                self._responder(200, metricas.resumen())
+            elif self.path == "/salud":
+                self._responder(200, {"ok": True})
+            else:
+                self._responder(404, {"error": "ruta no encontrada"})
+
+        def do_POST(self):
+            t0 = time.perf_counter()
+            if self.path not in RUTAS:
+                self._responder(404, {"error": "ruta no encontrada"})
+                return
+            validar, _ = RUTAS[self.path]
+            try:
+                longitud = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(longitud) or b"{}")
+                elementos = payload if isinstance(payload, list) else [payload]
+                if not all(isinstance(p, dict) for p in elementos):
+                    raise ValueError("cada petición debe ser un objeto JSON")
+                entradas = [validar(p) for p in elementos]
+            except (ValueError, TypeError) as e:
+                metricas.peticion(self.path, time.perf_counter() - t0, ok=False)
+                self._responder(400, {"error": str(e)})
+                return
+
+            futuros = [lotes[self.path].enviar(e) for e in entradas]
+            try:
+                salidas = [f.result(timeout=TIMEOUT_S) for f in futuros]
+            except Exception as e:
+                metricas.peticion(self.path, time.perf_counter() - t0, ok=False)
+                self._responder(500, {"error": str(e)})
+                return
+            metricas.peticion(self.path, time.perf_counter() - t0, ok=True)
+            self._responder(200, salidas if isinstance(payload, list) else salidas[0])
+
+    servidor = _Servidor((host, puerto), Manejador)
+    servidor.metricas = metricas
+    return servidor
+
+
+# ---------- Prueba de carga ----------
+EJEMPLOS = {
+    "fija": {"principal": 150000, "years": 25, "interest": 3.0},
+    "mixta": {"principal": 150000, "years_fixed": 10, "years_total": 25, "tipo_fijo": 2.2, "euribor": 2.5, "diferencial": 0.8},
+    "oferta": {
+        "tipo": "Mixta", "principal": 150000, "years": 25, "years_fixed": 10, "tin_fijo_mixta": 2.2,
+        "euribor": 2.5, "diferencial": 0.8, "bonus_pp": 0.3, "bonus_cost_anual": 400,
+        "amortizaciones": [{"anio": 5, "importe": 10000, "modo": "Plazo"}],
+    },
+}
+
+
+def prueba_carga(url, ruta="oferta", peticiones=2000, concurrencia=32):
+    """Lanza peticiones concurrentes contra el servicio y mide latencias y throughput."""
+    cuerpo = json.dumps(EJEMPLOS[ruta]).encode("utf-8")
+
+    def una(i):
+        t0 = time.perf_counter()
+        req = urllib.request.Request(f"{url}/{ruta}", data=cuerpo, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=TIMEOUT_S) as resp:
+            resp.read()
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ex:
+        latencias = np.array(list(ex.map(una, range(peticiones)))) * 1000
+    total = time.perf_counter() - t0
+    with urllib.request.urlopen(f"{url}/metricas", timeout=TIMEOUT_S) as resp:
+        servidor = json.loads(resp.read())
+    return {
+        "peticiones": peticiones,
+        "segundos": total,
+        "peticiones_por_s": peticiones / total,
+        "latencia_ms": {p: float(np.percentile(latencias, q)) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+        "servidor": servidor["rutas"].get(f"/{ruta}"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de cálculo de hipotecas")
+    sub = parser.add_subparsers(dest="orden")
+    p_servir = sub.add_parser("servir", help="arranca el servicio (por defecto)")
+    p_servir.add_argument("--host", default="127.0.0.1")
+    p_servir.add_argument("--puerto", type=int, default=8502)
+    p_servir.add_argument("--ventana-ms", type=float, default=5.0, help="espera máxima para agrupar peticiones")
+    p_servir.add_argument("--max-lote", type=int, default=1024)
+    p_carga = sub.add_parser("carga", help="prueba de carga contra un servicio en marcha")
+    p_carga.add_argument("--url", default="http://127.0.0.1:8502")
+    p_carga.add_argument("--ruta", choices=sorted(EJEMPLOS), default="oferta")
+    p_carga.add_argument("--peticiones", type=int, default=2000)
+    p_carga.add_argument("--concurrencia", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.orden == "carga":
+        print(json.dumps(prueba_carga(args.url, args.ruta, args.peticiones, args.concurrencia), indent=2))
+        return
+    host = getattr(args, "host", "127.0.0.1")
+    puerto = getattr(args, "puerto", 8502)
+    servidor = crear_servidor(host, puerto, getattr(args, "ventana_ms", 5.0), getattr(args, "max_lote", 1024))
+    print(f"Servicio de cálculo en http://{host}:{puerto} (Ctrl+C para parar)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
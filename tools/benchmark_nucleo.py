@@ -0,0 +1,94 @@
+# =============================
+# BENCHMARK DEL NÚCLEO COMPILADO
+# =============================
+"""
+Compara el bucle mensual de NumPy con el compilado (``nucleo.py``) sobre un
+lote sintético de ofertas fijas y mixtas con amortizaciones parciales y
+bonificaciones.
+
+    python -m tools.benchmark_nucleo --ofertas 100000 --repeticiones 3
+"""
+import argparse
+import time
+
+import numpy as np
+
+from motor import matrices_eventos, simular_lote
+from nucleo import HAY_JIT
+
+
+def lote_sintetico(n, semilla=0):
+    """Lote columnar aleatorio con la misma forma que ``motor.lote_ofertas``."""
+    rng = np.random.default_rng(semilla)
+    mixta = rng.random(n) < 0.5
+    n_total = rng.integers(10, 41, n) * 12
+    n_fijo = np.where(mixta, np.minimum(rng.integers(1, 16, n) * 12, n_total), n_total)
+    amortizaciones = [
+        [{"anio": int(rng.integers(1, n_total[i] // 12 + 1)), "importe": float(rng.choice([5000, 20000])),
+          "modo": "Cuota" if rng.random() < 0.5 else "Plazo"}
+         for _ in range(int(rng.integers(0, 3)))]
+        for i in range(n)
+    ]
+    lote = {
+        "nombre": np.array([f"Oferta {i+1}" for i in range(n)], dtype=object),
+        "mixta": mixta,
+        "principal": rng.uniform(50_000, 500_000, n).round(-3),
+        "n_total": n_total.astype(np.int64),
+        "n_fijo": n_fijo.astype(np.int64),
+        "tin_fijo": np.where(mixta, rng.uniform(1.5, 3.0, n), rng.uniform(2.0, 4.0, n)).round(2),
+        "euribor": np.where(mixta, rng.uniform(0.0, 4.0, n), 0.0).round(2),
+        "diferencial": np.where(mixta, rng.uniform(0.5, 1.5, n), 0.0).round(2),
+        "bonus_pp": rng.choice([0.0, 0.2, 0.5], n),
+        "bonus_cost_anual": rng.choice([0.0, 300.0, 600.0], n),
+        "bonus_pct_saldo": rng.choice([0.0, 0.2], n),
+        "com_apertura_pct": rng.choice([0.0, 0.5], n),
+        "com_apertura_fija": np.zeros(n),
+        "com_amort_parcial_pct": rng.choice([0.0, 1.0], n),
+    }
+    lote.update(matrices_eventos(amortizaciones))
+    return lote
+
+
+def medir(lote, repeticiones, **kwargs):
+    """Mejor tiempo de ``repeticiones`` llamadas a ``simular_lote`` y su resultado."""
+    mejor = np.inf
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        res = simular_lote(lote, **kwargs)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del bucle mensual: NumPy frente a numba")
+    parser.add_argument("--ofertas", type=int, default=100_000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--coste-mensual", action="store_true", help="incluye la curva de coste acumulado")
+    args = parser.parse_args()
+
+    if not HAY_JIT:
+        print("numba no está instalado (o HIPOTECAS_JIT=0): solo se mide el bucle de NumPy.")
+    print(f"Generando {args.ofertas:,} ofertas…")
+    lote = lote_sintetico(args.ofertas)
+
+    t_numpy, res_numpy = medir(lote, args.repeticiones, compilado=False, coste_mensual=args.coste_mensual)
+    print(f"NumPy:     {t_numpy:8.3f} s")
+    if not HAY_JIT:
+        return
+
+    # La primera llamada compila o carga la compilación guardada en disco
+    t0 = time.perf_counter()
+    simular_lote(lote_sintetico(2), compilado=True)
+    print(f"Arranque:  {time.perf_counter() - t0:8.3f} s (compilación o carga desde caché)")
+    t_jit, res_jit = medir(lote, args.repeticiones, compilado=True, coste_mensual=args.coste_mensual)
+    print(f"Compilado: {t_jit:8.3f} s  ({t_numpy / t_jit:.1f}x)")
+
+    diferencia = max(
+        float(np.max(np.abs(res_numpy[k] - res_jit[k]) / np.maximum(1.0, np.abs(res_numpy[k]))))
+        for k in res_numpy
+    )
+    print(f"Diferencia relativa máxima entre ambos: {diferencia:.1e}")
+
+
+if __name__ == "__main__":
+    main()